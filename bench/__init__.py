@@ -0,0 +1 @@
+"""benchmarks and load tools for wormnet"""
@@ -0,0 +1,190 @@
+"""!host/!close throughput benchmark for hostingbuddy
+
+runs the real bot loop in a thread against a fake irc server and a fake
+Game.asp that answers after a fixed delay. every simulated user sends
+`--rounds` pairs of !host/!close as private messages in one burst, while the
+fake server keeps sending PINGs so we can see whether the bot stays
+responsive under load.
+
+    python -m bench.buddy --users 50 --rounds 4 --latency 0.05 --workers 8
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import hostingbuddy
+
+from .loadgen import summarize
+
+
+class FakeAPI(ThreadingHTTPServer):
+    """Game.asp stand-in with a fixed response delay, counts tcp connections"""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.next_id = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeAPIHandler)
+
+    def get_request(self):
+        conn = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return conn
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            server.next_id += 1
+            game_id = server.next_id
+        self.send_response(200)
+        if query.get("Cmd") == ["Create"]:
+            self.send_header("SetGameId", f": {game_id}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeIRC:
+    """accepts the bot, plays users issuing commands, times the replies"""
+
+    def __init__(self, users, rounds, ping_interval):
+        self.users = users
+        self.rounds = rounds
+        self.ping_interval = ping_interval
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        # nick -> [send time of each command, in order]
+        self.sent = {f"u{i}": [] for i in range(users)}
+        self.latencies = []
+        self.pongs = []
+        self.errors = 0
+        self.done = threading.Event()
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        self.listener.close()
+        reader = threading.Thread(target=self.read_replies, args=(conn,), daemon=True)
+        reader.start()
+
+        self.start = time.perf_counter()
+        burst = []
+        for _ in range(self.rounds):
+            for cmd in ("host", "close"):
+                for nick in self.sent:
+                    burst.append((nick, cmd))
+        for nick, cmd in burst:
+            self.sent[nick].append(time.perf_counter())
+            line = f":{nick}!{nick}@10.0.0.1 PRIVMSG HostingBuddy :!{cmd}\r\n"
+            conn.sendall(line.encode())
+
+        while not self.done.wait(self.ping_interval):
+            conn.sendall(f"PING :{time.perf_counter():.6f}\r\n".encode())
+        self.elapsed = self.finished - self.start
+        # the bot sees eof and hangs up, which ends the reader
+        conn.shutdown(socket.SHUT_WR)
+        reader.join()
+        conn.close()
+
+    def read_replies(self, conn):
+        expected = self.users * self.rounds * 2
+        answered = {nick: 0 for nick in self.sent}
+        received = 0
+        buf = b""
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            buf += data
+            *lines, buf = buf.split(b"\r\n")
+            for raw in lines:
+                now = time.perf_counter()
+                line = raw.decode()
+                if line.startswith("PONG :"):
+                    self.pongs.append(now - float(line[6:]))
+                    continue
+                parts = line.split(" ", 3)
+                if len(parts) < 4 or parts[0] != "PRIVMSG":
+                    continue
+                nick = parts[1]
+                if "Game created" not in parts[3] and "Game closed" not in parts[3]:
+                    self.errors += 1
+                self.latencies.append(now - self.sent[nick][answered[nick]])
+                answered[nick] += 1
+                received += 1
+                if received == expected:
+                    self.finished = now
+                    self.done.set()
+
+
+def run(users, rounds, latency, workers, ping_interval=0.01):
+    api = FakeAPI(latency)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    irc = FakeIRC(users, rounds, ping_interval)
+    bot = threading.Thread(
+        target=hostingbuddy.run_bot,
+        kwargs={
+            "port": irc.port,
+            "channels": [],
+            "http_base": f"http://127.0.0.1:{api.server_address[1]}",
+            "workers": workers,
+        },
+        daemon=True,
+    )
+    bot.start()
+    irc.run()
+    bot.join()
+    api.shutdown()
+
+    commands = users * rounds * 2
+    return {
+        "commands": commands,
+        "seconds": round(irc.elapsed, 3),
+        "commands_per_sec": round(commands / irc.elapsed, 1),
+        "command_latency_ms": summarize(irc.latencies),
+        "pong_latency_ms": summarize(irc.pongs),
+        "http_connections": api.connections,
+        "errors": irc.errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=4, help="!host/!close pairs")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Game.asp response delay"
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    opts = parser.parse_args(argv)
+
+    report = {}
+    for workers in opts.workers:
+        report[f"workers={workers}"] = run(
+            opts.users, opts.rounds, opts.latency, workers
+        )
+    print(json.dumps(report, indent=2))
+    return 0 if not any(r["errors"] for r in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""message latency across federated nodes
+
+starts --nodes wormnet.py processes linked in a full mesh, puts --clients
+users on each one in a shared channel and has them chat. every receiver
+timestamps what it gets, so latency is reported separately for messages
+from a user on the same node and from one on another node (one link hop).
+
+    python -m bench.federation --nodes 3 --clients 50 --messages 20
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from . import harness
+from .loadgen import raise_fd_limit, summarize
+
+CHANNEL = "#AnythingGoes"
+
+
+def start_nodes(count):
+    ports = [harness.free_port() for _ in range(count)]
+    nodes = []
+    for i, port in enumerate(ports):
+        peers = ", ".join(f'"127.0.0.1:{p}"' for p in ports[:i])
+        nodes.append(
+            harness.start_subprocess(
+                extra_config=(
+                    "[overload]\nenabled = false\n\n"
+                    f'[federation]\nenabled = true\nname = "node{i}"\n'
+                    f'node_id = {i + 1}\nport = {port}\npassword = "bench"\n'
+                    f"peers = [{peers}]\nreconnect = 0.2\n"
+                ),
+                irc_config="max_clients = 0\naccept_rate = 0\nmax_per_ip = 0\n",
+            )
+        )
+    return nodes
+
+
+class User:
+    def __init__(self, node, index, server, samples):
+        self.node = node
+        self.nick = f"n{node}u{index}"
+        self.server = server
+        self.samples = samples
+        self.names = set()
+        self.names_done = asyncio.Event()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.server.host, self.server.irc_port
+        )
+        self.writer.write(
+            f"PASS ELSILRACLIHP\r\nNICK {self.nick}\r\n"
+            f"USER {self.nick} h s :0 11 US 3.8.1\r\nJOIN {CHANNEL}\r\n".encode()
+        )
+        await self.read_until(" 366 ")
+        self.task = asyncio.ensure_future(self.read_loop())
+
+    async def read_until(self, marker):
+        while True:
+            line = (await self.reader.readline()).decode()
+            if not line:
+                raise ConnectionError(f"{self.nick}: closed")
+            if " 353 " in line:
+                self.names.update(line.rsplit(":", 1)[1].split())
+            if marker in line:
+                return
+
+    async def read_loop(self):
+        while line := await self.reader.readline():
+            # ":nick PRIVMSG #chan :lat <node> <perf_counter>"
+            fields = line.decode().split()
+            if len(fields) == 6 and fields[3] == ":lat":
+                kind = "same_node" if int(fields[4]) == self.node else "cross_node"
+                self.samples[kind].append(time.perf_counter() - float(fields[5]))
+            elif len(fields) > 1 and fields[1] == "353":
+                self.names.update(line.decode().rsplit(":", 1)[1].split())
+            elif len(fields) > 1 and fields[1] == "366":
+                self.names_done.set()
+
+    async def count_names(self):
+        self.names = set()
+        self.names_done.clear()
+        self.writer.write(f"NAMES {CHANNEL}\r\n".encode())
+        await self.names_done.wait()
+        return len(self.names)
+
+    async def chat(self, messages, interval):
+        for _ in range(messages):
+            await asyncio.sleep(interval)
+            stamp = f"{time.perf_counter():.6f}"
+            self.writer.write(
+                f"PRIVMSG {CHANNEL} :lat {self.node} {stamp}\r\n".encode()
+            )
+
+
+async def run(nodes, opts):
+    samples = {"same_node": [], "cross_node": []}
+    users = [
+        User(n, i, server, samples)
+        for n, server in enumerate(nodes)
+        for i in range(opts.clients)
+    ]
+    for user in users:
+        await user.connect()
+
+    # the mesh is up once every node's users show up in NAMES everywhere
+    t0 = time.perf_counter()
+    probes = [users[n * opts.clients] for n in range(len(nodes))]
+    while True:
+        counts = [await probe.count_names() for probe in probes]
+        if all(c == len(users) for c in counts):
+            break
+        if time.perf_counter() - t0 > opts.timeout:
+            raise TimeoutError(f"mesh incomplete: {counts} of {len(users)} users")
+        await asyncio.sleep(0.2)
+    mesh_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await asyncio.gather(
+        *(u.chat(opts.messages, opts.clients * len(nodes) / opts.rate) for u in users)
+    )
+    await asyncio.sleep(opts.settle)
+    wall = time.perf_counter() - t0
+    for user in users:
+        user.task.cancel()
+        user.writer.close()
+
+    sent = len(users) * opts.messages
+    return {
+        "nodes": len(nodes),
+        "users": len(users),
+        "messages_sent": sent,
+        "expected_deliveries": sent * (len(users) - 1),
+        "mesh_seconds": round(mesh_seconds, 3),
+        "wall_seconds": round(wall, 3),
+        "latency_ms": {k: summarize(v) for k, v in samples.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=20, help="users per node")
+    parser.add_argument("--messages", type=int, default=20, help="sent per user")
+    parser.add_argument(
+        "--rate", type=float, default=200.0, help="messages per second, all users"
+    )
+    parser.add_argument("--settle", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=15.0)
+    opts = parser.parse_args(argv)
+    raise_fd_limit()
+
+    nodes = start_nodes(opts.nodes)
+    try:
+        result = asyncio.run(run(nodes, opts))
+    finally:
+        for node in nodes:
+            node.stop()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
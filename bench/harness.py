@@ -0,0 +1,137 @@
+"""start a wormnet server on localhost for benchmarks"""
+
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+def free_port():
+    """ask the kernel for an unused tcp port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, host="127.0.0.1", timeout=10.0):
+    """block until something accepts on host:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.002)
+    raise TimeoutError(f"nothing listening on {host}:{port}")
+
+
+class Server:
+    """handle on a running wormnet server"""
+
+    def __init__(self, irc_port, http_port, stop, pid=None):
+        self.host = "127.0.0.1"
+        self.irc_port = irc_port
+        self.http_port = http_port
+        self.pid = pid  # server process, when it's one we started
+        self._stop = stop
+
+    def stop(self):
+        """shut the server down"""
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start_inprocess():
+    """run irc and http servers as threads in this process"""
+    from wormnet import config, http, irc
+
+    # per-request logging would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    config.IRC_HOST = "127.0.0.1"
+    config.IRC_PORT = free_port()
+    config.build_irc_channels()
+
+    threading.Thread(target=irc.run_server, daemon=True).start()
+    httpd = http.make_server("127.0.0.1", 0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    wait_for_port(config.IRC_PORT)
+
+    return Server(config.IRC_PORT, httpd.server_port, httpd.shutdown, os.getpid())
+
+
+def start_subprocess(
+    extra_config="", irc_config="", python=None, cpus=None, role="all"
+):
+    """run wormnet.py in a child process with a throwaway config
+
+    irc_config is extra lines for the [irc] table, extra_config whole tables.
+    python picks the interpreter (default: this one) and cpus pins the server
+    to that set of cpu numbers. returns once the role's listeners accept.
+    """
+    irc_port, http_port = free_port(), free_port()
+    with tempfile.NamedTemporaryFile("w", suffix=".toml", delete=False) as tmp:
+        tmp.write(
+            f'[logging]\nlevel = "WARNING"\n\n'
+            f'[irc]\nport = {irc_port}\nip = "127.0.0.1"\n{irc_config}\n'
+            f"[http]\nport = {http_port}\n\n"
+            f"{extra_config}"
+        )
+
+    proc = subprocess.Popen(
+        [
+            python or sys.executable,
+            str(ROOT / "wormnet.py"),
+            "-c",
+            tmp.name,
+            "--role",
+            role,
+        ],
+        cwd=ROOT,
+        preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+    )
+
+    def stop():
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        Path(tmp.name).unlink(missing_ok=True)
+
+    try:
+        if role in ("all", "irc"):
+            wait_for_port(irc_port)
+        if role in ("all", "http"):
+            wait_for_port(http_port)
+    except TimeoutError:
+        stop()
+        raise
+
+    return Server(irc_port, http_port, stop, proc.pid)
+
+
+def start(mode):
+    """start a server: 'inproc', 'subprocess', or attach to 'host:ircport:httpport'"""
+    if mode == "inproc":
+        return start_inprocess()
+    if mode == "subprocess":
+        return start_subprocess()
+
+    host, irc_port, http_port = mode.rsplit(":", 2)
+    server = Server(int(irc_port), int(http_port), lambda: None)
+    server.host = host
+    return server
@@ -0,0 +1,409 @@
+"""synthetic wormnet client load generator
+
+simulates many worms armageddon clients against a local server. each client
+follows the real client flow: Login.asp, then PASS/NICK/USER with the
+"flags rank country version" realname, JOIN, chat, GameList.asp polling and
+hosting/closing games via Game.asp. the irc connection goes to the address
+Login.asp hands out in <CONNECT>, so with an [irc.pool] the load spreads
+over the nodes the way real clients would.
+
+    python -m bench.loadgen --clients 2000 --duration 60 --report soak.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import resource
+import sys
+import time
+
+from . import harness
+
+COUNTRIES = ["US", "GB", "DE", "PL", "RU", "FR", "SE", "NL", "BR", "ZZ"]
+PASSWORD = "ELSILRACLIHP"
+CONNECT = re.compile(rb"<CONNECT ([^>\s]+)>")
+
+
+def connect_address(body, default_port):
+    """(host, port) from Login.asp's <CONNECT host[:port]>, or None"""
+    match = CONNECT.search(body)
+    if match is None:
+        return None
+    host, _, port = match.group(1).decode().rpartition(":")
+    if not host or not port.isdigit():
+        # no port: the server's own irc port (the game would use 6667)
+        return match.group(1).decode(), default_port
+    return host, int(port)
+
+
+def percentile(values, pct):
+    """nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    """count and latency percentiles in milliseconds"""
+    ms = [v * 1000 for v in values]
+    return {
+        "count": len(ms),
+        "p50": percentile(ms, 50),
+        "p90": percentile(ms, 90),
+        "p99": percentile(ms, 99),
+        "max": max(ms) if ms else None,
+    }
+
+
+class Stats:
+    """latency samples and error counts shared by all simulated clients"""
+
+    def __init__(self):
+        self.samples = {
+            "login": [],
+            "connect": [],
+            "join": [],
+            "message": [],
+            "gamelist": [],
+            "player_info": [],
+            "game_create": [],
+            "game_close": [],
+        }
+        self.errors = {}
+        self.messages_sent = 0
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self):
+        return {
+            "latency_ms": {k: summarize(v) for k, v in self.samples.items()},
+            "messages_sent": self.messages_sent,
+            "errors": self.errors,
+        }
+
+
+async def http_get(host, port, path, params=None):
+    """minimal HTTP/1.0 GET returning (status, headers, body)"""
+    if params:
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        path = f"{path}?{query}"
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+        raw = await reader.read()
+    finally:
+        writer.close()
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return status, headers, body
+
+
+async def sleep_until(delay, until):
+    """sleep for delay but never past the deadline; False once it has passed"""
+    await asyncio.sleep(max(0.0, min(delay, until - time.monotonic())))
+    return time.monotonic() < until
+
+
+class SimClient:
+    """one simulated worms armageddon client"""
+
+    def __init__(self, index, server, opts, stats):
+        self.index = index
+        self.server = server
+        self.opts = opts
+        self.stats = stats
+        self.rng = random.Random(opts.seed * 1_000_003 + index)
+        self.nick = f"lg{index}"
+        self.channel = opts.channels[index % len(opts.channels)]
+        self.irc_addr = None  # where Login.asp sent us
+        self.reader = None
+        self.writer = None
+        self.waiters = {}
+        self.seq = 0
+
+    def realname(self):
+        """USER realname as sent by WA: flags rank country version"""
+        rank = self.rng.randint(0, 13)
+        country = self.rng.choice(COUNTRIES)
+        return f"48 {rank} {country} 3.8.1"
+
+    def send(self, line):
+        self.writer.write(f"{line}\r\n".encode())
+
+    def expect(self, numeric):
+        """future resolved when the server sends the given numeric"""
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[numeric] = fut
+        return fut
+
+    async def read_loop(self):
+        """dispatch server lines until the connection closes"""
+        while True:
+            raw = await self.reader.readline()
+            if not raw:
+                break
+            line = raw.decode("utf-8", errors="ignore").rstrip("\r\n")
+            parts = line.split(" ", 3)
+            if parts[0] == "PING":
+                self.send(f"PONG {parts[1] if len(parts) > 1 else ''}")
+                continue
+            if len(parts) < 2:
+                continue
+            fut = self.waiters.pop(parts[1], None)
+            if fut and not fut.done():
+                fut.set_result(line)
+            if parts[1] == "PRIVMSG" and len(parts) == 4:
+                self.on_privmsg(parts[3])
+
+    def on_privmsg(self, text):
+        """record delivery latency of messages stamped by other sim clients"""
+        # payload: ":lg <sender> <seq> <perf_counter>"
+        fields = text.lstrip(":").split(" ")
+        if len(fields) == 4 and fields[0] == "lg":
+            try:
+                sent = float(fields[3])
+            except ValueError:
+                return
+            self.stats.add("message", time.perf_counter() - sent)
+
+    async def login(self):
+        host, port = self.server.host, self.server.http_port
+        t0 = time.perf_counter()
+        status, _, body = await http_get(host, port, "/wormageddonweb/Login.asp")
+        self.stats.add("login", time.perf_counter() - t0)
+        self.irc_addr = connect_address(body, self.server.irc_port)
+        if status != 200 or self.irc_addr is None:
+            raise RuntimeError("login")
+
+    async def connect(self):
+        t0 = time.perf_counter()
+        # follow the <CONNECT> address, so pool assignments are honoured
+        self.reader, self.writer = await asyncio.open_connection(*self.irc_addr)
+        asyncio.ensure_future(self.read_loop())
+        welcome = self.expect("376")
+        self.send(f"PASS {PASSWORD}")
+        self.send(f"NICK {self.nick}")
+        self.send(f"USER {self.nick} host server :{self.realname()}")
+        await asyncio.wait_for(welcome, self.opts.timeout)
+        self.stats.add("connect", time.perf_counter() - t0)
+
+    async def join(self):
+        t0 = time.perf_counter()
+        names_end = self.expect("366")
+        self.send(f"JOIN {self.channel}")
+        await asyncio.wait_for(names_end, self.opts.timeout)
+        self.stats.add("join", time.perf_counter() - t0)
+
+    async def chat_loop(self, until):
+        if self.opts.chat_rate <= 0:
+            return
+        while await sleep_until(self.rng.expovariate(self.opts.chat_rate), until):
+            self.seq += 1
+            stamp = f"{time.perf_counter():.6f}"
+            self.send(f"PRIVMSG {self.channel} :lg {self.nick} {self.seq} {stamp}")
+            self.stats.messages_sent += 1
+
+    async def gamelist_loop(self, until):
+        host, port = self.server.host, self.server.http_port
+        chan = self.channel.lstrip("#")
+        # stagger first poll so clients don't move in lockstep
+        delay = self.rng.uniform(0, self.opts.poll_interval)
+        while await sleep_until(delay, until):
+            delay = self.opts.poll_interval
+            t0 = time.perf_counter()
+            status, _, body = await http_get(
+                host, port, "/wormageddonweb/GameList.asp", {"Channel": chan}
+            )
+            self.stats.add("gamelist", time.perf_counter() - t0)
+            if status != 200 or not body.startswith(b"<GAMELISTSTART>"):
+                self.stats.error("gamelist")
+
+    async def info_loop(self, until):
+        if self.opts.info_rate <= 0:
+            return
+        host, port = self.server.host, self.server.http_port
+        params = {"Nick": self.nick, "Rank": str(self.index % 13), "Country": "GB"}
+        while await sleep_until(self.rng.expovariate(self.opts.info_rate), until):
+            t0 = time.perf_counter()
+            status, _, _ = await http_get(
+                host, port, "/wormageddonweb/UpdatePlayerInfo.asp", params
+            )
+            self.stats.add("player_info", time.perf_counter() - t0)
+            if status != 200:
+                self.stats.error("player_info")
+
+    async def host_loop(self, until):
+        if self.opts.host_rate <= 0:
+            return
+        host, port = self.server.host, self.server.http_port
+        path = "/wormageddonweb/Game.asp"
+        while await sleep_until(self.rng.expovariate(self.opts.host_rate), until):
+            t0 = time.perf_counter()
+            status, headers, _ = await http_get(
+                host,
+                port,
+                path,
+                {
+                    "Cmd": "Create",
+                    "Name": f"{self.nick}.game",
+                    "Nick": self.nick,
+                    "HostIP": f"127.0.0.{1 + self.index % 250}:17011",
+                    "Pwd": "",
+                    "Chan": self.channel.lstrip("#"),
+                    "Loc": "48",
+                    "Type": "0",
+                    "Scheme": "Pf,Be",
+                },
+            )
+            self.stats.add("game_create", time.perf_counter() - t0)
+            game_id = headers.get("setgameid", "").lstrip(": ").strip()
+            if status != 200 or not game_id:
+                self.stats.error("game_create")
+                continue
+
+            await asyncio.sleep(self.rng.uniform(*self.opts.game_lifetime))
+            t0 = time.perf_counter()
+            status, _, _ = await http_get(
+                host, port, path, {"Cmd": "Close", "GameID": game_id}
+            )
+            self.stats.add("game_close", time.perf_counter() - t0)
+            if status != 200:
+                self.stats.error("game_close")
+
+    async def run(self, until):
+        try:
+            await self.login()
+            await self.connect()
+            await self.join()
+            await asyncio.gather(
+                self.chat_loop(until),
+                self.gamelist_loop(until),
+                self.host_loop(until),
+                self.info_loop(until),
+            )
+            self.send("QUIT :bye")
+            await self.writer.drain()
+        except (TimeoutError, OSError, RuntimeError) as e:
+            self.stats.error(type(e).__name__)
+        finally:
+            if self.writer:
+                self.writer.close()
+
+
+async def run_load(server, opts):
+    """ramp clients up and let them run for the configured duration"""
+    stats = Stats()
+    start = time.monotonic()
+    ramp = opts.clients / opts.ramp if opts.ramp > 0 else 0
+    until = start + ramp + opts.duration
+
+    tasks = []
+    for i in range(opts.clients):
+        if opts.ramp > 0:
+            delay = start + i / opts.ramp - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(
+            asyncio.ensure_future(SimClient(i, server, opts, stats).run(until))
+        )
+    await asyncio.gather(*tasks)
+
+    report = stats.report()
+    report["wall_seconds"] = round(time.monotonic() - start, 3)
+    return report
+
+
+def raise_fd_limit():
+    """each sim client needs sockets; lift the soft fd limit to the hard one"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="seconds after ramp-up"
+    )
+    parser.add_argument(
+        "--ramp",
+        type=float,
+        default=200.0,
+        help="new clients per second (0 = all at once)",
+    )
+    parser.add_argument(
+        "--channels", nargs="+", default=["#AnythingGoes", "#PartyTime"]
+    )
+    parser.add_argument(
+        "--chat-rate", type=float, default=0.05, help="messages per second per client"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=5.0, help="GameList.asp poll interval"
+    )
+    parser.add_argument(
+        "--host-rate",
+        type=float,
+        default=0.01,
+        help="games hosted per second per client",
+    )
+    parser.add_argument(
+        "--info-rate",
+        type=float,
+        default=0.0,
+        help="UpdatePlayerInfo.asp reports per second per client",
+    )
+    parser.add_argument(
+        "--game-lifetime",
+        type=float,
+        nargs=2,
+        default=[5.0, 20.0],
+        metavar=("MIN", "MAX"),
+    )
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--server",
+        default="subprocess",
+        help="'subprocess', 'inproc', or an existing 'host:ircport:httpport'",
+    )
+    parser.add_argument("--report", help="write JSON report to this path")
+    return parser
+
+
+def main(argv=None):
+    opts = build_parser().parse_args(argv)
+    raise_fd_limit()
+
+    with harness.start(opts.server) as server:
+        report = asyncio.run(run_load(server, opts))
+
+    report["params"] = {
+        k: v for k, v in vars(opts).items() if k not in ("report", "server")
+    }
+    report["python"] = sys.version.split()[0]
+    text = json.dumps(report, indent=2)
+    if opts.report:
+        with open(opts.report, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""resident memory per idle registered irc client
+
+starts wormnet.py in a subprocess, registers clients in steps (optionally
+spread over channels), lets them sit idle and reads the server's VmRSS
+after each step. the slope between steps is the cost of one more client.
+
+    python -m bench.memory --clients 10000 --steps 4 --channels 20
+    python -m bench.memory --workers 0   # a thread per client, for comparison
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from . import harness
+from .loadgen import raise_fd_limit
+
+REGISTER = "PASS ELSILRACLIHP\r\nNICK {nick}\r\nUSER {nick} h s :0 11 US 3.8.1\r\n"
+
+
+def status(pid):
+    """VmRSS (bytes) and thread count from /proc"""
+    fields = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key, _, value = line.partition(":")
+        fields[key] = value.split()
+    return int(fields["VmRSS"][0]) * 1024, int(fields["Threads"][0])
+
+
+async def drain(reader):
+    """keep reading so broadcasts to this client never block the server"""
+    try:
+        while await reader.read(65536):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def connect(server, index, channel, conns):
+    reader, writer = await asyncio.open_connection(server.host, server.irc_port)
+    nick = f"mem{index}"
+    writer.write(REGISTER.format(nick=nick).encode())
+    if channel:
+        writer.write(f"JOIN {channel}\r\n".encode())
+    marker = b" 366 " if channel else b" 376 "
+    buf = b""
+    while marker not in buf:
+        chunk = await reader.read(65536)
+        if not chunk:
+            raise ConnectionError(f"{nick}: closed during registration")
+        buf += chunk
+    conns.append((writer, asyncio.ensure_future(drain(reader))))
+
+
+async def measure(server, opts):
+    channels = [f"#mem{i}" for i in range(opts.channels)]
+    await asyncio.sleep(opts.settle)
+    rss, threads = status(server.pid)
+    rows = [{"clients": 0, "rss_mb": round(rss / 2**20, 2), "threads": threads}]
+    conns = []
+    per_step = opts.clients // opts.steps
+    for step in range(1, opts.steps + 1):
+        start = len(conns)
+        for batch in range(start, start + per_step, opts.batch):
+            await asyncio.gather(
+                *(
+                    connect(
+                        server,
+                        i,
+                        channels[i % len(channels)] if channels else None,
+                        conns,
+                    )
+                    for i in range(batch, min(batch + opts.batch, start + per_step))
+                )
+            )
+        await asyncio.sleep(opts.settle)
+        rss, threads = status(server.pid)
+        rows.append(
+            {"clients": len(conns), "rss_mb": round(rss / 2**20, 2), "threads": threads}
+        )
+        print(json.dumps(rows[-1]), file=sys.stderr, flush=True)
+
+    for writer, task in conns:
+        task.cancel()
+        writer.close()
+
+    first, last = rows[1], rows[-1]
+    slope = (
+        (last["rss_mb"] - first["rss_mb"])
+        * 2**20
+        / (last["clients"] - first["clients"])
+        if last["clients"] > first["clients"]
+        else 0
+    )
+    return {
+        "clients": last["clients"],
+        "channels": opts.channels,
+        "workers": opts.workers,
+        "steps": rows,
+        # marginal cost, so interpreter and import overhead cancel out
+        "bytes_per_client": round(slope),
+        "bytes_per_client_total": round(
+            (last["rss_mb"] - rows[0]["rss_mb"]) * 2**20 / max(1, last["clients"])
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=10, help="0 = don't join")
+    parser.add_argument("--batch", type=int, default=200, help="connects in flight")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="[irc] workers (0 = thread each)"
+    )
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds idle")
+    opts = parser.parse_args(argv)
+    raise_fd_limit()
+
+    channels = "".join(
+        f'[channels.mem{i}]\ntopic = "memory"\nicon = 0\nscheme = "Pf,Be"\n\n'
+        for i in range(opts.channels)
+    )
+    server = harness.start_subprocess(
+        extra_config=f"[overload]\nenabled = false\n\n{channels}",
+        irc_config=(
+            "max_clients = 0\naccept_rate = 0\nbacklog = 1024\n"
+            'motd_file = "/nonexistent"\n'
+            + (f"workers = {opts.workers}\n" if opts.workers is not None else "")
+        ),
+    )
+    try:
+        t0 = time.perf_counter()
+        result = asyncio.run(measure(server, opts))
+        result["seconds"] = round(time.perf_counter() - t0, 1)
+    finally:
+        server.stop()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""microbenchmarks for irc and http hot paths
+
+each case builds server state with fake sockets, then times one call of the
+function under test. results are stored as JSON and compared against a
+baseline so a slowdown shows up before it ships.
+
+    python -m bench.micro run --save bench/baselines/micro.json
+    python -m bench.micro compare bench/baselines/micro.json
+"""
+
+import argparse
+import gc
+import ipaddress
+import itertools
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from wormnet import config, state
+from wormnet import events as wn_events
+from wormnet import games as wn_games
+from wormnet import http as wn_http
+from wormnet import ipfilter
+from wormnet import players as wn_players
+from wormnet import status as wn_status
+from wormnet.irc import IRCClient
+
+BASELINE = Path(__file__).parent / "baselines" / "micro.json"
+DEFAULT_THRESHOLD = 0.25
+
+
+class FakeSocket:
+    """socket stand-in that swallows writes"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+
+    def close(self):
+        pass
+
+
+def make_channels(count):
+    """configure `count` channels named #ch0..#chN"""
+    config.CHANNELS = {
+        f"ch{i}": {"topic": f"channel {i}", "icon": i % 10, "scheme": "Pf,Be"}
+        for i in range(count)
+    }
+    config.build_irc_channels()
+    return list(state.irc_channels)
+
+
+def make_clients(count, channels):
+    """register `count` clients spread round-robin across channels"""
+    state.irc_clients.clear()
+    clients = []
+    for i in range(count):
+        client = IRCClient(FakeSocket(), ("127.0.0.1", 10000 + i))
+        client.nickname = f"bench{i}"
+        client.username = f"bench{i}"
+        client.realname = "48 0 US 3.8.1"
+        client.registered = True
+        channame = channels[i % len(channels)]
+        client.channels.add(channame)
+        state.irc_channels[channame]["users"].add(client.nickname)
+        state.irc_clients.append(client)
+        clients.append(client)
+    return clients
+
+
+def make_games(count, channels):
+    """fill the game table, spread across channels"""
+    state.games.clear()
+    state.game_creators.clear()
+    for i in range(1, count + 1):
+        wn_games.create(
+            name=f"game{i}",
+            host=f"bench{i}",
+            address=f"10.0.{i // 250}.{i % 250}:17011",
+            channel=channels[i % len(channels)].lstrip("#"),
+            location="48",
+            scheme="Pf,Be",
+        )
+
+
+def case_privmsg(clients, channels):
+    """channel PRIVMSG through process_line"""
+    make_clients(clients, make_channels(channels))
+    sender = state.irc_clients[0]
+    target = next(iter(sender.channels))
+    line = f"PRIVMSG {target} :hello there, anyone up for a game?"
+    return lambda: sender.process_line(line)
+
+
+def case_privmsg_feed(clients, channels):
+    """channel PRIVMSG with accented cp1252 text, from the bytes read"""
+    make_clients(clients, make_channels(channels))
+    sender = state.irc_clients[0]
+    target = next(iter(sender.channels))
+    raw = f"PRIVMSG {target} :".encode() + "déjà vu, ça va? gg à tous\r\n".encode(
+        "cp1252"
+    )
+    return lambda: sender.feed(raw)
+
+
+def case_join_part(clients, channels):
+    """JOIN then PART of the busiest channel through process_line"""
+    make_clients(clients, make_channels(channels))
+    joiner = IRCClient(FakeSocket(), ("127.0.0.1", 9999))
+    joiner.nickname = joiner.username = "joiner"
+    joiner.registered = True
+
+    def run():
+        joiner.process_line("JOIN #ch0")
+        joiner.process_line("PART #ch0")
+
+    return run
+
+
+def case_who(clients, channels):
+    """WHO #channel through process_line"""
+    make_clients(clients, make_channels(channels))
+    client = state.irc_clients[0]
+    return lambda: client.process_line("WHO #ch0")
+
+
+def case_broadcast(clients, channels):
+    """broadcast_to_channel without command parsing"""
+    make_clients(clients, make_channels(channels))
+    sender = state.irc_clients[0]
+    msg = ":bench0 PRIVMSG #ch0 :hello"
+    return lambda: sender.broadcast_to_channel("#ch0", msg)
+
+
+def case_cleanup_games(games, channels):
+    """games.cleanup with nothing expired (the per-request common case)"""
+    make_games(games, make_channels(channels))
+    return wn_games.cleanup
+
+
+def case_gamelist(games, channels):
+    """GameList.asp handler for one channel"""
+    make_games(games, make_channels(channels))
+    ctx = wn_http.app.test_request_context("/wormageddonweb/GameList.asp?Channel=ch0")
+    ctx.push()
+    return wn_http.gamelist
+
+
+def case_game_changes(games, channels):
+    """/games/changes answering with the one change since the last poll"""
+    make_games(games, make_channels(channels))
+    since = wn_games.version - 1
+    ctx = wn_http.app.test_request_context(f"/games/changes?since={since}&timeout=0")
+    ctx.push()
+    return wn_http.game_changes
+
+
+def case_ipfilter(rules, channels):
+    """ip filter decision for a mix of listed and unlisted addresses"""
+    rng = random.Random(rules)
+    deny = [
+        ipaddress.ip_network((rng.getrandbits(32), 32)).supernet(
+            new_prefix=rng.choice([16, 20, 24, 32])
+        )
+        for _ in range(rules)
+    ]
+    filt = ipfilter.IPFilter(allow=["10.0.0.0/8"], deny=[str(n) for n in deny])
+    addrs = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(64)]
+    addrs += [str(n.network_address) for n in deny[:64]]
+    addrs = itertools.cycle(addrs)
+    return lambda: filt.allowed(next(addrs))
+
+
+def player_info(store):
+    """UpdatePlayerInfo.asp handler with `store` as the player store"""
+    wn_players.store = store
+    ctx = wn_http.app.test_request_context(
+        "/wormageddonweb/UpdatePlayerInfo.asp?Nick=bench0&Rank=11&Country=GB"
+    )
+    ctx.push()
+    return wn_http.update_info
+
+
+def case_event_publish(subscribers, channels):
+    """one ChannelJoined through the event bus to no-op subscribers"""
+    bus = wn_events.Bus()
+    for _ in range(subscribers):
+        bus.subscribe(lambda batch: None)
+    event = wn_events.ChannelJoined(None, "#ch0")
+    return lambda: bus.publish(event)
+
+
+def status_lobby(clients, channels):
+    """a lobby view seeded with `clients` registered clients"""
+    make_clients(clients, make_channels(channels))
+    lobby = wn_status.Lobby()
+    lobby.seed()
+    return lobby
+
+
+def case_status_build(clients, channels):
+    """rebuilding the /status.json data from the lobby aggregates"""
+    return status_lobby(clients, channels).build
+
+
+def case_status_json(clients, channels):
+    """/status.json handler while the cached copy is fresh"""
+    wn_status.lobby = status_lobby(clients, channels)
+    wn_status.lobby.max_age = 3600
+    ctx = wn_http.app.test_request_context("/status.json")
+    ctx.push()
+    return wn_http.status_json
+
+
+def case_player_info(players, channels):
+    """UpdatePlayerInfo.asp recording into a full table, written behind"""
+    store = wn_players.PlayerStore(max_players=players, path=":memory:")
+    for i in range(players):
+        store.update(f"bench{i}", (("Rank", "11"),))
+    return player_info(store)
+
+
+def case_player_info_off(players, channels):
+    """UpdatePlayerInfo.asp with no store: the old no-op"""
+    return player_info(None)
+
+
+# name -> (factory, parameter name, sizes, channel count)
+CASES = {
+    "irc.privmsg": (case_privmsg, "clients", [10, 100, 1000], 4),
+    "irc.privmsg_feed": (case_privmsg_feed, "clients", [10, 100, 1000], 4),
+    "irc.join_part": (case_join_part, "clients", [10, 100, 1000], 4),
+    "irc.who": (case_who, "clients", [10, 100, 1000], 4),
+    "irc.broadcast": (case_broadcast, "clients", [10, 100, 1000], 4),
+    "http.cleanup_games": (case_cleanup_games, "games", [10, 100, 1000], 4),
+    "http.gamelist": (case_gamelist, "games", [10, 100, 1000], 4),
+    "http.game_changes": (case_game_changes, "games", [10, 100, 1000], 4),
+    "ipfilter.lookup": (case_ipfilter, "rules", [10, 1000, 50000], 0),
+    "status.build": (case_status_build, "clients", [10, 100, 1000], 4),
+    "http.status_json": (case_status_json, "clients", [10, 100, 1000], 4),
+    "events.publish": (case_event_publish, "subscribers", [0, 1, 10], 0),
+    "http.player_info": (case_player_info, "players", [10, 10000, 100000], 0),
+    "http.player_info_off": (case_player_info_off, "players", [0], 0),
+}
+
+
+def measure(fn, repeat=7, min_time=0.1):
+    """per-call timings in microseconds, one sample per repeat"""
+    # like timeit: a collection landing inside one repeat skews it
+    gc.collect()
+    gc.disable()
+    try:
+        return _measure(fn, repeat, min_time)
+    finally:
+        gc.enable()
+
+
+def _measure(fn, repeat, min_time):
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - t0) / loops * 1e6)
+    return samples, loops
+
+
+def run(pattern=None, repeat=7):
+    """run every case matching pattern, returning a results document"""
+    results = {}
+    for name, (factory, param, sizes, channels) in CASES.items():
+        for size in sizes:
+            key = f"{name}[{param}={size}]"
+            if pattern and pattern not in key:
+                continue
+            fn = factory(size, channels)
+            samples, loops = measure(fn, repeat=repeat)
+            results[key] = {
+                "median_us": round(statistics.median(samples), 3),
+                "min_us": round(min(samples), 3),
+                "loops": loops,
+            }
+            print(f"{key:40} {results[key]['min_us']:>12.3f} us", flush=True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """print a comparison table; returns names that regressed past threshold
+
+    compares the fastest repeat: noise from other processes only ever adds
+    time, so the minimum is the most stable estimate of the code's own cost.
+    """
+    regressions = []
+    print(f"{'case':40} {'base us':>10} {'now us':>10} {'change':>8}")
+    for key, now in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            print(f"{key:40} {'-':>10} {now['min_us']:>10.3f} {'new':>8}")
+            continue
+        change = now["min_us"] / base["min_us"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(
+            f"{key:40} {base['min_us']:>10.3f} {now['min_us']:>10.3f}"
+            f" {change:>+7.1%}{flag}"
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="wormnet microbenchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="run benchmarks")
+    run_p.add_argument("-k", "--filter", help="only cases containing this string")
+    run_p.add_argument("--repeat", type=int, default=7)
+    run_p.add_argument("--save", help="write results JSON here")
+
+    cmp_p = sub.add_parser("compare", help="run (or load) results and diff")
+    cmp_p.add_argument("baseline", nargs="?", default=str(BASELINE))
+    cmp_p.add_argument("current", nargs="?", help="results JSON (default: run now)")
+    cmp_p.add_argument("-k", "--filter", help="only cases containing this string")
+    cmp_p.add_argument("--repeat", type=int, default=7)
+    cmp_p.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"allowed slowdown as a fraction (default {DEFAULT_THRESHOLD})",
+    )
+
+    args = parser.parse_args(argv)
+    # debug log formatting is part of the measured cost, emitting it is not
+    logging.disable(logging.CRITICAL)
+
+    if args.command == "run":
+        doc = run(args.filter, args.repeat)
+        if args.save:
+            Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+            Path(args.save).write_text(json.dumps(doc, indent=2) + "\n")
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    if args.current:
+        current = json.loads(Path(args.current).read_text())
+    else:
+        current = run(args.filter, args.repeat)
+        print()
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""loopback load harness for the nat relay
+
+starts a relay on ephemeral ports, one fake game host (an echo server) and
+an agent per match, then drives joiners that bounce fixed-size payloads
+through the relay and time each round trip.
+
+    python -m bench.relay --matches 300 --joiners 4 --rounds 50 --size 512
+    python -m bench.relay --mode buffer   # compare against the splice path
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import threading
+import time
+
+from wormnet import relay as relay_mod
+
+from .loadgen import raise_fd_limit, summarize
+
+
+async def echo(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass  # torn down with the relay at the end of the run
+    finally:
+        writer.close()
+
+
+async def joiner(port, rounds, size, rtts):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = b"w" * size
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        writer.write(payload)
+        await reader.readexactly(size)
+        rtts.append(time.perf_counter() - t0)
+    writer.close()
+
+
+async def run(opts):
+    relay = relay_mod.Relay(
+        bind="127.0.0.1", control_port=0, ports=None, splice=opts.mode == "splice"
+    )
+    relay.start()
+    server = await asyncio.start_server(echo, "127.0.0.1", 0)
+    game = server.sockets[0].getsockname()[:2]
+
+    sessions = []
+    for _ in range(opts.matches):
+        session = relay.allocate(f"m{len(sessions)}")
+        ready = threading.Event()
+        threading.Thread(
+            target=relay_mod.run_agent,
+            args=(("127.0.0.1", relay.control_port), session.token, game),
+            kwargs={"ready": lambda port, ready=ready: ready.set()},
+            daemon=True,
+        ).start()
+        await asyncio.to_thread(ready.wait, 5)
+        sessions.append(session)
+
+    rtts = []
+    cpu0 = resource.getrusage(resource.RUSAGE_SELF)
+    t0 = time.perf_counter()
+    await asyncio.gather(
+        *(
+            joiner(s.port, opts.rounds, opts.size, rtts)
+            for s in sessions
+            for _ in range(opts.joiners)
+        )
+    )
+    elapsed = time.perf_counter() - t0
+    cpu1 = resource.getrusage(resource.RUSAGE_SELF)
+
+    stats = relay.stats()
+    relayed = sum(s["bytes_to_host"] + s["bytes_to_joiners"] for s in stats)
+    relay.stop()
+    server.close()
+    return {
+        "mode": opts.mode,
+        "matches": opts.matches,
+        "joiners": opts.matches * opts.joiners,
+        "seconds": round(elapsed, 3),
+        "relayed_mb": round(relayed / 1e6, 2),
+        "relayed_mb_per_sec": round(relayed / 1e6 / elapsed, 2),
+        "round_trips": len(rtts),
+        "rtt_ms": summarize(rtts),
+        # the whole process: relay, agents, echo server and joiners
+        "cpu_seconds": round(
+            cpu1.ru_utime - cpu0.ru_utime + cpu1.ru_stime - cpu0.ru_stime, 3
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--matches", type=int, default=100)
+    parser.add_argument("--joiners", type=int, default=4, help="per match")
+    parser.add_argument("--rounds", type=int, default=50, help="per joiner")
+    parser.add_argument("--size", type=int, default=512, help="payload bytes")
+    parser.add_argument(
+        "--mode",
+        choices=["splice", "buffer"],
+        default="splice" if relay_mod.SPLICE else "buffer",
+    )
+    opts = parser.parse_args(argv)
+    raise_fd_limit()
+    print(json.dumps(asyncio.run(run(opts)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
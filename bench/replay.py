@@ -0,0 +1,225 @@
+"""replay recorded wormnet traffic against a local server
+
+    python -m bench.replay import-pcap capture.pcap capture.wnrec
+    python -m bench.replay info capture.wnrec
+    python -m bench.replay run capture.wnrec --speed 10
+
+logs come from `wormnet.py --record FILE` or from import-pcap. --speed 1
+replays in real time, 10 runs ten times faster and 0 sends everything as
+fast as the server accepts it.
+
+the log has requests but not responses, so the game ids a recorded
+Game.asp?Cmd=Close or Cmd=Refresh names are the recording server's. each
+one is mapped to the id the replayed server gave the oldest not yet mapped
+Create from the same client ip, which holds as long as a host's games are
+closed in the order they were made. ids of games created before the
+recording started are sent as recorded.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import parse_qs, urlsplit
+
+from wormnet import record
+
+from . import harness
+from .loadgen import http_get, raise_fd_limit, summarize
+
+
+async def _drain(reader):
+    """read and discard server output so the server never blocks on us"""
+    while await reader.read(65536):
+        pass
+
+
+GAME_ID = re.compile(r"(?<=[?&]GameID=)[^&]*")
+
+
+class GameIds:
+    """recorded game ids -> the ids the replayed server handed out"""
+
+    def __init__(self):
+        self.unmapped = defaultdict(deque)  # session -> futures of creates
+        self.mapped = {}  # (session, recorded id) -> future
+
+    def created(self, session):
+        """a future for the id a replayed Create gets (None if it failed)"""
+        future = asyncio.get_running_loop().create_future()
+        self.unmapped[session].append(future)
+        return future
+
+    def lookup(self, session, recorded):
+        """the future holding recorded's replayed id, None if unknown"""
+        key = (session, recorded)
+        if key not in self.mapped:
+            if not self.unmapped[session]:
+                return None
+            self.mapped[key] = self.unmapped[session].popleft()
+        return self.mapped[key]
+
+
+async def replay(server, events, speed):
+    """send events at their recorded offsets divided by speed"""
+    sessions = {}
+    pending = []
+    lag = []
+    http_latency = []
+    errors = Counter()
+    sent = Counter()
+    game_ids = GameIds()
+
+    async def do_http(session, path):
+        query = parse_qs(urlsplit(path).query)
+        cmd = query.get("Cmd", [None])[0]
+        created = None
+        if cmd == "Create":
+            created = game_ids.created(session)
+        elif cmd in ("Close", "Refresh") and "GameID" in query:
+            future = game_ids.lookup(session, query["GameID"][0])
+            if future is not None:
+                game_id = await future
+                if game_id is None:
+                    errors["game_not_created"] += 1
+                    return
+                path = GAME_ID.sub(game_id, path)
+
+        t0 = time.perf_counter()
+        headers = {}
+        try:
+            status, headers, _ = await http_get(server.host, server.http_port, path)
+        except OSError:
+            errors["http_connect"] += 1
+            return
+        finally:
+            if created is not None:
+                game_id = headers.get("setgameid", "").lstrip(": ").strip()
+                created.set_result(game_id or None)
+        http_latency.append(time.perf_counter() - t0)
+        if status >= 500:
+            errors[f"http_{status}"] += 1
+
+    start = time.monotonic()
+    for kind, offset, session, payload in events:
+        if speed > 0:
+            delay = start + offset / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lag.append(max(0.0, time.monotonic() - start - offset / speed))
+
+        if kind == record.OPEN:
+            try:
+                reader, writer = await asyncio.open_connection(
+                    server.host, server.irc_port
+                )
+            except OSError:
+                errors["irc_connect"] += 1
+                continue
+            sessions[session] = writer
+            pending.append(asyncio.ensure_future(_drain(reader)))
+        elif kind == record.LINE:
+            writer = sessions.get(session)
+            if writer is None:
+                errors["line_without_session"] += 1
+                continue
+            writer.write(payload + b"\r\n")
+            if writer.transport.get_write_buffer_size() > 1 << 20:
+                await writer.drain()
+        elif kind == record.CLOSE:
+            writer = sessions.pop(session, None)
+            if writer:
+                writer.close()
+        elif kind == record.HTTP:
+            path = payload.decode("latin-1")
+            pending.append(asyncio.ensure_future(do_http(session, path)))
+        sent[record.KIND_NAMES.get(kind, str(kind))] += 1
+
+    for writer in sessions.values():
+        writer.close()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    return {
+        "events": dict(sent),
+        "wall_seconds": round(time.monotonic() - start, 3),
+        "schedule_lag_ms": summarize(lag),
+        "http_latency_ms": summarize(http_latency),
+        "errors": dict(errors),
+    }
+
+
+def cmd_import(args):
+    counts = record.import_pcap(
+        args.pcap, args.log, irc_ports=args.irc_port, http_ports=args.http_port
+    )
+    print(json.dumps(counts, indent=2))
+
+
+def cmd_info(args):
+    kinds = Counter()
+    sessions = set()
+    last = 0.0
+    for kind, offset, session, _ in record.read_log(args.log):
+        kinds[record.KIND_NAMES.get(kind, str(kind))] += 1
+        sessions.add(session)
+        last = offset
+    print(
+        json.dumps(
+            {"records": dict(kinds), "sessions": len(sessions), "seconds": last},
+            indent=2,
+        )
+    )
+
+
+def cmd_run(args):
+    raise_fd_limit()
+    events = list(record.read_log(args.log))
+    with harness.start(args.server) as server:
+        report = asyncio.run(replay(server, events, args.speed))
+    report["speed"] = args.speed
+    report["log"] = args.log
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="wormnet traffic replay")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import-pcap", help="convert a libpcap capture")
+    imp.add_argument("pcap")
+    imp.add_argument("log")
+    imp.add_argument("--irc-port", type=int, nargs="+", default=[6667])
+    imp.add_argument("--http-port", type=int, nargs="+", default=[80, 8081])
+    imp.set_defaults(func=cmd_import)
+
+    info = sub.add_parser("info", help="summarize a traffic log")
+    info.add_argument("log")
+    info.set_defaults(func=cmd_info)
+
+    run = sub.add_parser("run", help="replay a traffic log")
+    run.add_argument("log")
+    run.add_argument(
+        "--speed", type=float, default=1.0, help="time scale, 0 = as fast as possible"
+    )
+    run.add_argument(
+        "--server",
+        default="subprocess",
+        help="'subprocess', 'inproc', or an existing 'host:ircport:httpport'",
+    )
+    run.add_argument("--report", help="write JSON report to this path")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""how the server scales with cores, per interpreter
+
+runs the load generator against wormnet.py once per (interpreter, core
+count), with the server pinned to that many cpus, and reports message
+latency, throughput and the cpu time the server burned. with a standard
+build extra cores mostly sit idle behind the GIL; a free-threaded build
+(python3.13t) should turn them into throughput.
+
+    python -m bench.scaling --python python3.13 --python python3.13t \\
+        --cores 1,4,16 --clients 2000 --duration 30
+
+each interpreter needs the server's dependencies (flask, tomli) installed.
+core counts above what this machine offers are skipped.
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from . import harness
+from .loadgen import build_parser, raise_fd_limit, run_load
+
+PROBE = (
+    "import sys, sysconfig;"
+    "print(sys.version.split()[0], sysconfig.get_config_var('Py_GIL_DISABLED') or 0)"
+)
+
+
+def interpreter(python):
+    """(version, free-threaded build?) for an interpreter path"""
+    out = subprocess.run(
+        [python, "-c", PROBE], capture_output=True, text=True, check=True
+    ).stdout.split()
+    return out[0], out[1] == "1"
+
+
+def cpu_seconds(pid):
+    """user + system time of a process so far, from /proc"""
+    # comm (field 2) may contain spaces; everything after its ")" is fixed
+    fields = Path(f"/proc/{pid}/stat").read_text().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run_one(python, cpus, opts):
+    server = harness.start_subprocess(
+        extra_config="[overload]\nenabled = false\n",
+        irc_config="max_clients = 0\naccept_rate = 0\nbacklog = 1024\n",
+        python=python,
+        cpus=cpus,
+    )
+    try:
+        cpu0 = cpu_seconds(server.pid)
+        report = asyncio.run(run_load(server, opts))
+        cpu = cpu_seconds(server.pid) - cpu0
+    finally:
+        server.stop()
+
+    wall = report["wall_seconds"]
+    message = report["latency_ms"]["message"]
+    return {
+        "message_p50_ms": message["p50"],
+        "message_p99_ms": message["p99"],
+        "messages_per_second": round(report["messages_sent"] / wall, 1) if wall else 0,
+        # each message fans out to the rest of its channel
+        "deliveries_per_second": round(message["count"] / wall, 1) if wall else 0,
+        "gamelist_p99_ms": report["latency_ms"]["gamelist"]["p99"],
+        "server_cpu_seconds": round(cpu, 2),
+        # average cores kept busy; stuck near 1 means the GIL is the ceiling
+        "server_cores_busy": round(cpu / wall, 2) if wall else 0,
+        "errors": report["errors"],
+    }
+
+
+def main(argv=None):
+    parser = build_parser()
+    parser.description = __doc__.splitlines()[0]
+    parser.add_argument(
+        "--python",
+        action="append",
+        help="interpreter to run the server with (repeatable; default: this one)",
+    )
+    parser.add_argument(
+        "--cores", default="1,4,16", help="comma separated core counts to pin to"
+    )
+    opts = parser.parse_args(argv)
+    raise_fd_limit()
+
+    available = sorted(os.sched_getaffinity(0))
+    rows, skipped = [], []
+    for python in opts.python or [sys.executable]:
+        version, free_threaded = interpreter(python)
+        for cores in (int(c) for c in opts.cores.split(",")):
+            if cores > len(available):
+                skipped.append({"python": python, "cores": cores})
+                print(
+                    f"skipping {cores} cores: only {len(available)} available",
+                    file=sys.stderr,
+                )
+                continue
+            row = {
+                "python": python,
+                "version": version,
+                "free_threaded": free_threaded,
+                "cores": cores,
+            }
+            row.update(run_one(python, available[:cores], opts))
+            rows.append(row)
+            print(json.dumps(row), file=sys.stderr, flush=True)
+
+    result = {
+        "params": {
+            k: v
+            for k, v in vars(opts).items()
+            if k not in ("report", "server", "python", "cores")
+        },
+        "runs": rows,
+        "skipped": skipped,
+    }
+    text = json.dumps(result, indent=2)
+    if opts.report:
+        with open(opts.report, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if all(not r["errors"] for r in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""cold start time per server role
+
+for each role, repeatedly starts `wormnet.py --role <role>` and times spawn
+to the first accepted connection on every listener the role opens. also
+times importing just that role's modules in a fresh interpreter, and
+whether flask got loaded.
+
+    python -m bench.startup --runs 10
+    python -m bench.startup --roles irc http
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from . import harness
+
+# what each role imports before it can listen
+IMPORTS = {
+    "irc": "wormnet.irc",
+    "http": "wormnet.http",
+    "all": "wormnet.irc, wormnet.http",
+}
+PROBE = (
+    "import sys, time; t = time.perf_counter(); import {modules};"
+    "print(time.perf_counter() - t, len(sys.modules), 'flask' in sys.modules)"
+)
+
+
+def import_cost(role):
+    """(seconds, modules loaded, flask loaded?) importing a role's modules"""
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(modules=IMPORTS[role])],
+        cwd=harness.ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(out[0]), int(out[1]), out[2] == "True"
+
+
+def time_to_listen(role):
+    """seconds from spawning wormnet.py to its listeners accepting"""
+    t0 = time.perf_counter()
+    server = harness.start_subprocess(
+        extra_config="[overload]\nenabled = false\n", role=role
+    )
+    elapsed = time.perf_counter() - t0
+    server.stop()
+    return elapsed
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--roles", nargs="+", choices=list(IMPORTS), default=None)
+    opts = parser.parse_args(argv)
+
+    results = {}
+    for role in opts.roles or list(IMPORTS):
+        imports = [import_cost(role) for _ in range(opts.runs)]
+        listen = [time_to_listen(role) for _ in range(opts.runs)]
+        results[role] = {
+            "import_ms": ms(statistics.median(i[0] for i in imports)),
+            "modules": imports[0][1],
+            "flask_loaded": imports[0][2],
+            "listen_ms": ms(statistics.median(listen)),
+            "listen_min_ms": ms(min(listen)),
+            "listen_max_ms": ms(max(listen)),
+        }
+        print(f"{role}: {json.dumps(results[role])}", file=sys.stderr, flush=True)
+
+    print(json.dumps({"runs": opts.runs, "roles": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,14 +2,34 @@
 """HostingBuddy - IRC bot for creating Worms Armageddon game lobbies"""
 
 import argparse
+import collections
+import heapq
 import logging
 import re
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
 # Global logger instance
 logger = logging.getLogger('hostingbuddy')
 
+# Base URL of the wormnet HTTP API
+HTTP_BASE = 'http://localhost:8081'
+
+# Seconds before the server drops a game nobody refreshed (wormnet GAME_TIMEOUT)
+GAME_TIMEOUT = 300
+
+# Game IDs in a GameList.asp response: <GAME name host addr loc 1 pwd id type>
+GAMELIST_ID_RE = re.compile(r'<GAME (?:\S+ ){6}(\d+) ')
+
+# HTTP client used for Game.asp calls: the requests module itself until
+# configure_http() swaps in a pooled keep-alive session
+http_client = requests
+
 
 def setup_logging(level_name):
     """Configure logging with the specified level
@@ -74,6 +94,34 @@ Examples:
 
     parser.add_argument('--public-ip', help='Public IP/hostname for game hosting (overrides detected IP from IRC)')
 
+    parser.add_argument('--http-base',
+                        default=HTTP_BASE,
+                        help=f'Base URL of the wormnet HTTP API (default: {HTTP_BASE})')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help='Commands handled concurrently, ordered per nick (default: 8)')
+
+    parser.add_argument('--game-timeout',
+                        type=int,
+                        default=GAME_TIMEOUT,
+                        help=f'Server game expiry in seconds (default: {GAME_TIMEOUT})')
+
+    parser.add_argument('--reconcile-interval',
+                        type=int,
+                        default=60,
+                        help='Seconds between GameList.asp checks for games closed elsewhere (default: 60)')
+
+    parser.add_argument('--keepalive',
+                        action='store_true',
+                        help='Refresh hosted games before the server expires them')
+
+    parser.add_argument('--max-game-age',
+                        type=int,
+                        default=3600,
+                        help='Stop refreshing a game after this many seconds (default: 3600)')
+
     return parser
 
 
@@ -82,6 +130,83 @@ def send_line(sock, line):
     sock.sendall(f'{line}\r\n'.encode('utf-8'))
 
 
+def configure_http(http_base=None, pool_size=8):
+    """Use a keep-alive session for all Game.asp calls
+
+    Args:
+        http_base: Base URL of the wormnet HTTP API (None keeps the current one)
+        pool_size: Max idle connections kept to the API, one per worker
+
+    Returns:
+        The configured requests.Session
+    """
+    global HTTP_BASE, http_client
+
+    if http_base:
+        HTTP_BASE = http_base.rstrip('/')
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    http_client = session
+    return session
+
+
+class LockedSocket:
+    """Socket wrapper that serializes sendall across worker threads"""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._lock = threading.Lock()
+
+    def sendall(self, data):
+        with self._lock:
+            self._sock.sendall(data)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class CommandDispatcher:
+    """Run commands on a worker pool, in arrival order for each key
+
+    Commands for different nicks run concurrently; commands from the same
+    nick are queued so a !close can never overtake the !host before it.
+    """
+
+    def __init__(self, workers=8):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='buddy')
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) behind any pending work for key"""
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self._queues[key] = collections.deque([(fn, args)])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                fn, args = queue.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception(f"Command for {key} failed")
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
 def connect_irc(host='localhost', port=6667):
     """Connect to IRC server and authenticate"""
     sock = socket.socket()
@@ -121,29 +246,98 @@ def handle_ping(sock, line):
 
 
 class GameState:
-    """Track active games created by users"""
+    """Track active games created by users (safe to share between workers)
+
+    Each game carries the deadline after which the server will have expired
+    it. A heap of deadlines lets the maintenance loop find due games without
+    scanning; lookups also treat a game past its deadline as gone.
+    """
 
-    def __init__(self):
+    def __init__(self, ttl=GAME_TIMEOUT):
         self.games = {}
+        self.ttl = ttl
+        self._deadlines = []  # heap of (deadline, nick, game_id)
+        self._lock = threading.Lock()
 
-    def store_game(self, nick, game_id, channel):
+    def store_game(self, nick, game_id, channel, now=None):
         """Store game info for a user"""
-        self.games[nick] = {'game_id': game_id, 'channel': channel}
+        now = now or time.time()
+        with self._lock:
+            self.games[nick] = {'game_id': game_id, 'channel': channel, 'created': now, 'deadline': now + self.ttl}
+            heapq.heappush(self._deadlines, (now + self.ttl, nick, game_id))
+
+    def refresh_game(self, nick, game_id, now=None):
+        """Push back a game's deadline after the server refreshed it
+
+        Returns False if the user no longer has that game
+        """
+        now = now or time.time()
+        with self._lock:
+            game = self.games.get(nick)
+            if not game or game['game_id'] != game_id:
+                return False
+            game['deadline'] = now + self.ttl
+            heapq.heappush(self._deadlines, (game['deadline'], nick, game_id))
+            return True
 
     def get_game(self, nick):
         """Get game info for a user, or None"""
-        return self.games.get(nick)
+        with self._lock:
+            game = self.games.get(nick)
+            if game and game['deadline'] <= time.time():
+                del self.games[nick]
+                return None
+            return game
 
     def has_game(self, nick):
         """Check if user has an active game"""
-        return nick in self.games
-
-    def remove_game(self, nick):
-        """Remove user's game from tracking"""
-        self.games.pop(nick, None)
-
-
-def create_game(nick, ip, channel, scheme='Intermediate', http_base='http://localhost:8081', public_ip=None):
+        return self.get_game(nick) is not None
+
+    def remove_game(self, nick, game_id=None):
+        """Remove user's game from tracking (only if it's game_id, when given)"""
+        with self._lock:
+            game = self.games.get(nick)
+            if game and (game_id is None or game['game_id'] == game_id):
+                del self.games[nick]
+
+    def pop_due(self, until):
+        """Take games whose deadline is at or before until off the heap
+
+        Returns a list of (nick, game). The games stay tracked; the caller
+        either refreshes them (which schedules a new deadline) or removes them.
+        """
+        due = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= until:
+                deadline, nick, game_id = heapq.heappop(self._deadlines)
+                game = self.games.get(nick)
+                # skip entries superseded by a refresh, a close or a new game
+                if game and game['game_id'] == game_id and game['deadline'] == deadline:
+                    due.append((nick, dict(game)))
+        return due
+
+    def requeue(self, nick, game):
+        """Put a game taken by pop_due back on the heap at its current deadline"""
+        with self._lock:
+            heapq.heappush(self._deadlines, (game['deadline'], nick, game['game_id']))
+
+    def expire(self, now=None):
+        """Forget games the server has dropped by now, returns their nicks"""
+        due = self.pop_due(now or time.time())
+        for nick, game in due:
+            self.remove_game(nick, game['game_id'])
+        return [nick for nick, _ in due]
+
+    def games_by_channel(self):
+        """{channel: [(nick, game), ...]} snapshot of tracked games"""
+        channels = collections.defaultdict(list)
+        with self._lock:
+            for nick, game in self.games.items():
+                channels[game['channel']].append((nick, dict(game)))
+        return dict(channels)
+
+
+def create_game(nick, ip, channel, scheme='Intermediate', http_base=None, public_ip=None):
     """Create game via HTTP API
 
     Returns game_id on success, None on failure
@@ -151,7 +345,7 @@ def create_game(nick, ip, channel, scheme='Intermediate', http_base='http://loca
     # Use public_ip if provided, otherwise fall back to detected IP
     host_ip = public_ip if public_ip else ip
 
-    url = f'{http_base}/wormageddonweb/Game.asp'
+    url = f'{http_base or HTTP_BASE}/wormageddonweb/Game.asp'
     params = {
         'Cmd': 'Create',
         'Name': f"{scheme}.for.{nick}",
@@ -166,7 +360,7 @@ def create_game(nick, ip, channel, scheme='Intermediate', http_base='http://loca
 
     try:
         logger.debug(f"Creating game: {url}?{params}")
-        response = requests.get(url, params=params, timeout=5)
+        response = http_client.get(url, params=params, timeout=5)
         logger.debug(f"Response status: {response.status_code}")
         logger.debug(f"Response text: {response.text!r}")
         logger.debug(f"Response headers: {dict(response.headers)}")
@@ -182,21 +376,126 @@ def create_game(nick, ip, channel, scheme='Intermediate', http_base='http://loca
     return None
 
 
-def close_game(game_id, http_base='http://localhost:8081'):
+def close_game(game_id, http_base=None):
     """Close game via HTTP API
 
     Returns True on success, False on failure
     """
-    url = f'{http_base}/wormageddonweb/Game.asp'
+    url = f'{http_base or HTTP_BASE}/wormageddonweb/Game.asp'
     params = {'Cmd': 'Close', 'GameID': game_id}
 
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = http_client.get(url, params=params, timeout=5)
         return response.status_code == 200
     except Exception:
         return False
 
 
+def refresh_game(game_id, http_base=None):
+    """Restart a game's expiry clock on the server
+
+    Returns True if refreshed, False if the server no longer has the game,
+    None if the request failed
+    """
+    url = f'{http_base or HTTP_BASE}/wormageddonweb/Game.asp'
+    params = {'Cmd': 'Refresh', 'GameID': game_id}
+
+    try:
+        response = http_client.get(url, params=params, timeout=5)
+    except Exception as e:
+        logger.warning(f"Exception refreshing game {game_id}: {e}")
+        return None
+    if response.status_code == 404:
+        return False
+    return True if response.status_code == 200 else None
+
+
+class Reconciler:
+    """Keep GameState in line with what the server actually lists
+
+    Every tick drops games past their deadline (or, with keepalive, refreshes
+    them shortly before it). Every interval it fetches GameList.asp for each
+    channel it has games in, with If-None-Match so an unchanged list costs a
+    bodyless 304, and forgets games that are no longer listed.
+    """
+
+    def __init__(self, state, interval=60, keepalive=False, max_age=3600, http_base=None):
+        self.state = state
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_age = max_age
+        self.http_base = http_base
+        self.etags = {}  # channel -> ETag of the last list we saw
+        self.next_reconcile = time.time() + interval
+
+    def fetch_game_ids(self, channel):
+        """IDs listed in channel, or None if unchanged since last time or on error"""
+        url = f'{self.http_base or HTTP_BASE}/wormageddonweb/GameList.asp'
+        headers = {'If-None-Match': self.etags[channel]} if channel in self.etags else {}
+
+        try:
+            response = http_client.get(url, params={'Channel': channel}, headers=headers, timeout=5)
+        except Exception as e:
+            logger.warning(f"Exception fetching game list for {channel}: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        if 'ETag' in response.headers:
+            self.etags[channel] = response.headers['ETag']
+        return {int(gid) for gid in GAMELIST_ID_RE.findall(response.text)}
+
+    def reconcile(self):
+        """Forget tracked games the server no longer lists"""
+        dropped = []
+        for channel, games in self.state.games_by_channel().items():
+            started = time.time()
+            listed = self.fetch_game_ids(channel)
+            if listed is None:
+                continue
+            for nick, game in games:
+                # a game created while the list was in flight may not be in it yet
+                if game['game_id'] not in listed and game['created'] < started:
+                    self.state.remove_game(nick, game['game_id'])
+                    dropped.append(nick)
+        if dropped:
+            logger.info(f"Reconciled: dropped games of {', '.join(dropped)}")
+        return dropped
+
+    def refresh_due(self, now):
+        """Refresh games nearing their deadline, forget those the server lost"""
+        margin = self.state.ttl / 5
+        for nick, game in self.state.pop_due(now + margin):
+            if now - game['created'] > self.max_age:
+                # let it lapse at its deadline like any other game
+                self.state.requeue(nick, game)
+                continue
+            result = refresh_game(game['game_id'], http_base=self.http_base)
+            if result:
+                self.state.refresh_game(nick, game['game_id'], now)
+            elif result is False:
+                self.state.remove_game(nick, game['game_id'])
+            else:
+                # request failed; try again next tick until the deadline passes
+                self.state.requeue(nick, game)
+
+    def tick(self, now=None):
+        now = now or time.time()
+        if self.keepalive:
+            self.refresh_due(now)
+        self.state.expire(now)
+        if now >= self.next_reconcile:
+            self.next_reconcile = now + self.interval
+            self.reconcile()
+
+    def run(self, stop, period=1.0):
+        """Tick until the stop event is set"""
+        while not stop.wait(period):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Game maintenance failed")
+
+
 def handle_host_command(sock, msg, state, channel='#hell', public_ip=None):
     """Handle !host command to create a game"""
     nick = msg['nick']
@@ -243,13 +542,40 @@ def handle_close_command(sock, msg, state):
         send_line(sock, f"PRIVMSG {reply_to} :{nick}: Failed to close game")
 
 
-def run_bot(host='localhost', port=6667, channels=None, public_ip=None):
-    """Main bot loop"""
+def dispatch_command(sock, msg, state, dispatcher, public_ip=None):
+    """Queue a parsed command on the worker pool, ordered per nick"""
+    if msg['command'] == 'host':
+        # Extract channel from target or default
+        channel = msg['target'].lstrip('#') if msg['target'].startswith('#') else 'hell'
+        dispatcher.submit(msg['nick'], handle_host_command, sock, msg, state, channel, public_ip)
+    elif msg['command'] == 'close':
+        dispatcher.submit(msg['nick'], handle_close_command, sock, msg, state)
+
+
+def run_bot(host='localhost',
+            port=6667,
+            channels=None,
+            public_ip=None,
+            http_base=None,
+            workers=8,
+            game_timeout=GAME_TIMEOUT,
+            reconcile_interval=60,
+            keepalive=False,
+            max_game_age=3600):
+    """Main bot loop
+
+    The recv loop only parses lines and answers PINGs; !host and !close run
+    on a worker pool so a slow Game.asp call never stalls other users, and a
+    maintenance thread keeps the tracked games in line with the server.
+    """
     if channels is None:
         channels = ['#hell']
 
+    configure_http(http_base, pool_size=workers)
+    dispatcher = CommandDispatcher(workers)
+
     logger.info(f"Connecting to {host}:{port}...")
-    sock = connect_irc(host, port)
+    sock = LockedSocket(connect_irc(host, port))
 
     # Join channels
     for channel in channels:
@@ -259,9 +585,13 @@ def run_bot(host='localhost', port=6667, channels=None, public_ip=None):
     if public_ip:
         logger.info(f"Using public IP for games: {public_ip}")
 
-    state = GameState()
+    state = GameState(ttl=game_timeout)
     buffer = ''
 
+    stop = threading.Event()
+    reconciler = Reconciler(state, reconcile_interval, keepalive, max_game_age)
+    threading.Thread(target=reconciler.run, args=(stop, ), name='buddy-maintenance', daemon=True).start()
+
     logger.info("HostingBuddy ready!")
 
     try:
@@ -289,16 +619,13 @@ def run_bot(host='localhost', port=6667, channels=None, public_ip=None):
                 # Handle commands
                 msg = parse_privmsg(line)
                 if msg:
-                    if msg['command'] == 'host':
-                        # Extract channel from target or default
-                        channel = msg['target'].lstrip('#') if msg['target'].startswith('#') else 'hell'
-                        handle_host_command(sock, msg, state, channel, public_ip=public_ip)
-                    elif msg['command'] == 'close':
-                        handle_close_command(sock, msg, state)
+                    dispatch_command(sock, msg, state, dispatcher, public_ip=public_ip)
 
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     finally:
+        stop.set()
+        dispatcher.shutdown(wait=True)
         sock.close()
 
 
@@ -311,10 +638,20 @@ def main():
     setup_logging(args.log_level)
 
     logger.info("Starting HostingBuddy")
-    logger.debug(f"Arguments: host={args.host}, port={args.port}, channels={args.channels}, public_ip={args.public_ip}")
+    logger.debug(f"Arguments: host={args.host}, port={args.port}, channels={args.channels}, public_ip={args.public_ip}, "
+                 f"http_base={args.http_base}, workers={args.workers}, keepalive={args.keepalive}")
 
     # Run the bot
-    run_bot(host=args.host, port=args.port, channels=args.channels, public_ip=args.public_ip)
+    run_bot(host=args.host,
+            port=args.port,
+            channels=args.channels,
+            public_ip=args.public_ip,
+            http_base=args.http_base,
+            workers=args.workers,
+            game_timeout=args.game_timeout,
+            reconcile_interval=args.reconcile_interval,
+            keepalive=args.keepalive,
+            max_game_age=args.max_game_age)
 
 
 if __name__ == '__main__':
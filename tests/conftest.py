@@ -11,7 +11,11 @@ from wormnet import config, state as state_module
 def reset_state():
     """Reset global state before each test"""
     state_module.irc_clients.clear()
+    state_module.irc_connections.clear()
     state_module.games.clear()
+    state_module.game_hosts.clear()
+    state_module.game_sessions.clear()
+    state_module.game_creators.clear()
 
 
 @pytest.fixture
@@ -92,6 +96,7 @@ class IRCTestClient:
         self.port = port
         self.sock = None
         self.responses = []
+        self.buf = b""
 
     def connect(self):
         """Connect to IRC server"""
@@ -104,15 +109,14 @@ class IRCTestClient:
         self.sock.sendall(f"{line}\r\n".encode())
 
     def recv_line(self):
-        """Receive one line"""
-        buf = b""
-        while b"\n" not in buf:
+        """Receive one line, keeping any following lines for the next call"""
+        while b"\n" not in self.buf:
             chunk = self.sock.recv(4096)
             if not chunk:
                 break
-            buf += chunk
-        if b"\n" in buf:
-            line, rest = buf.split(b"\n", 1)
+            self.buf += chunk
+        if b"\n" in self.buf:
+            line, self.buf = self.buf.split(b"\n", 1)
             decoded = line.decode().strip()
             self.responses.append(decoded)
             return decoded
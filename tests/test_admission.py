@@ -0,0 +1,110 @@
+"""
+Tests for admission control on the IRC and HTTP listeners
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+from wormnet import admission, irc
+from wormnet.http import GatedWSGIServer, app
+
+
+def test_token_bucket_paces_after_burst():
+    """The burst is free, after that tokens arrive at the configured rate"""
+    bucket = admission.TokenBucket(rate=50, burst=5)
+    assert all(bucket.take() for _ in range(5))
+    assert bucket.take() is False
+
+    t0 = time.monotonic()
+    for _ in range(5):
+        bucket.wait()
+    assert time.monotonic() - t0 >= 0.07  # 5 tokens at 50/s, with slack
+
+
+def test_token_bucket_unlimited():
+    bucket = admission.TokenBucket(rate=0, burst=1)
+    assert all(bucket.take() for _ in range(1000))
+
+
+def test_gate_caps_and_release():
+    """Global and per-ip caps refuse, exempt ips skip the per-ip cap"""
+    gate = admission.Gate("test", max_clients=3, max_per_ip=2, exempt=["127.0.0.1"])
+    assert gate.admit("10.0.0.1") is None
+    assert gate.admit("10.0.0.1") is None
+    assert "Too many" in gate.admit("10.0.0.1")
+    assert gate.admit("127.0.0.1") is None
+    assert gate.admit("10.0.0.2") == "Server full"
+
+    gate.release("10.0.0.1")
+    assert gate.admit("10.0.0.2") is None
+    stats = gate.stats()
+    assert stats["active"] == 3
+    assert stats["rejected"] == {"per ip": 1, "server full": 1}
+
+
+@pytest.fixture
+def irc_listener(setup_test_config):
+    """irc.serve on an ephemeral port with a strict gate"""
+    gate = admission.Gate("irc", max_clients=10, max_per_ip=2)
+    sock = socket.create_server(("127.0.0.1", 0))
+    thread = threading.Thread(target=irc.serve, args=(sock, gate, 8), daemon=True)
+    thread.start()
+    yield sock.getsockname()[1], gate
+    sock.close()
+    thread.join(timeout=3)
+
+
+def test_irc_per_ip_cap(irc_listener):
+    """The connection past the per-ip cap gets an ERROR and is closed"""
+    port, gate = irc_listener
+    kept = [socket.create_connection(("127.0.0.1", port)) for _ in range(2)]
+    extra = socket.create_connection(("127.0.0.1", port), timeout=2)
+    data = extra.recv(200)
+    assert data.startswith(b"ERROR :Closing Link: 127.0.0.1 (Too many")
+    assert extra.recv(200) == b""
+
+    # closing an admitted connection frees its slot
+    kept.pop().close()
+    deadline = time.time() + 2
+    while gate.active > 1 and time.time() < deadline:
+        time.sleep(0.01)
+    again = socket.create_connection(("127.0.0.1", port), timeout=2)
+    again.sendall(b"PASS x\r\n")
+    again.settimeout(0.3)
+    with pytest.raises(socket.timeout):
+        again.recv(200)  # admitted: no ERROR, the server waits for NICK/USER
+    for s in kept + [extra, again]:
+        s.close()
+
+
+def test_http_refuses_over_cap():
+    """Past the per-ip cap the http listener answers 503 without a request"""
+    gate = admission.Gate("http", max_per_ip=1)
+    server = GatedWSGIServer("127.0.0.1", 0, app, gate, backlog=16)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_port
+        # an idle connection holds its slot until the handler finishes
+        held = socket.create_connection(("127.0.0.1", port))
+        deadline = time.time() + 2
+        while gate.active < 1 and time.time() < deadline:
+            time.sleep(0.01)
+
+        refused = socket.create_connection(("127.0.0.1", port), timeout=2)
+        assert refused.recv(100).startswith(b"HTTP/1.0 503")
+
+        held.sendall(b"GET /wormageddonweb/Login.asp HTTP/1.0\r\n\r\n")
+        response = b""
+        while chunk := held.recv(4096):
+            response += chunk
+        assert b"<CONNECT" in response
+        held.close()
+        deadline = time.time() + 2
+        while gate.active and time.time() < deadline:
+            time.sleep(0.01)
+        assert gate.active == 0
+    finally:
+        server.shutdown()
+        server.server_close()
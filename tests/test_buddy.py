@@ -0,0 +1,145 @@
+"""
+Tests for the game store and the embedded HostingBuddy
+"""
+
+import time
+from unittest.mock import Mock
+
+import pytest
+from wormnet import buddy, config, games, state
+from wormnet.irc import IRCClient
+
+
+def make_player(nick, ip="10.0.0.5", channels=("#heaven",)):
+    client = IRCClient(Mock(), (ip, 4000))
+    client.nickname = nick
+    client.username = nick
+    client.password = config.PASSWORD
+    client.registered = True
+    state.irc_clients.append(client)
+    for channame in channels:
+        client.channels.add(channame)
+        state.irc_channels[channame]["users"].add(nick)
+    return client
+
+
+def sent(client):
+    return [c[0][0].decode().strip() for c in client.sock.sendall.call_args_list]
+
+
+@pytest.fixture
+def bot(setup_test_config):
+    """Embedded buddy in every test channel, driven synchronously"""
+    bot = buddy.HostingBuddy("HostingBuddy")
+    bot.join(list(state.irc_channels))
+    yield bot
+    bot.leave()
+
+
+def deliver(bot):
+    """Run whatever the irc side queued for the buddy"""
+    while not bot.inbox.empty():
+        bot.handle_line(bot.inbox.get())
+
+
+def test_store_create_close_get():
+    """Games are created with sequential ids and vanish once closed"""
+    gid = games.create("x" * 40, "Player1", "1.2.3.4:17011", "heaven")
+    game = games.get(gid)
+    assert game["name"] == "x" * 29
+    assert games.for_channel("heaven") == [state.games[gid]]
+    assert games.close(gid) is True
+    assert games.close(gid) is False
+    assert games.get(gid) is None
+
+
+def test_store_get_hides_expired(monkeypatch):
+    """An expired game reads as gone even before cleanup runs"""
+    gid = games.create("g", "Player1", "1.2.3.4:17011", "heaven")
+    state.games[gid]["created"] = time.time() - config.GAME_TIMEOUT - 1
+    assert games.get(gid) is None
+    games.cleanup()
+    assert gid not in state.games
+
+
+def test_buddy_listed_in_channel(bot):
+    """The buddy shows up in NAMES like a normal user"""
+    player = make_player("Player1")
+    player.process_line("NAMES #heaven")
+    assert "HostingBuddy" in sent(player)[0]
+
+
+def test_private_host_and_close(bot):
+    """!host by PM lists a game in the player's channel at their ip"""
+    player = make_player("Player1", ip="10.0.0.5")
+    player.process_line("PRIVMSG HostingBuddy :!host")
+    deliver(bot)
+
+    [game] = games.for_channel("heaven")
+    assert game["host"] == "Player1"
+    assert game["address"] == "10.0.0.5:17011"
+    reply = sent(player)[-1]
+    assert reply.startswith(":HostingBuddy!~HostingBuddy@")
+    assert f"Game created (ID: {game['id']}" in reply
+
+    player.process_line("PRIVMSG HostingBuddy :!host")
+    deliver(bot)
+    assert "Close your existing game first" in sent(player)[-1]
+
+    player.process_line("PRIVMSG HostingBuddy :close")
+    deliver(bot)
+    assert "Game closed." in sent(player)[-1]
+    assert games.for_channel("heaven") == []
+
+
+def test_channel_host_replies_to_channel(bot):
+    """!host in a channel lists the game there and answers the whole channel"""
+    player = make_player("Player1", channels=("#heaven", "#AnythingGoes"))
+    watcher = make_player("Watcher", channels=("#AnythingGoes",))
+    player.process_line("PRIVMSG #AnythingGoes :!host")
+    deliver(bot)
+
+    [game] = games.for_channel("AnythingGoes")
+    assert game["host"] == "Player1"
+    assert "PRIVMSG #AnythingGoes :Player1: Game created" in sent(watcher)[-1]
+
+
+def test_expired_game_can_be_rehosted(bot):
+    """A game the server expired doesn't block the next !host"""
+    player = make_player("Player1")
+    player.process_line("PRIVMSG HostingBuddy :!host")
+    deliver(bot)
+    [game] = games.for_channel("heaven")
+    state.games[game["id"]]["created"] = time.time() - config.GAME_TIMEOUT - 1
+
+    player.process_line("PRIVMSG HostingBuddy :!host")
+    deliver(bot)
+    assert "Game created" in sent(player)[-1]
+
+
+def test_public_ip_override(bot):
+    """A configured public ip is advertised instead of the player's"""
+    bot.public_ip = "relay.example.com"
+    player = make_player("Player1")
+    player.process_line("PRIVMSG HostingBuddy :!host")
+    deliver(bot)
+    [game] = games.for_channel("heaven")
+    assert game["address"] == "relay.example.com:17011"
+
+
+def test_start_from_config(setup_test_config, monkeypatch):
+    """start() joins the configured channels and handles lines on a thread"""
+    monkeypatch.setattr(config, "BUDDY_CHANNELS", ["heaven"])
+    bot = buddy.start()
+    try:
+        assert bot.channels == {"#heaven"}
+        player = make_player("Player1")
+        player.process_line("PRIVMSG HostingBuddy :!host")
+        deadline = time.time() + 2
+        while not games.for_channel("heaven") and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(games.for_channel("heaven")) == 1
+    finally:
+        buddy.stop()
+    assert bot not in state.irc_clients
+    assert "HostingBuddy" not in state.irc_channels["#heaven"]["users"]
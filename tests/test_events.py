@@ -0,0 +1,109 @@
+"""
+Tests for the state change event bus
+"""
+
+import threading
+from unittest.mock import Mock
+
+import pytest
+from wormnet import events, games
+from wormnet.irc import IRCClient
+
+
+@pytest.fixture
+def seen():
+    batches = []
+
+    def subscriber(batch):
+        batches.append(batch)
+
+    events.subscribe(subscriber)
+    yield batches
+    events.unsubscribe(subscriber)
+
+
+def flat(batches):
+    return [event for batch in batches for event in batch]
+
+
+def test_irc_session_publishes_in_order(setup_test_config, seen):
+    client = IRCClient(Mock(), ("192.0.2.1", 5000))
+    for line in (
+        "PASS ELSILRACLIHP",
+        "NICK alice",
+        "USER alice h s :0 11 US",
+        "JOIN #AnythingGoes,#heaven",
+        "PART #heaven",
+        "NICK alicia",
+        "QUIT :bye",
+    ):
+        client.process_line(line)
+    client.cleanup()
+    assert [type(e).__name__ for e in flat(seen)] == [
+        "UserRegistered",
+        "ChannelJoined",
+        "ChannelJoined",
+        "ChannelParted",
+        "NickChanged",
+        "UserQuit",
+    ]
+    quit = flat(seen)[-1]
+    assert quit.client is client and quit.channels == ("#AnythingGoes",)
+    assert flat(seen)[-2].old == "alice"
+
+
+def test_game_changes_are_published(seen):
+    first = games.create("g", "alice", "192.0.2.1:17011", "heaven", password="x")
+    games.close(first)
+    published = flat(seen)
+    assert [type(e) for e in published] == [events.GameCreated, events.GameClosed]
+    assert published[0].game["id"] == first and published[0].game["password"]
+
+
+def test_subscribers_get_only_their_types():
+    got = []
+    events.subscribe(got.extend, events.GameClosed)
+    try:
+        games.close(games.create("g", "alice", "192.0.2.1:17011", "heaven"))
+    finally:
+        events.unsubscribe(got.extend)
+    assert [type(e) for e in got] == [events.GameClosed]
+
+
+def test_events_from_other_threads_batch_behind_the_dispatcher(seen):
+    bus = events.Bus()
+    batches = []
+    delivering, release = threading.Event(), threading.Event()
+
+    def slow(batch):
+        batches.append(batch)
+        delivering.set()
+        release.wait(2)
+
+    bus.subscribe(slow)
+    first = threading.Thread(target=bus.publish, args=(1,))
+    first.start()
+    delivering.wait(2)
+    for n in range(2, 6):
+        bus.publish(n)  # returns at once: the first thread is delivering
+    release.set()
+    first.join()
+    assert batches == [[1], [2, 3, 4, 5]]
+
+
+def test_a_failing_subscriber_doesnt_stop_delivery():
+    bus = events.Bus()
+    got = []
+    bus.subscribe(lambda batch: 1 / 0)
+    bus.subscribe(got.extend)
+    bus.publish("a")
+    bus.publish("b")
+    assert got == ["a", "b"]
+    assert bus.stats()["errors"] == 2
+
+
+def test_nothing_is_queued_without_subscribers():
+    bus = events.Bus()
+    bus.post("a")
+    bus.publish("b")
+    assert not bus.queue and bus.batches == 0
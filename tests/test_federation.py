@@ -0,0 +1,316 @@
+"""
+Tests for server-to-server federation
+"""
+
+import socket
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from bench import harness
+from tests.conftest import IRCTestClient
+from wormnet import config, federation, games, state
+from wormnet.irc import IRCClient
+
+
+@pytest.fixture
+def fed_config(setup_test_config, monkeypatch):
+    monkeypatch.setattr(config, "FEDERATION_ENABLED", True)
+    monkeypatch.setattr(config, "FEDERATION_NAME", "local")
+    monkeypatch.setattr(config, "FEDERATION_NODE_ID", 1)
+    monkeypatch.setattr(config, "FEDERATION_PASSWORD", "secret")
+
+
+class Peer:
+    """the far end of a link, speaking the protocol by hand"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.settimeout(2)
+        self.reader = sock.makefile("r", encoding="utf-8", newline="\n")
+
+    def send(self, line):
+        self.sock.sendall(f"{line}\n".encode())
+
+    def recv(self):
+        return self.reader.readline().rstrip("\n")
+
+    def recv_until(self, prefix):
+        lines = []
+        while not lines or not lines[-1].startswith(prefix):
+            line = self.recv()
+            assert line, f"closed waiting for {prefix}"
+            lines.append(line)
+        return lines
+
+    def sync(self):
+        """everything the node sent before now"""
+        self.send("PING sync")
+        return self.recv_until("PONG")[:-1]
+
+    def close(self):
+        # the reader holds the fd open, so close() alone sends no FIN
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+
+@pytest.fixture
+def link(fed_config):
+    """a node 'remote' (id 2) linked to us, after both bursts"""
+    ours, theirs = socket.socketpair()
+    thread = threading.Thread(target=federation.serve, args=(ours, False))
+    thread.start()
+    peer = Peer(theirs)
+    peer.send("SERVER remote 2 secret")
+    assert peer.recv() == "SERVER local 1 secret"
+    peer.burst = peer.recv_until("EOB")
+    peer.send("EOB")
+    wait_for(lambda: federation.links and federation.links[0].synced.is_set())
+    yield peer
+    peer.close()
+    thread.join(timeout=2)
+    assert not federation.links
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def local(nick, *channels):
+    client = IRCClient(Mock(), ("192.0.2.1", 5000))
+    for line in ("PASS ELSILRACLIHP", f"NICK {nick}", f"USER {nick} h s :0 11 US"):
+        client.process_line(line)
+    for channame in channels:
+        client.process_line(f"JOIN {channame}")
+    client.sock.sendall.reset_mock()
+    return client
+
+
+def sent(client):
+    return [c.args[0].decode() for c in client.sock.sendall.call_args_list]
+
+
+def test_bad_password_refused(fed_config):
+    ours, theirs = socket.socketpair()
+    thread = threading.Thread(target=federation.serve, args=(ours, False))
+    thread.start()
+    peer = Peer(theirs)
+    peer.send("SERVER remote 2 wrong")
+    assert peer.recv() == "ERROR :Bad password"
+    thread.join(timeout=2)
+    assert not federation.links
+
+
+def test_burst_and_remote_users(setup_test_config, fed_config):
+    alice = local("alice", "#heaven")
+    ours, theirs = socket.socketpair()
+    threading.Thread(target=federation.serve, args=(ours, False), daemon=True).start()
+    peer = Peer(theirs)
+    peer.send("SERVER remote 2 secret")
+    peer.recv()
+    burst = peer.recv_until("EOB")
+    assert burst[0].startswith("UID alice ")
+    assert burst[0].endswith(" 192.0.2.1 #heaven :0 11 US")
+
+    peer.send("UID bob 10.5 bob 198.51.100.7 #heaven :0 12 GB")
+    peer.send("EOB")
+    wait_for(lambda: federation.is_remote("bob"))
+    assert any("bob!~bob@198.51.100.7 JOIN :#heaven" in line for line in sent(alice))
+
+    alice.process_line("NAMES #heaven")
+    alice.process_line("WHO #heaven")
+    lines = sent(alice)
+    assert any(" 353 " in line and "bob" in line for line in lines)
+    assert any(" 352 " in line and " bob H :0 0 12 GB" in line for line in lines)
+    peer.close()
+    wait_for(lambda: not federation.links)
+
+
+def test_channel_messages_go_only_where_members_are(link):
+    alice = local("alice", "#heaven")
+    assert link.recv_until("JOIN alice")[-1] == "JOIN alice #heaven"
+    alice.process_line("PRIVMSG #heaven :nobody there")
+    assert not any("PRIVMSG" in line for line in link.sync())
+
+    link.send("UID bob 10.5 bob 198.51.100.7 #heaven :0 12 GB")
+    link.sync()
+    alice.process_line("PRIVMSG #heaven :hi bob")
+    assert "PRIVMSG alice #heaven :hi bob" in link.sync()
+
+    link.send("PRIVMSG bob #heaven :hi alice")
+    link.sync()
+    assert ":bob PRIVMSG #heaven :hi alice\r\n" in sent(alice)
+
+
+def test_private_messages_are_routed(link):
+    alice = local("alice")
+    link.send("UID bob 10.5 bob 198.51.100.7 * :0 12 GB")
+    link.sync()
+    alice.process_line("PRIVMSG bob :psst")
+    assert "ROUTE bob :alice!~alice@192.0.2.1 PRIVMSG bob :psst" in link.sync()
+
+    link.send("ROUTE alice :bob!~bob@198.51.100.7 PRIVMSG alice :back")
+    link.sync()
+    assert ":bob!~bob@198.51.100.7 PRIVMSG alice :back\r\n" in sent(alice)
+
+
+def test_remote_nick_is_in_use(link):
+    link.send("UID bob 10.5 bob 198.51.100.7 * :0 12 GB")
+    link.sync()
+    client = IRCClient(Mock(), ("192.0.2.1", 5000))
+    client.process_line("NICK bob")
+    assert client.nickname is None
+    assert " 433 * bob " in sent(client)[0]
+
+
+def test_nick_collision_older_wins(link):
+    alice = local("alice", "#heaven")
+    link.sync()
+
+    # newer than ours: ignored here, the other node kills its own
+    link.send(f"UID alice {alice.nick_ts + 1!r} a 198.51.100.7 * :x")
+    link.sync()
+    assert state.irc_clients.find("alice") is alice
+
+    # older: ours is killed and theirs takes the nick
+    link.send(f"UID alice {alice.nick_ts - 1!r} a 198.51.100.7 #heaven :x")
+    lines = link.sync()
+    assert federation.is_remote("alice")
+    assert "QUIT alice :Nick collision" in lines
+    alice.sock.shutdown.assert_called_once()
+    assert "alice" in state.irc_channels["#heaven"]["users"]
+
+
+def test_nick_collision_tie_goes_to_lower_name(link):
+    alice = local("alice")
+    link.sync()
+    link.send(f"UID alice {alice.nick_ts!r} a 198.51.100.7 * :x")
+    link.sync()
+    # "local" < "remote"
+    assert state.irc_clients.find("alice") is alice
+
+
+def test_games_are_mirrored(link):
+    gid = games.create("mine", "alice", "192.0.2.1", "heaven")
+    assert games.node_of(gid) == 1
+    lines = link.sync()
+    assert lines[-1].startswith("GAME 0.0") and f'"id":{gid}' in lines[-1]
+    games.close(gid)
+    assert link.sync() == [f"UNGAME {gid}"]
+
+    theirs = 5 << games.NODE_BITS | 2
+    link.send(
+        f'GAME 12.0 {{"id":{theirs},"name":"yours","host":"bob","address":"x",'
+        '"password":null,"channel":"heaven","location":"","type":"0","scheme":""}'
+    )
+    link.sync()
+    listed = games.for_channel("heaven")
+    assert [g["name"] for g in listed] == ["yours"]
+    assert 11 < time.time() - listed[0]["created"] < 13
+
+
+def test_bound_games_survive_a_timeout_on_every_node(link, monkeypatch):
+    """only the listing node expires or refreshes a game; peers follow it"""
+    monkeypatch.setattr(config, "GAME_TIMEOUT", 60)
+    local("alice")
+    bound = games.create("g", "alice", "192.0.2.1:17011", "heaven", host_ip="192.0.2.1")
+    unbound = games.create("g", "carol", "192.0.2.3:17011", "heaven")
+    theirs = 5 << games.NODE_BITS | 2
+    link.send(
+        f'GAME 61 {{"id":{theirs},"name":"g","host":"bob","address":"x",'
+        '"password":null,"channel":"heaven","location":"","type":"0","scheme":""}'
+    )
+    link.sync()
+    for gid in (bound, unbound):
+        state.games[gid]["created"] -= 61
+
+    games.cleanup()
+    listed = {g["id"] for g in games.for_channel("heaven")}
+    # their game outlived the timeout here, since their node keeps it listed
+    assert listed == {bound, theirs}
+    lines = link.sync()
+    assert [line.split(" ")[0] for line in lines] == ["GAME", "UNGAME"]
+    assert f'"id":{bound}' in lines[0] and lines[1] == f"UNGAME {unbound}"
+
+    link.send(f"UNGAME {theirs}")
+    link.sync()
+    assert {g["id"] for g in games.for_channel("heaven")} == {bound}
+
+
+def test_split_quits_users_and_unlists_games(link):
+    alice = local("alice", "#heaven")
+    link.send("UID bob 10.5 bob 198.51.100.7 #heaven :0 12 GB")
+    link.send(
+        f'GAME 0 {{"id":{1 << games.NODE_BITS | 2},"name":"g","host":"bob",'
+        '"address":"x","password":null,"channel":"heaven","location":"",'
+        '"type":"0","scheme":""}'
+    )
+    link.sync()
+    assert games.for_channel("heaven")
+
+    link.close()
+    wait_for(lambda: not federation.links)
+    assert ":bob QUIT :local remote\r\n" in sent(alice)
+    assert state.irc_clients.find("bob") is None
+    assert "bob" not in state.irc_channels["#heaven"]["users"]
+    assert games.for_channel("heaven") == []
+
+
+def test_two_nodes_on_localhost():
+    fed_a, fed_b = harness.free_port(), harness.free_port()
+    section = '[federation]\nenabled = true\npassword = "pw"\nreconnect = 0.2\n'
+    a = harness.start_subprocess(
+        extra_config=f'{section}name = "a"\nnode_id = 1\nport = {fed_a}\n'
+    )
+    b = harness.start_subprocess(
+        extra_config=f'{section}name = "b"\nnode_id = 2\nport = {fed_b}\n'
+        f'peers = ["127.0.0.1:{fed_a}"]\n'
+    )
+    clients = []
+    try:
+        for server, nick in ((a, "alice"), (b, "bob")):
+            client = IRCTestClient(server.host, server.irc_port)
+            client.connect()
+            client.send("PASS ELSILRACLIHP")
+            client.send(f"NICK {nick}")
+            client.send(f"USER {nick} h s :0 11 US 3.8.1")
+            client.recv_until(" 376 ")
+            client.send("JOIN #AnythingGoes")
+            client.recv_until(" 366 ")
+            clients.append(client)
+        alice, bob = clients
+
+        deadline = time.monotonic() + 5
+        while not any("bob" in line for line in alice.recv_until(" 366 ")):
+            assert time.monotonic() < deadline, "nodes never linked"
+            time.sleep(0.1)
+            alice.send("NAMES #AnythingGoes")
+
+        bob.send("PRIVMSG #AnythingGoes :across the link")
+        assert any("across the link" in line for line in alice.recv_until("across"))
+
+        b.stop()
+        assert any("bob QUIT :a b" in line for line in alice.recv_until("QUIT"))
+    finally:
+        for client in clients:
+            client.close()
+        a.stop()
+        b.stop()
+
+
+def test_message_bytes_cross_the_link(link):
+    alice = local("alice", "#heaven")
+    link.send("UID bob 10.5 bob 198.51.100.7 #heaven :0 12 GB")
+    link.sync()
+    alice.feed(b"PRIVMSG #heaven :caf\xe9 \x80\r\n")
+    assert "PRIVMSG alice #heaven :caf\xe9 \x80" in link.sync()
+
+    link.send("PRIVMSG bob #heaven :d\xe9j\xe0")
+    link.sync()
+    assert alice.sock.sendall.call_args_list[-1].args[0] == (
+        b":bob PRIVMSG #heaven :d\xe9j\xe0\r\n"
+    )
@@ -0,0 +1,248 @@
+"""
+Tests for binding games to their host's IRC session
+"""
+
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from wormnet import config, games, state
+from wormnet.http import app
+from wormnet.irc import IRCClient
+
+
+def online(nick, ip="192.0.2.1"):
+    client = IRCClient(Mock(), (ip, 5000))
+    for line in ("PASS ELSILRACLIHP", f"NICK {nick}", f"USER {nick} h s :0 11 US"):
+        client.process_line(line)
+    return client
+
+
+def create(host, host_ip, port=17011, **kwargs):
+    address = f"{host_ip}:{port}"
+    return games.create("g", host, address, "heaven", host_ip=host_ip, **kwargs)
+
+
+def test_games_close_when_the_host_quits(setup_test_config):
+    alice, bob = online("alice"), online("bob", "192.0.2.2")
+    mine = [create("alice", "192.0.2.1", port) for port in (17011, 17012)]
+    theirs = create("bob", "192.0.2.2")
+    assert state.game_hosts[alice] == set(mine)
+
+    alice.process_line("QUIT :bye")
+    assert [g["id"] for g in games.for_channel("heaven")] == [theirs]
+    assert alice not in state.game_hosts
+    assert not set(mine) & set(state.game_sessions)
+
+    bob.cleanup()
+    assert games.for_channel("heaven") == []
+
+
+@pytest.mark.parametrize("host, ip", [("carol", "192.0.2.1"), ("alice", "10.9.9.9")])
+def test_unbound_without_a_matching_session(setup_test_config, host, ip):
+    alice = online("alice")
+    gid = create(host, ip)
+    assert gid not in state.game_sessions
+    alice.process_line("QUIT")
+    assert games.get(gid) is not None
+
+
+def test_timeout_is_refreshed_while_the_host_is_online(setup_test_config, monkeypatch):
+    monkeypatch.setattr(config, "GAME_TIMEOUT", 60)
+    online("alice")
+    bound = create("alice", "192.0.2.1")
+    unbound = create("carol", "192.0.2.3")
+    touched = []
+    monkeypatch.setattr(games, "hooks", [lambda kind, g: touched.append(kind)])
+    for gid in (bound, unbound):
+        state.games[gid]["created"] -= 61
+
+    games.cleanup()
+    assert [g["id"] for g in games.for_channel("heaven")] == [bound]
+    assert time.time() - games.get(bound)["created"] < 1
+    # linked nodes hear about both: they don't expire our games themselves
+    assert touched == ["touch", "close"]
+
+
+def test_closing_a_game_unbinds_it(setup_test_config):
+    alice = online("alice")
+    gid = create("alice", "192.0.2.1")
+    games.close(gid)
+    assert alice not in state.game_hosts
+    assert games.host_left(alice) == 0
+
+
+def test_game_asp_binds_to_the_requesting_address(setup_test_config):
+    alice = online("alice", "127.0.0.1")
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        resp = client.get(
+            "/wormageddonweb/Game.asp?Cmd=Create&Name=g&Nick=alice"
+            "&HostIP=127.0.0.1:17011&Chan=heaven"
+        )
+    gid = int(resp.headers["SetGameId"].lstrip(": "))
+    assert state.game_sessions[gid] is alice
+    alice.cleanup()
+    assert games.get(gid) is None
+
+
+@pytest.fixture
+def quotas(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_EXEMPT", ["127.0.0.1"])
+    monkeypatch.setattr(config, "GAME_MAX_PER_IP", 2)
+    monkeypatch.setattr(config, "GAME_MAX_PER_NICK", 1)
+    monkeypatch.setattr(config, "GAME_CREATE_RATE", 0)
+    monkeypatch.setattr(games, "_buckets", {})
+    monkeypatch.setattr(games, "refused", games.refused.copy())
+
+
+def test_same_host_and_address_replaces(quotas):
+    events = []
+    games.hooks.append(lambda kind, g: events.append((kind, g["id"])))
+    try:
+        first = create("alice", "192.0.2.1", limited=True)
+        second = create("alice", "192.0.2.1", limited=True)
+    finally:
+        games.hooks.pop()
+    assert [g["id"] for g in games.for_channel("heaven")] == [second]
+    assert events == [("add", first), ("close", first), ("add", second)]
+
+
+def test_only_the_creating_address_replaces(quotas):
+    first = games.create("g", "alice", "192.0.2.1:17011", "heaven", host_ip="192.0.2.1")
+    games.create("g", "alice", "192.0.2.1:17011", "heaven", host_ip="192.0.2.9")
+    assert first in [g["id"] for g in games.for_channel("heaven")]
+
+
+def test_quotas_per_address_and_nick(quotas):
+    create("alice", "192.0.2.1", limited=True)
+    with pytest.raises(games.Refused, match="per nick"):
+        create("alice", "192.0.2.1", 17012, limited=True)
+    create("bob", "192.0.2.1", 17012, limited=True)
+    with pytest.raises(games.Refused, match="per ip"):
+        create("carol", "192.0.2.1", 17013, limited=True)
+    # exempt addresses and unlimited creates (the embedded buddy) skip quotas
+    create("carol", "127.0.0.1", 17013, limited=True)
+    create("carol", "192.0.2.1", 17014)
+    assert games.refused == {"per nick": 1, "per ip": 1}
+
+
+def test_create_rate_per_address(quotas, monkeypatch):
+    monkeypatch.setattr(config, "GAME_MAX_PER_IP", 0)
+    monkeypatch.setattr(config, "GAME_CREATE_RATE", 0.01)
+    monkeypatch.setattr(config, "GAME_CREATE_BURST", 2)
+    create("alice", "192.0.2.1", limited=True)
+    create("bob", "192.0.2.1", limited=True)
+    with pytest.raises(games.Refused, match="rate"):
+        create("carol", "192.0.2.1", limited=True)
+    create("carol", "192.0.2.2", limited=True)
+
+
+def test_quota_refusals_dont_spend_tokens(quotas, monkeypatch):
+    monkeypatch.setattr(config, "GAME_CREATE_RATE", 0.01)
+    monkeypatch.setattr(config, "GAME_CREATE_BURST", 2)
+    create("alice", "192.0.2.1", limited=True)
+    for _ in range(5):
+        with pytest.raises(games.Refused, match="per nick"):
+            create("alice", "192.0.2.1", 17012, limited=True)
+    create("bob", "192.0.2.1", limited=True)
+    assert games.refused == {"per nick": 5}
+
+
+def test_table_evicts_oldest_past_the_cap(monkeypatch):
+    monkeypatch.setattr(config, "GAME_MAX", 3)
+    gids = [create(f"p{i}", "192.0.2.1", 17000 + i) for i in range(5)]
+    assert [g["id"] for g in games.for_channel("heaven")] == gids[2:]
+    assert set(state.game_creators) == set(gids[2:])
+
+
+def test_ids_wrap_and_skip_listed_games(monkeypatch):
+    monkeypatch.setattr(games, "MAX_ID", 3)
+    monkeypatch.setattr(state, "game_counter", 0)
+    first = create("alice", "192.0.2.1")
+    create("bob", "192.0.2.2")
+    games.close(create("carol", "192.0.2.3"))
+    assert first == 1
+    assert create("dave", "192.0.2.4") == 3
+
+
+def test_game_asp_refusal_has_no_game_id(setup_test_config, quotas, monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_EXEMPT", [])
+    app.config["TESTING"] = True
+    url = "/wormageddonweb/Game.asp?Cmd=Create&Name=g&Nick=alice&Chan=heaven&HostIP="
+    with app.test_client() as client:
+        assert "SetGameId" in client.get(url + "1.2.3.4:17011").headers
+        resp = client.get(url + "1.2.3.4:17012")
+    assert resp.status_code == 429
+    assert resp.get_data(as_text=True) == "<NOTHING>"
+    assert "SetGameId" not in resp.headers
+
+
+def test_feed_logs_creates_closes_and_expiry(monkeypatch):
+    monkeypatch.setattr(config, "GAME_TIMEOUT", 60)
+    since = games.version
+    first = create("alice", "192.0.2.1")
+    second = games.create("g", "bob", "192.0.2.2:17011", "heaven", password="pw")
+    games.close(first)
+    state.games[second]["created"] -= 61
+    version, changes = games.changes_since(since, 0)
+    assert version == games.version
+    assert [(kind, g["id"]) for _, kind, g in changes] == [
+        ("create", first),
+        ("create", second),
+        ("close", first),
+        ("expire", second),
+    ]
+    assert changes[1][2]["password"] is True
+    assert games.changes_since(version, 0) == (version, [])
+
+
+def test_feed_asks_for_a_resync_past_its_log(monkeypatch):
+    monkeypatch.setattr(config, "GAME_FEED_SIZE", 2)
+    since = games.version
+    gids = [create(f"p{i}", "192.0.2.1", 17000 + i) for i in range(3)]
+    assert games.changes_since(since, 0)[1] is None
+    assert games.changes_since(since + 10**9, 0)[1] is None  # another run's
+    assert games.changes_since(None, 0)[1] is None
+    version, table = games.listing()
+    assert [g["id"] for g in table] == gids
+    assert games.changes_since(version, 0) == (version, [])
+
+
+def test_feed_long_polls_until_a_change():
+    since = games.version
+    timer = threading.Timer(0.2, create, ("alice", "192.0.2.1"))
+    timer.start()
+    started = time.monotonic()
+    _, changes = games.changes_since(since, 5)
+    assert 0.1 < time.monotonic() - started < 2
+    assert [kind for _, kind, _ in changes] == ["create"]
+    assert games.waiting == 0
+
+
+def test_feed_endpoint():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        reset = client.get("/games/changes").get_json()
+        assert reset["reset"] is True and reset["games"] == []
+        gid = create("alice", "192.0.2.1")
+        url = f"/games/changes?since={reset['version']}&timeout=0"
+        feed = client.get(url).get_json()
+        assert feed["version"] == str(games.version)
+        assert [(c["kind"], c["game"]["id"]) for c in feed["changes"]] == [
+            ("create", gid)
+        ]
+        url = f"/games/changes?since={feed['version']}&timeout=0"
+        assert client.get(url).get_json()["changes"] == []
+
+
+def test_feed_skips_refreshes_from_other_nodes():
+    since = games.version
+    game = {"id": 101, "name": "g", "host": "zed", "address": "192.0.2.9:17011"}
+    game.update(channel="heaven", password=None, location="", type="0", scheme="")
+    games.merge(dict(game, created=time.time()))
+    games.merge(dict(game, created=time.time() + 1))
+    games.merge(dict(game, name="renamed", created=time.time()))
+    _, changes = games.changes_since(since, 0)
+    assert [kind for _, kind, _ in changes] == ["create", "update"]
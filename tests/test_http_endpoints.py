@@ -4,6 +4,9 @@ Tests for WormNET HTTP endpoints
 All endpoints are under /wormageddonweb/
 """
 
+import re
+import time
+
 import pytest
 from wormnet.http import app
 from wormnet import state
@@ -255,3 +258,49 @@ def test_update_player_info_noop(client):
     assert response.status_code == 200
     text = response.get_data(as_text=True)
     assert "<NOTHING>" in text
+
+
+def test_game_list_conditional(client):
+    """
+    GameList.asp sends an ETag and answers a matching If-None-Match with a
+    bodyless 304 until any game changes
+    """
+    url = "/wormageddonweb/GameList.asp?Channel=AnythingGoes"
+    first = client.get(url)
+    etag = first.headers["ETag"]
+
+    unchanged = client.get(url, headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+
+    client.get(
+        "/wormageddonweb/Game.asp?Cmd=Create&Name=x&Nick=p&HostIP=1.2.3.4&Chan=AnythingGoes"
+    )
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert "<GAME x p 1.2.3.4" in changed.get_data(as_text=True)
+
+
+def test_refresh_game(client):
+    """Cmd=Refresh restarts a game's expiry clock, 404 once it's gone"""
+    response = client.get(
+        "/wormageddonweb/Game.asp?Cmd=Create&Name=x&Nick=p&HostIP=1.2.3.4&Chan=heaven"
+    )
+    game_id = int(re.search(r"(\d+)", response.headers["SetGameId"]).group(1))
+    state.games[game_id]["created"] -= 200
+
+    response = client.get(f"/wormageddonweb/Game.asp?Cmd=Refresh&GameID={game_id}")
+    assert response.status_code == 200
+    assert time.time() - state.games[game_id]["created"] < 5
+
+    client.get(f"/wormageddonweb/Game.asp?Cmd=Close&GameID={game_id}")
+    response = client.get(f"/wormageddonweb/Game.asp?Cmd=Refresh&GameID={game_id}")
+    assert response.status_code == 404
+
+
+def test_bad_game_id(client):
+    """a non-numeric GameID is a bad request, not a server error"""
+    for cmd in ("Refresh", "Close"):
+        response = client.get(f"/wormageddonweb/Game.asp?Cmd={cmd}&GameID=abc")
+        assert response.status_code == 400
@@ -0,0 +1,125 @@
+"""
+Tests for per-connection counters, the admin listing and OPER-only commands
+"""
+
+from unittest.mock import Mock
+
+import pytest
+from wormnet import config, state
+from wormnet.http import app
+from wormnet.irc import IRCClient, list_connections
+
+
+def make_client(nick, port, registered=True):
+    client = IRCClient(Mock(), ("10.0.0.1", port))
+    client.nickname = nick
+    client.username = nick
+    client.registered = registered
+    state.irc_connections.add(client)
+    if registered:
+        state.irc_clients.append(client)
+    return client
+
+
+def sent(client):
+    return [c[0][0].decode().strip() for c in client.sock.sendall.call_args_list]
+
+
+@pytest.fixture
+def opers(monkeypatch):
+    monkeypatch.setattr(config, "OPERS", {"boss": "hunter2"})
+
+
+def test_counters_track_traffic(setup_test_config):
+    """lines, bytes and per-command counts move with traffic"""
+    client = make_client("counted", 1)
+    client.process_line("PING :x")
+    client.process_line("PING :y")
+    client.process_line("LIST")
+
+    stats = client.stats()
+    assert stats["lines_in"] == 3
+    assert stats["commands"] == {"PING": 2, "LIST": 1}
+    assert stats["lines_out"] == len(sent(client))
+    assert stats["bytes_out"] == sum(len(s) + 2 for s in sent(client))
+    assert stats["idle"] >= 0
+    assert stats["send_queue"] == 0  # not a real socket
+
+
+def test_junk_verbs_share_one_counter(setup_test_config):
+    """made-up commands can't grow the per-command counter"""
+    client = make_client("junk", 1)
+    for i in range(1000):
+        client.process_line(f"BOGUS{i} x")
+    client.process_line("PING :x")
+    assert client.stats()["commands"] == {"other": 1000, "PING": 1}
+
+
+def test_list_connections_sort_and_filter():
+    """listing sorts by any numeric key and filters by nick/ip substring"""
+    quiet = make_client("quiet", 1)
+    loud = make_client("loud", 2)
+    lurker = make_client(None, 3, registered=False)
+    loud.bytes_in, quiet.bytes_in, lurker.bytes_in = 500, 10, 0
+
+    rows = list_connections(sort="bytes_in")
+    assert [r["id"] for r in rows] == [loud.id, quiet.id, lurker.id]
+
+    rows = list_connections(sort="bytes_in", reverse=False, limit=1)
+    assert [r["id"] for r in rows] == [lurker.id]
+
+    assert [r["nick"] for r in list_connections(match="qui")] == ["quiet"]
+
+
+def test_oper_login(setup_test_config, opers):
+    client = make_client("op", 1)
+    client.process_line("OPER boss wrong")
+    assert not client.oper
+    assert " 464 " in sent(client)[-1]
+
+    client.process_line("OPER boss hunter2")
+    assert client.oper
+    assert " 381 " in sent(client)[-1]
+
+
+def test_conns_requires_oper(setup_test_config, opers):
+    client = make_client("pleb", 1)
+    client.process_line("CONNS")
+    assert " 481 " in sent(client)[-1]
+
+
+def test_conns_lists_connections(setup_test_config, opers):
+    client = make_client("op", 1)
+    make_client("other", 2).bytes_in = 999
+    client.process_line("OPER boss hunter2")
+    client.process_line("CONNS bytes_in other")
+
+    notices = [m for m in sent(client) if "NOTICE op" in m]
+    assert any(" other 10.0.0.1 999/" in m for m in notices)
+    assert "End of CONNS (1)" in notices[-1]
+
+
+def test_kill_by_nick(setup_test_config, opers):
+    client = make_client("op", 1)
+    victim = make_client("victim", 2)
+    client.process_line("OPER boss hunter2")
+    client.process_line("KILL victim :flooding")
+
+    assert "ERROR :Closing Link" in sent(victim)[-1]
+    assert "flooding" in sent(victim)[-1]
+    victim.sock.shutdown.assert_called_once()
+
+
+def test_admin_clients_endpoint(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "t")
+    make_client("a", 1).bytes_out = 5
+    make_client("b", 2).bytes_out = 50
+    app.config["TESTING"] = True
+    with app.test_client() as http:
+        rows = http.get("/admin/clients?token=t&sort=bytes_out").get_json()["clients"]
+        assert [r["nick"] for r in rows] == ["b", "a"]
+        assert http.get("/admin/clients?token=t&sort=nope").status_code == 400
+
+        response = http.post("/admin/clients/b/kill?token=t")
+        assert response.status_code == 200
+        assert http.post("/admin/clients/nobody/kill?token=t").status_code == 404
@@ -0,0 +1,124 @@
+"""
+Tests for the CIDR allow/deny filter and where it's enforced
+"""
+
+import ipaddress
+import random
+import socket
+import threading
+
+import pytest
+from wormnet import admission, config, ipfilter, irc
+from wormnet.http import app
+
+
+def test_longest_prefix_wins():
+    """A more specific allow punches a hole in a broader deny, and vice versa"""
+    filt = ipfilter.IPFilter(
+        allow=["203.0.113.128/25", "198.51.100.7"],
+        deny=["203.0.113.0/24", "198.51.100.0/24", "203.0.113.200/32"],
+    )
+    assert filt.allowed("203.0.113.5") is False
+    assert filt.allowed("203.0.113.130") is True
+    assert filt.allowed("203.0.113.200") is False
+    assert filt.allowed("198.51.100.7") is True
+    assert filt.allowed("198.51.100.8") is False
+    assert filt.allowed("192.0.2.1") is True
+
+
+def test_default_deny_and_ipv6():
+    filt = ipfilter.IPFilter(allow=["2001:db8::/32", "10.0.0.0/8"], default="deny")
+    assert filt.allowed("2001:db8:1::5") is True
+    assert filt.allowed("2001:db9::1") is False
+    assert filt.allowed("10.1.2.3") is True
+    assert filt.allowed("::ffff:10.1.2.3") is True  # v4-mapped uses the v4 rules
+    assert filt.allowed("11.1.2.3") is False
+    assert filt.allowed("not an ip") is False
+
+
+def test_hit_counters():
+    filt = ipfilter.IPFilter(deny=["192.0.2.0/24"])
+    for _ in range(3):
+        filt.allowed("192.0.2.9")
+    filt.allowed("198.51.100.1")
+    stats = filt.stats()
+    assert stats["hits"] == [{"cidr": "192.0.2.0/24", "action": "deny", "hits": 3}]
+    assert stats["default_hits"] == 1
+
+
+def test_radix_matches_linear_scan():
+    """Randomised cross-check of the tree against a brute-force scan"""
+    rng = random.Random(36)
+    networks = {
+        ipaddress.ip_network((rng.getrandbits(32), 32)).supernet(
+            new_prefix=rng.randint(4, 32)
+        )
+        for _ in range(2000)
+    }
+    filt = ipfilter.IPFilter()
+    rules = [filt.add(str(n), ipfilter.DENY) for n in networks]
+    for _ in range(2000):
+        addr = ipaddress.IPv4Address(rng.getrandbits(32))
+        containing = [r for r in rules if addr in r.network]
+        expected = max(containing, key=lambda r: r.network.prefixlen, default=None)
+        assert filt.match(str(addr)) is expected
+
+
+def test_reload_from_config_file(tmp_path, monkeypatch):
+    denied = tmp_path / "deny.txt"
+    denied.write_text("# spammers\n192.0.2.0/24\n198.51.100.0/24  # more\n")
+    conf = tmp_path / "wormnet.toml"
+    conf.write_text(f'[ipfilter]\ndeny_file = "{denied}"\n')
+    monkeypatch.setattr(config, "CONFIG_FILE", conf)
+    monkeypatch.setattr(ipfilter, "active", ipfilter.IPFilter())
+
+    assert ipfilter.allowed("192.0.2.1") is True
+    ipfilter.reload()
+    assert ipfilter.allowed("192.0.2.1") is False
+    assert len(ipfilter.active.rules) == 2
+
+    conf.write_text('[ipfilter]\ndeny = ["not-a-cidr"]\n')
+    with pytest.raises(ValueError):
+        ipfilter.reload()
+    assert ipfilter.allowed("192.0.2.1") is False  # old filter kept
+
+
+def test_wormageddonweb_denied(monkeypatch):
+    monkeypatch.setattr(ipfilter, "active", ipfilter.IPFilter(deny=["127.0.0.0/8"]))
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        response = client.get("/wormageddonweb/Login.asp?UserName=x")
+        assert response.status_code == 403
+
+
+def test_admin_ipfilter(monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "t")
+    monkeypatch.setattr(ipfilter, "active", ipfilter.IPFilter(deny=["192.0.2.0/24"]))
+    ipfilter.allowed("192.0.2.1")
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        stats = client.get("/admin/ipfilter?token=t").get_json()
+        assert stats["hits"][0] == {
+            "cidr": "192.0.2.0/24",
+            "action": "deny",
+            "hits": 1,
+        }
+
+
+def test_irc_accept_denied(setup_test_config, monkeypatch):
+    """A denied address gets an ERROR and never takes a gate slot"""
+    monkeypatch.setattr(ipfilter, "active", ipfilter.IPFilter(deny=["127.0.0.1"]))
+    gate = admission.Gate("irc", max_clients=10)
+    sock = socket.create_server(("127.0.0.1", 0))
+    thread = threading.Thread(target=irc.serve, args=(sock, gate, 8), daemon=True)
+    thread.start()
+    try:
+        with socket.create_connection(sock.getsockname(), timeout=3) as client:
+            data = b""
+            while chunk := client.recv(1024):
+                data += chunk
+        assert b"ERROR :Closing Link" in data and b"Banned" in data
+        assert gate.stats()["admitted"] == 0
+    finally:
+        sock.close()
+        thread.join(timeout=3)
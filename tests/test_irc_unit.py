@@ -9,7 +9,7 @@ import pytest
 import re
 from unittest.mock import Mock
 from wormnet.irc import IRCClient
-from wormnet import state
+from wormnet import config, state
 
 
 @pytest.fixture
@@ -236,3 +236,49 @@ def test_privmsg_to_channel(mock_client, setup_test_config):
     privmsg = [m for m in messages if "PRIVMSG" in m]
     assert len(privmsg) > 0, "Message not broadcast"
     assert "Hello everyone!" in privmsg[0], "Message content wrong"
+
+
+def registered(nick, *channels):
+    client = IRCClient(Mock(), ("127.0.0.1", 12345))
+    for line in ("PASS ELSILRACLIHP", f"NICK {nick}", f"USER {nick} h s :0 11 FR"):
+        client.process_line(line)
+    for channame in channels:
+        client.process_line(f"JOIN {channame}")
+    client.sock.sendall.reset_mock()
+    return client
+
+
+def test_message_bytes_pass_through(setup_test_config):
+    """WA's cp1252 text reaches other players byte for byte"""
+    alice = registered("alice", "#heaven")
+    bob, carol = registered("bob", "#heaven"), registered("carol", "#heaven")
+    bob.sock.sendall.reset_mock()
+    text = "d\xe9j\xe0 vu \x80 caf\xe9".encode("latin-1")
+
+    alice.feed(b"PRIVMSG #heaven :" + text + b"\r\nPRIVMSG bob :" + text + b"\r\n")
+    channel, private = [c.args[0] for c in bob.sock.sendall.call_args_list]
+    assert channel == b":alice PRIVMSG #heaven :" + text + b"\r\n"
+    assert private.endswith(b" PRIVMSG bob :" + text + b"\r\n")
+    # the broadcast encoded the line once for everyone
+    assert carol.sock.sendall.call_args[0][0] is channel
+
+
+def test_utf8_mode_is_unchanged(setup_test_config, monkeypatch):
+    """with [irc] raw off, text is utf-8 and invalid bytes are dropped"""
+    monkeypatch.setattr(config, "IRC_RAW", False)
+    alice, bob = registered("alice", "#heaven"), registered("bob", "#heaven")
+    bob.sock.sendall.reset_mock()
+    alice.feed("PRIVMSG #heaven :café ".encode("utf-8") + b"\xe9\r\n")
+    assert bob.sock.sendall.call_args[0][0] == (
+        ":alice PRIVMSG #heaven :café \r\n".encode("utf-8")
+    )
+
+
+def test_our_text_goes_out_in_the_codepage(setup_test_config):
+    state.irc_channels["#heaven"]["topic"] = "00 Café €"
+    alice = registered("alice")
+    alice.process_line("JOIN #heaven")
+    topic = [
+        c.args[0] for c in alice.sock.sendall.call_args_list if b" 332 " in c.args[0]
+    ]
+    assert topic[0].endswith(b":00 Caf\xe9 \x80\r\n")
@@ -0,0 +1,164 @@
+"""
+Tests for overload detection and load shedding
+"""
+
+from unittest.mock import Mock
+
+import pytest
+from wormnet import config, games, overload, state
+from wormnet.http import app
+from wormnet.irc import IRCClient
+
+
+@pytest.fixture
+def level(monkeypatch):
+    """pin the active controller at a shedding level"""
+    controller = overload.Controller()
+    monkeypatch.setattr(overload, "controller", controller)
+
+    def set_level(value):
+        controller.level = value
+        return controller
+
+    return set_level
+
+
+def test_escalates_immediately_and_steps_down_after_cooldown():
+    controller = overload.Controller(limits={"lag": 0.1}, cooldown=5)
+    assert controller.update({"lag": 0.05}, now=0) == overload.NORMAL
+    assert controller.update({"lag": 0.25}, now=1) == overload.STALE
+
+    # calm, but not for long enough
+    controller.update({"lag": 0.01}, now=2)
+    assert controller.update({"lag": 0.01}, now=6) == overload.STALE
+    # one level per cooldown on the way down
+    assert controller.update({"lag": 0.01}, now=7) == overload.THROTTLE
+    assert controller.update({"lag": 0.01}, now=8) == overload.THROTTLE
+    assert controller.update({"lag": 0.01}, now=13) == overload.REJECT
+
+    stats = controller.stats()
+    assert stats["transitions"] == {
+        "normal->stale": 1,
+        "stale->throttle": 1,
+        "throttle->reject": 1,
+    }
+    assert [h["to"] for h in stats["history"]] == ["stale", "throttle", "reject"]
+
+
+def test_hysteresis_holds_level_near_threshold():
+    controller = overload.Controller(limits={"http_latency": 1.0}, cooldown=1)
+    controller.update({"http_latency": 1.1}, now=0)
+    # below the threshold but inside the hysteresis band: no calm clock
+    for t in range(1, 10):
+        assert controller.update({"http_latency": 0.9}, now=t) == overload.REJECT
+
+
+def test_pressure_is_the_worst_signal_and_zero_limits_are_ignored():
+    controller = overload.Controller(
+        limits={"lag": 0.1, "threads": 0, "send_queue": 100}
+    )
+    controller.update({"lag": 0.01, "threads": 10**6, "send_queue": 160})
+    assert controller.pressure == pytest.approx(1.6)
+    assert controller.level == overload.THROTTLE
+
+
+def test_monitor_survives_a_failing_sample(monkeypatch):
+    controller = overload.Controller(limits={"lag": 1.0}, interval=0.01)
+    calls = []
+
+    def sample(lag):
+        calls.append(lag)
+        if len(calls) == 1:
+            raise RuntimeError("deque mutated during iteration")
+        if len(calls) == 3:
+            controller._stop.set()
+        return {"lag": 5.0}
+
+    monkeypatch.setattr(controller, "sample", sample)
+    controller.run()
+    assert len(calls) == 3 and controller.level == overload.STALE
+
+
+def test_latency_p95():
+    controller = overload.Controller()
+    for ms in range(100):
+        controller.record_latency(ms / 1000)
+    assert controller.sample(0.0)["http_latency"] == pytest.approx(0.095)
+
+
+def test_irc_rejects_new_connections(setup_test_config, level):
+    from wormnet import admission, irc
+
+    controller = level(overload.REJECT)
+    sock = Mock()
+    gate = admission.Gate("irc")
+    irc.admit(sock, ("192.0.2.1", 5000), gate)
+    assert b"Server busy" in sock.send.call_args[0][0]
+    sock.close.assert_called_once()
+    assert gate.stats()["admitted"] == 0
+    assert controller.shed["irc_connection"] == 1
+
+
+def registered(nick):
+    client = IRCClient(Mock(), ("192.0.2.1", 5000))
+    client.nickname = client.username = nick
+    client.registered = True
+    state.irc_clients.append(client)
+    return client
+
+
+def sent(client):
+    return [call.args[0].decode() for call in client.sock.sendall.call_args_list]
+
+
+def test_who_and_list_throttled(setup_test_config, level):
+    controller = level(overload.THROTTLE)
+    client = registered("alice")
+    client.process_line("WHO #heaven")
+    client.process_line("WHO #heaven")
+    client.process_line("LIST")
+    lines = sent(client)
+    assert sum(" 315 " in line for line in lines) == 1
+    assert sum(" 263 " in line for line in lines) == 2
+    assert controller.shed == {"who": 1, "list": 1}
+
+    # chat is never shed
+    client.channels.add("#heaven")
+    bob = registered("bob")
+    bob.channels.add("#heaven")
+    client.process_line("PRIVMSG #heaven :still here")
+    assert any("still here" in line for line in sent(bob))
+
+
+def test_who_unthrottled_when_normal(setup_test_config, level):
+    level(overload.REJECT)
+    client = registered("alice")
+    for _ in range(3):
+        client.process_line("WHO #heaven")
+    assert sum(" 315 " in line for line in sent(client)) == 3
+
+
+def test_gamelist_serves_stale_body(setup_test_config, level, monkeypatch):
+    app.config["TESTING"] = True
+    url = "/wormageddonweb/GameList.asp?Channel=heaven"
+    with app.test_client() as client:
+        games.create("first", "alice", "192.0.2.1", "heaven")
+        assert b"first" in client.get(url).data
+
+        controller = level(overload.STALE)
+        games.create("second", "bob", "192.0.2.2", "heaven")
+        assert b"second" not in client.get(url).data
+        assert controller.shed["stale_gamelist"] == 1
+
+        # a cached body older than stale_max gets rebuilt
+        monkeypatch.setattr(config, "OVERLOAD_STALE_MAX", -1)
+        assert b"second" in client.get(url).data
+
+
+def test_login_shed(level):
+    level(overload.REJECT)
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        assert client.get("/wormageddonweb/Login.asp").status_code == 503
+        game = client.get("/wormageddonweb/Game.asp?Cmd=Create&Name=x&Chan=heaven")
+        assert game.status_code == 200
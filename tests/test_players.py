@@ -0,0 +1,107 @@
+"""
+Tests for the UpdatePlayerInfo.asp player store
+"""
+
+import sqlite3
+
+import pytest
+from wormnet import players
+from wormnet.http import app
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT nick, updates FROM players").fetchall())
+
+
+def test_update_and_get():
+    store = players.PlayerStore()
+    store.update("alice", (("Rank", "5"),), "192.0.2.1", now=10)
+    store.update("alice", (("Rank", "6"),), "192.0.2.1", now=20)
+    alice = store.get("alice")
+    assert alice["info"] == {"Rank": "6"}
+    assert (alice["updates"], alice["first_seen"], alice["last_seen"]) == (2, 10, 20)
+    assert store.get("bob") is None
+
+
+def test_fields_are_capped():
+    args = {"Nick": "alice", "k" * 40: "v" * 100}
+    args.update({f"f{i}": "x" for i in range(30)})
+    fields = players.clean(args)
+    assert len(fields) == players.MAX_FIELDS
+    assert fields[0] == ("k" * players.MAX_KEY, "v" * players.MAX_VALUE)
+    assert "Nick" not in dict(fields)
+
+
+def test_least_recently_seen_is_evicted():
+    store = players.PlayerStore(max_players=2)
+    store.update("alice", ())
+    store.update("bob", ())
+    store.update("alice", ())
+    store.update("carol", ())
+    assert list(store.table) == ["alice", "carol"]
+    assert store.evicted == 1
+
+
+def test_rankings():
+    store = players.PlayerStore()
+    for nick, rank, reports in (("a", "3", 1), ("b", "9", 2), ("c", "x", 3)):
+        for _ in range(reports):
+            store.update(nick, (("Rank", rank),))
+    assert [p["nick"] for p in store.top(2)] == ["c", "b"]
+    assert [p["nick"] for p in store.top(5, by="Rank")] == ["b", "a"]
+
+
+def test_written_behind(tmp_path):
+    path = tmp_path / "players.sqlite"
+    store = players.PlayerStore(max_players=1, path=path)
+    store.update("alice", (("Rank", "5"),))
+    store.update("alice", ())
+    store.update("bob", ())  # evicts alice before she's written
+    assert rows(path) == {}
+    assert store.flush() == 2
+    assert rows(path) == {"alice": 2, "bob": 1}
+    assert store.flush() == 0
+
+    # alice comes back: the next flush restores her totals
+    store.update("alice", ())
+    store.flush()
+    assert rows(path)["alice"] == 3
+    assert store.get("alice")["updates"] == 3
+    store.stop()
+
+
+def test_warm_start_and_stop_flushes(tmp_path):
+    path = tmp_path / "players.sqlite"
+    store = players.PlayerStore(path=path)
+    for nick in ("alice", "bob", "carol"):
+        store.update(nick, (("Country", "GB"),))
+    store.stop()
+    assert rows(path) == {"alice": 1, "bob": 1, "carol": 1}
+
+    store = players.PlayerStore(max_players=2, path=path)
+    assert list(store.table) == ["bob", "carol"]
+    assert store.get("carol")["info"] == {"Country": "GB"}
+    store.update("carol", ())
+    assert store.get("carol")["updates"] == 2
+    store.stop()
+    assert rows(path)["carol"] == 2
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(players, "store", players.PlayerStore())
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_endpoint_records_reports(client):
+    url = "/wormageddonweb/UpdatePlayerInfo.asp"
+    assert client.get(url + "?Nick=alice&Rank=12").get_data(as_text=True) == (
+        "<NOTHING>"
+    )
+    assert client.get(url + "?Rank=1").status_code == 200
+    assert players.store.get("alice")["info"] == {"Rank": "12"}
+    assert players.store.get("alice")["ip"] == "127.0.0.1"
+    assert len(players.store.table) == 1
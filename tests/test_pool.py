@@ -0,0 +1,114 @@
+"""
+Tests for spreading Login.asp across a pool of IRC nodes
+"""
+
+import time
+
+import pytest
+from wormnet import config, overload, pool, state
+from wormnet.http import app
+
+NODES = [
+    {"name": "a", "host": "10.0.0.1", "port": 6667},
+    {"name": "b", "host": "10.0.0.2"},
+]
+
+
+@pytest.fixture
+def up():
+    """a pool with both nodes freshly reported"""
+    p = pool.Pool(NODES, interval=1.0, sticky=60)
+    p.report("a 10 100 0", now=0)
+    p.report("b 20 100 0", now=0)
+    return p
+
+
+def test_least_loaded_node(up):
+    assert up.pick("192.0.2.1", now=1).name == "a"
+    assert up.nodes["b"].address == f"10.0.0.2:{config.DEFAULT_IRC_PORT}"
+
+
+def test_load_is_relative_to_capacity(up):
+    up.report("b 20 1000 0", now=0)
+    assert up.pick("192.0.2.1", now=1).name == "b"
+
+
+def test_logins_between_reports_count_as_load(up):
+    picks = [up.pick(f"192.0.2.{i}", now=1).name for i in range(20)]
+    # a takes 10 more to catch up with b, then they alternate
+    assert picks[:10] == ["a"] * 10
+    assert set(picks[10:]) == {"a", "b"}
+    up.report("a 20 100 0", now=1)
+    assert up.nodes["a"].pending == 0
+
+
+def test_same_ip_keeps_its_node(up):
+    assert up.pick("192.0.2.1", now=1).name == "a"
+    up.report("a 90 100 0", now=1)
+    assert up.pick("192.0.2.1", now=2).name == "a"
+    # the sticky window ran out (and a's reports went stale)
+    up.report("b 20 100 0", now=61)
+    assert up.pick("192.0.2.1", now=62).name == "b"
+
+
+def test_sticky_node_going_down_moves_the_ip(up):
+    assert up.pick("192.0.2.1", now=1).name == "a"
+    up.report(f"a 10 100 {overload.REJECT}", now=1)
+    assert up.pick("192.0.2.1", now=2).name == "b"
+
+
+def test_stale_or_missing_reports_mean_down(up):
+    up.report("b 20 100 0", now=5)
+    assert up.pick("192.0.2.1", now=5).name == "b"
+    assert up.pick("192.0.2.2", now=9) is None
+    assert pool.Pool(NODES).pick("192.0.2.1") is None
+
+
+def test_bad_reports_are_ignored(up):
+    assert not up.report("c 1 100 0")
+    assert not up.report("a lots 100 0")
+    assert not up.report("a 1 100")
+    assert up.nodes["a"].connections == 10
+
+
+def test_expire_forgets_old_assignments(up):
+    up.pick("192.0.2.1", now=1)
+    up.report("a 10 100 0", now=30)
+    up.pick("192.0.2.2", now=30)
+    up.expire(now=70)
+    assert list(up.assigned) == ["192.0.2.2"]
+
+
+def test_reports_over_udp(setup_test_config, monkeypatch):
+    monkeypatch.setattr(config, "IRC_MAX_CLIENTS", 500)
+    p = pool.Pool(NODES, interval=0.05)
+    p.start("127.0.0.1", 0)
+    reporter = pool.Reporter("b", p.sock.getsockname(), interval=0.05)
+    state.irc_connections.add(object())
+    reporter.start()
+    try:
+        deadline = time.monotonic() + 2
+        while p.nodes["b"].seen is None:
+            assert time.monotonic() < deadline, "no report arrived"
+            time.sleep(0.01)
+        assert (p.nodes["b"].connections, p.nodes["b"].max_clients) == (1, 500)
+        assert p.stats()["nodes"]["b"]["healthy"]
+        assert not p.stats()["nodes"]["a"]["healthy"]
+    finally:
+        reporter.stop()
+        p.stop()
+
+
+def test_login_hands_out_pool_node(up, monkeypatch):
+    monkeypatch.setattr(pool, "pool", up)
+    up.report("a 10 100 0")
+    up.report("b 20 100 0")
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        text = client.get("/wormageddonweb/Login.asp").get_data(as_text=True)
+        assert text.startswith("<CONNECT 10.0.0.1:6667>")
+
+        up.report(f"a 10 100 {overload.REJECT}")
+        up.report(f"b 20 100 {overload.REJECT}")
+        text = client.get("/wormageddonweb/Login.asp").get_data(as_text=True)
+        assert "10.0.0." not in text
@@ -0,0 +1,112 @@
+"""
+Tests for on-demand profiling and the admin trigger endpoints
+"""
+
+import threading
+import time
+
+import pytest
+from wormnet import config, profiling
+from wormnet.http import app
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    """Write profiles to a temp dir"""
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def admin_client(monkeypatch):
+    """Flask test client with admin enabled"""
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "sekrit")
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def busy_loop_for_profiler(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_cpu_sees_other_threads():
+    """Sampler captures stacks of every thread but its own"""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop_for_profiler, args=(stop,))
+    worker.start()
+    try:
+        counts = profiling.sample_cpu(0.1, interval=0.001)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert any("busy_loop_for_profiler" in stack for stack in counts)
+    assert not any("sample_cpu" in stack for stack in counts)
+
+
+def test_profile_cpu_writes_folded_file(profile_dir):
+    """Output is one 'stack count' line per unique stack"""
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait)
+    worker.start()
+    try:
+        path = profiling.profile_cpu(0.05)
+    finally:
+        stop.set()
+        worker.join()
+    lines = path.read_text().splitlines()
+    assert path.suffix == ".folded"
+    assert lines
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_memory_diff(profile_dir):
+    """Growth between start and stop is reported by allocation site"""
+    assert profiling.start_memory()
+    assert not profiling.start_memory(), "second start should be refused"
+    hoard = [bytearray(1024) for _ in range(200)]
+    path = profiling.stop_memory()
+
+    assert not profiling.memory_tracking()
+    assert "total growth" in path.read_text()
+    assert "test_profiling.py" in path.read_text()
+    assert profiling.stop_memory() is None
+    del hoard
+
+
+def test_admin_disabled_without_token():
+    """Admin endpoints don't exist unless a token is configured"""
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        assert client.post("/admin/profile/cpu").status_code == 404
+
+
+def test_admin_rejects_bad_token(admin_client):
+    response = admin_client.post("/admin/profile/cpu?token=wrong")
+    assert response.status_code == 403
+
+
+def test_admin_triggers_cpu_profile(admin_client, profile_dir):
+    """POST starts a background profile; a second one is refused meanwhile"""
+    headers = {"X-Admin-Token": "sekrit"}
+    first = admin_client.post("/admin/profile/cpu?seconds=0.2", headers=headers)
+    second = admin_client.post("/admin/profile/cpu?seconds=0.2", headers=headers)
+    assert first.status_code == 202
+    assert second.status_code == 409
+
+    deadline = time.monotonic() + 5
+    while not list(profile_dir.glob("*.folded")) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert list(profile_dir.glob("*.folded"))
+
+
+def test_admin_memory_roundtrip(admin_client, profile_dir):
+    headers = {"X-Admin-Token": "sekrit"}
+    assert (
+        admin_client.post("/admin/profile/memory", headers=headers).status_code == 202
+    )
+    response = admin_client.delete("/admin/profile/memory", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["path"].endswith(".txt")
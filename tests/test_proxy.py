@@ -0,0 +1,178 @@
+"""
+Tests for PROXY protocol on the IRC listener and X-Forwarded-For over HTTP
+"""
+
+import socket
+import struct
+import threading
+import time
+
+import pytest
+from tests.conftest import IRCTestClient
+from wormnet import admission, config, ipfilter, irc, proxy
+from wormnet.http import GatedWSGIServer, app
+
+
+def v2(command=1, family=0x11, body=None):
+    if body is None:
+        body = socket.inet_aton("203.0.113.7") + socket.inet_aton("10.0.0.1")
+        body += struct.pack("!HH", 40000, 6667)
+    return (
+        proxy.V2_SIGNATURE
+        + bytes([0x20 | command, family])
+        + struct.pack("!H", len(body))
+        + body
+    )
+
+
+@pytest.fixture
+def trusted(monkeypatch):
+    monkeypatch.setattr(config, "IRC_TRUSTED_PROXIES", ["127.0.0.0/8"])
+    monkeypatch.setattr(config, "HTTP_TRUSTED_PROXIES", ["127.0.0.1", "10.0.0.0/8"])
+    proxy.load()
+    yield
+    monkeypatch.undo()
+    proxy.load()
+
+
+def header_then(data):
+    """read_header over a socketpair; returns (result, what's left)"""
+    ours, theirs = socket.socketpair()
+    with ours, theirs:
+        theirs.sendall(data)
+        result = proxy.read_header(ours, 1)
+        theirs.close()
+        return result, ours.recv(1024)
+
+
+def test_v1_header():
+    line = b"PROXY TCP4 203.0.113.7 10.0.0.1 40000 6667\r\n"
+    assert header_then(line + b"NICK x\r\n") == (("203.0.113.7", 40000), b"NICK x\r\n")
+    line = b"PROXY TCP6 2001:db8::7 2001:db8::1 40000 6667\r\n"
+    assert header_then(line)[0] == ("2001:db8::7", 40000)
+    assert header_then(b"PROXY UNKNOWN\r\n")[0] is None
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b"PROXY TCP4 203.0.113 10.0.0.1 40000 6667\r\n",
+        b"PROXY TCP4 203.0.113.7 10.0.0.1 99999 6667\r\n",
+        b"PROXY UDP4 203.0.113.7 10.0.0.1 40000 6667\r\n",
+        b"PROXY " + b"x" * 200,
+        b"PASS ELSILRACLIHP\r\nNICK x\r\n",
+    ],
+)
+def test_bad_headers(line):
+    with pytest.raises(ValueError):
+        header_then(line)
+
+
+def test_v2_header():
+    assert header_then(v2() + b"NICK x\r\n") == (("203.0.113.7", 40000), b"NICK x\r\n")
+    body = socket.inet_pton(socket.AF_INET6, "2001:db8::7") + bytes(16)
+    body += struct.pack("!HH", 40000, 6667) + b"\x04\x00\x01z"  # plus a tlv
+    assert header_then(v2(family=0x21, body=body)) == (("2001:db8::7", 40000), b"")
+    # health check from the balancer itself
+    assert header_then(v2(command=0, body=b""))[0] is None
+    assert header_then(v2(family=0x31, body=bytes(216)))[0] is None
+
+
+def test_irc_sees_the_client_behind_the_balancer(setup_test_config, trusted):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    threading.Thread(
+        target=irc.serve, args=(listener, admission.Gate("irc")), daemon=True
+    ).start()
+
+    clients = []
+    try:
+        for nick, header in (
+            ("alice", b"PROXY TCP4 203.0.113.7 10.0.0.1 40000 6667\r\n"),
+            ("bob", v2(command=0, body=b"")),
+        ):
+            client = IRCTestClient(*listener.getsockname())
+            client.connect()
+            client.sock.sendall(header)
+            client.send("PASS ELSILRACLIHP")
+            client.send(f"NICK {nick}")
+            client.send(f"USER {nick} h s :0 11 US")
+            client.recv_until(" 376 ")
+            clients.append(client)
+        alice, bob = clients
+        alice.send("WHO alice")
+        assert any(" ~alice 203.0.113.7 " in line for line in alice.recv_until(" 315 "))
+        bob.send("WHO bob")
+        assert any(" ~bob 127.0.0.1 " in line for line in bob.recv_until(" 315 "))
+    finally:
+        for client in clients:
+            client.close()
+        listener.close()
+
+
+def test_forwarded_for_trusts_only_proxies(trusted):
+    # untrusted peers can't pick their address
+    assert proxy.forwarded_for("198.51.100.1", "203.0.113.7") == "198.51.100.1"
+    assert proxy.forwarded_for("127.0.0.1", "203.0.113.7") == "203.0.113.7"
+    # the client's own claim at the left is ignored; only proxy hops are walked
+    chain = "192.0.2.99, 203.0.113.7, 10.1.2.3"
+    assert proxy.forwarded_for("127.0.0.1", chain) == "203.0.113.7"
+    assert proxy.forwarded_for("127.0.0.1", "10.1.2.3, junk") == "127.0.0.1"
+    assert proxy.forwarded_for("127.0.0.1", None) == "127.0.0.1"
+
+
+def test_http_uses_forwarded_address(trusted, monkeypatch):
+    monkeypatch.setattr(ipfilter, "active", ipfilter.IPFilter(deny=["203.0.113.0/24"]))
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        url = "/wormageddonweb/Login.asp"
+        assert client.get(url).status_code == 200
+        headers = {"X-Forwarded-For": "203.0.113.7"}
+        assert client.get(url, headers=headers).status_code == 403
+        headers = {"X-Forwarded-For": "198.51.100.1"}
+        assert client.get(url, headers=headers).status_code == 200
+
+
+def test_http_per_ip_cap_counts_clients_behind_the_proxy(trusted):
+    """a trusted proxy carries more than max_per_ip requests, its clients don't"""
+    gate = admission.Gate("http", max_per_ip=32)
+    inside, release = [], threading.Event()
+
+    def held(environ, start_response):
+        inside.append(environ["REMOTE_ADDR"])
+        release.wait(5)
+        start_response("200 OK", [("Content-Length", "0")])
+        return [b""]
+
+    server = GatedWSGIServer("127.0.0.1", 0, held, gate, backlog=128)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(client):
+        sock = socket.create_connection(("127.0.0.1", server.server_port), 5)
+        sock.sendall(f"GET / HTTP/1.0\r\nX-Forwarded-For: {client}\r\n\r\n".encode())
+        return sock
+
+    def status(sock):
+        with sock:
+            return sock.recv(100).split(b" ")[1]
+
+    try:
+        clients = [get(f"198.51.100.{n}") for n in range(40)]
+        same = [get("203.0.113.7") for _ in range(32)]
+        deadline = time.time() + 5
+        while len(inside) < 72 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(inside) == 72 and gate.active == 72
+        assert status(get("203.0.113.7")) == b"503"
+        release.set()
+        assert {status(sock) for sock in clients + same} == {b"200"}
+
+        deadline = time.time() + 2
+        while gate.active and time.time() < deadline:
+            time.sleep(0.01)
+        assert gate.active == 0 and not gate.per_ip
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
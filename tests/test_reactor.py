@@ -0,0 +1,123 @@
+"""
+Tests for the pooled IRC reactor and the compact client representation
+"""
+
+import select
+import socket
+import sys
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+from tests.conftest import IRCTestClient
+from wormnet import admission, irc, state
+from wormnet.irc import ChannelSet, IRCClient
+
+pytestmark = pytest.mark.skipif(not hasattr(select, "epoll"), reason="needs epoll")
+
+
+@pytest.fixture
+def pooled_server(setup_test_config, monkeypatch):
+    """irc.serve on an ephemeral port, clients served by a 2-worker reactor"""
+    reactor = irc.Reactor(2)
+    monkeypatch.setattr(irc, "reactor", reactor)
+    gate = admission.Gate("irc")
+    sock = socket.create_server(("127.0.0.1", 0))
+    thread = threading.Thread(target=irc.serve, args=(sock, gate, 8), daemon=True)
+    thread.start()
+    yield sock.getsockname()[1], gate
+    sock.close()
+    thread.join(timeout=3)
+    reactor.close()
+
+
+def login(port, nick):
+    client = IRCTestClient("127.0.0.1", port)
+    client.connect()
+    client.send("PASS ELSILRACLIHP")
+    client.send(f"NICK {nick}")
+    client.send(f"USER {nick} h s :0 11 US 3.8.1")
+    client.recv_until(" 376 ")
+    return client
+
+
+def wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_reactor_serves_many_clients_on_few_threads(pooled_server):
+    port, gate = pooled_server
+    threads = threading.active_count()
+    clients = [login(port, f"user{i}") for i in range(20)]
+    assert threading.active_count() <= threads + 2  # the pool, not one each
+
+    for c in clients:
+        c.send("JOIN #heaven")
+        c.recv_until(" 366 ")
+    clients[0].send("PRIVMSG #heaven :hello pool")
+    assert any("hello pool" in line for line in clients[-1].recv_until("hello pool"))
+
+    for c in clients:
+        c.close()
+    wait_for(lambda: gate.stats()["active"] == 0)
+    assert not state.irc_clients and not state.irc_connections
+
+
+def test_quit_cleans_up_once(pooled_server):
+    """QUIT closes the socket itself; members see a single QUIT line"""
+    port, gate = pooled_server
+    alice, bob = login(port, "alice"), login(port, "bob")
+    for c in (alice, bob):
+        c.send("JOIN #heaven")
+        c.recv_until(" 366 ")
+    bob.recv_until("alice JOIN", timeout=0.3)  # may already have been read
+
+    alice.send("QUIT :bye")
+    wait_for(lambda: gate.stats()["active"] == 1)
+    bob.send("PING x")
+    lines = bob.recv_until("PONG")
+    assert sum("alice QUIT" in line for line in lines) == 1
+
+
+def test_kill_from_another_thread(pooled_server):
+    port, gate = pooled_server
+    victim = login(port, "victim")
+    irc.find_connection("victim").kill("bye")
+    assert any("Closing Link" in line for line in victim.recv_until("Closing Link"))
+    wait_for(lambda: gate.stats()["active"] == 0)
+
+
+def test_channel_set():
+    channels = ChannelSet()
+    channels.add("#a")
+    channels.add("#a")
+    channels.add("#b")
+    assert len(channels) == 2 and "#a" in channels
+    assert channels == {"#a", "#b"}
+    assert channels & {"#b", "#c"} == {"#b"}
+    channels.remove("#a")
+    assert list(channels) == ["#b"]
+    with pytest.raises(KeyError):
+        channels.remove("#a")
+    channels.discard("#nope")
+    channels.clear()
+    assert not channels
+
+
+def test_client_is_compact(setup_test_config):
+    """slots instead of a __dict__, and strings shared between clients"""
+    a = IRCClient(Mock(), ("192.0.2.1", 1))
+    b = IRCClient(Mock(), ("192.0.2.2", 2))
+    assert not hasattr(a, "__dict__")
+    for client, nick in ((a, "alice"), (b, "bob")):
+        client.process_line("PASS ELSILRACLIHP")
+        client.process_line(f"NICK {nick}")
+        client.process_line(f"USER {nick} h s :0 11 US 3.8.1")
+        client.process_line("JOIN #heaven")
+    assert a.realname is b.realname
+    assert a.channels.names[0] is b.channels.names[0]
+    assert a.nickname is sys.intern("alice")
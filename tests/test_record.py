@@ -0,0 +1,159 @@
+"""
+Tests for the traffic recorder and pcap importer
+"""
+
+import struct
+
+import pytest
+from wormnet import record
+from wormnet.http import app
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """Record to a temp file for the duration of a test"""
+    path = tmp_path / "traffic.wnrec"
+    rec = record.start(str(path))
+    yield path
+    if record.recorder is rec:
+        record.stop()
+
+
+def test_log_roundtrip(tmp_path):
+    """Records come back in order with kind, session and payload intact"""
+    path = tmp_path / "log.wnrec"
+    rec = record.Recorder(str(path))
+    sid = rec.open_session("1.2.3.4")
+    rec.line(sid, b"NICK Player1")
+    rec.http("1.2.3.4", "/wormageddonweb/Login.asp")
+    rec.close_session(sid)
+    rec.close()
+
+    records = list(record.read_log(str(path)))
+    kinds = [r[0] for r in records]
+    assert kinds == [record.OPEN, record.LINE, record.HTTP, record.CLOSE]
+    assert records[0][3] == b"1.2.3.4"
+    assert records[1][2] == sid
+    assert records[1][3] == b"NICK Player1"
+    assert records[2][3] == b"/wormageddonweb/Login.asp"
+
+
+def test_log_outlasts_u32_milliseconds(tmp_path):
+    """timestamps past 49.7 days still pack and read back"""
+    path = tmp_path / "log.wnrec"
+    rec = record.LogWriter(str(path), 0.0)
+    rec.now = 60 * 86400.0
+    rec.close_session(rec.open_session("1.2.3.4"))
+    rec.close()
+    assert [r[1] for r in record.read_log(str(path))] == [5184000.0] * 2
+
+
+def test_read_log_reads_version_1(tmp_path):
+    """logs written with the u32 layout are still readable"""
+    path = tmp_path / "old.wnrec"
+    path.write_bytes(
+        b"WNREC\x00\x01\n"
+        + record.HEADER.pack(0.0)
+        + struct.pack("<BIIH", record.OPEN, 1500, 1, 7)
+        + b"1.2.3.4"
+    )
+    assert list(record.read_log(str(path))) == [(record.OPEN, 1.5, 1, b"1.2.3.4")]
+
+
+def test_read_log_rejects_other_files(tmp_path):
+    """Reading a non-log file raises instead of yielding garbage"""
+    path = tmp_path / "bogus"
+    path.write_bytes(b"not a log at all")
+    with pytest.raises(ValueError):
+        list(record.read_log(str(path)))
+
+
+def test_http_requests_recorded(recording):
+    """wormageddonweb requests land in the log with their query string"""
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        client.get("/wormageddonweb/GameList.asp?Channel=heaven")
+        client.get("/index.html")
+    record.stop()
+
+    paths = [r[3] for r in record.read_log(str(recording)) if r[0] == record.HTTP]
+    assert paths == [b"/wormageddonweb/GameList.asp?Channel=heaven"]
+
+
+def _tcp_frame(src, dst, sport, dport, seq, flags, payload):
+    """Ethernet + IPv4 + TCP frame (checksums left zero)"""
+    tcp = struct.pack("!HHIIBBHHH", sport, dport, seq, 0, 5 << 4, flags, 0, 0, 0)
+    total = 20 + len(tcp) + len(payload)
+    ip = struct.pack(
+        "!BBHHHBBH4s4s", 0x45, 0, total, 0, 0, 64, 6, 0, bytes(src), bytes(dst)
+    )
+    eth = b"\x00" * 12 + b"\x08\x00"
+    return eth + ip + tcp + payload
+
+
+def _write_pcap(path, frames):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for i, frame in enumerate(frames):
+            f.write(struct.pack("<IIII", 1000 + i, 0, len(frame), len(frame)))
+            f.write(frame)
+
+
+def test_import_pcap(tmp_path):
+    """IRC lines and HTTP GETs are reassembled from client->server segments"""
+    client, server = [10, 0, 0, 2], [10, 0, 0, 1]
+    syn, ack, fin = 0x02, 0x10, 0x01
+    frames = [
+        _tcp_frame(client, server, 40000, 6667, 100, syn, b""),
+        _tcp_frame(client, server, 40000, 6667, 101, ack, b"PASS ELSILRACLIHP\r\nNI"),
+        # retransmission of the first segment must not duplicate lines
+        _tcp_frame(client, server, 40000, 6667, 101, ack, b"PASS ELSILRACLIHP\r\nNI"),
+        _tcp_frame(client, server, 40000, 6667, 122, ack, b"CK Player1\r\n"),
+        # server->client traffic is ignored
+        _tcp_frame(server, client, 6667, 40000, 5, ack, b":srv 001 Player1 :hi\r\n"),
+        _tcp_frame(client, server, 40000, 6667, 134, fin | ack, b""),
+        _tcp_frame(
+            client,
+            server,
+            40001,
+            80,
+            7,
+            ack,
+            b"GET /wormageddonweb/Login.asp HTTP/1.0\r\nHost: x\r\n\r\n",
+        ),
+    ]
+    pcap = tmp_path / "capture.pcap"
+    log = tmp_path / "capture.wnrec"
+    _write_pcap(pcap, frames)
+
+    counts = record.import_pcap(str(pcap), str(log))
+    assert counts["irc_sessions"] == 1
+    assert counts["http_requests"] == 1
+
+    records = list(record.read_log(str(log)))
+    lines = [r[3] for r in records if r[0] == record.LINE]
+    assert lines == [b"PASS ELSILRACLIHP", b"NICK Player1"]
+    assert [r[0] for r in records][-2:] == [record.CLOSE, record.HTTP]
+    # timestamps are relative to the first packet
+    assert records[-1][1] == pytest.approx(6.0)
+
+
+def test_import_pcap_ignores_packets_after_fin(tmp_path):
+    """the final ack of a closed connection doesn't open another session"""
+    client, server = [10, 0, 0, 2], [10, 0, 0, 1]
+    syn, ack, fin, rst = 0x02, 0x10, 0x01, 0x04
+    frames = [
+        _tcp_frame(client, server, 40000, 6667, 100, syn, b""),
+        _tcp_frame(client, server, 40000, 6667, 101, ack, b"NICK Player1\r\n"),
+        _tcp_frame(client, server, 40000, 6667, 115, fin | ack, b""),
+        _tcp_frame(client, server, 40000, 6667, 116, ack, b""),
+        _tcp_frame(client, server, 40000, 6667, 116, rst, b""),
+    ]
+    pcap = tmp_path / "capture.pcap"
+    log = tmp_path / "capture.wnrec"
+    _write_pcap(pcap, frames)
+
+    counts = record.import_pcap(str(pcap), str(log))
+    assert counts["irc_sessions"] == 1
+    kinds = [r[0] for r in record.read_log(str(log))]
+    assert kinds == [record.OPEN, record.LINE, record.CLOSE]
@@ -0,0 +1,228 @@
+"""
+Tests for the NAT relay: a fake game host behind the agent, fake joiners on
+the public port, all over loopback
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+from wormnet import relay as relay_mod
+
+
+class FakeGameHost:
+    """stands in for WA hosting on 17011: greets, then echoes upper-cased"""
+
+    def __init__(self):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.addr = self.sock.getsockname()
+        self.accepted = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        conn.sendall(b"HELLO\n")
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            conn.sendall(data.upper())
+        conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def recv_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture(params=[False, True] if relay_mod.SPLICE else [False])
+def relay(request):
+    """Relay on ephemeral ports; parametrized over buffer and splice pumps"""
+    closed = []
+    r = relay_mod.Relay(
+        bind="127.0.0.1",
+        control_port=0,
+        ports=None,
+        idle_timeout=60,
+        claim_timeout=60,
+        splice=request.param,
+        on_close=closed.append,
+    )
+    r.closed = closed
+    r.start()
+    yield r
+    r.stop()
+
+
+@pytest.fixture
+def hosted(relay):
+    """A session with a fake game behind a running agent"""
+    game = FakeGameHost()
+    session = relay.allocate("Player1")
+    ready = threading.Event()
+    threading.Thread(
+        target=relay_mod.run_agent,
+        args=(("127.0.0.1", relay.control_port), session.token, game.addr),
+        kwargs={"ready": lambda port: ready.set()},
+        daemon=True,
+    ).start()
+    assert ready.wait(2)
+    yield session, game
+    game.close()
+
+
+def join(session):
+    sock = socket.create_connection(("127.0.0.1", session.port), timeout=2)
+    assert recv_exactly(sock, 6) == b"HELLO\n"
+    return sock
+
+
+def test_joiners_reach_host(hosted):
+    """Several joiners each get their own stream to the host"""
+    session, game = hosted
+    joiners = [join(session) for _ in range(4)]
+    for i, sock in enumerate(joiners):
+        sock.sendall(f"worm{i}".encode())
+    for i, sock in enumerate(joiners):
+        assert recv_exactly(sock, 5) == f"WORM{i}".encode()
+        sock.close()
+    assert game.accepted == 4
+
+
+def test_bulk_transfer_and_accounting(hosted, relay):
+    """Large transfers arrive intact and are counted in both directions"""
+    session, _ = hosted
+    sock = join(session)
+    payload = bytes(range(97, 123)) * 40000  # ~1 MB of lowercase letters
+
+    sender = threading.Thread(target=sock.sendall, args=(payload,))
+    sender.start()
+    echoed = recv_exactly(sock, len(payload))
+    sender.join()
+    assert echoed == payload.upper()
+
+    assert wait_for(lambda: session.bytes_to_host == len(payload))
+    assert session.bytes_to_joiners == len(payload) + 6
+    [row] = relay.stats()
+    assert row["joiners"] == 1 and row["agent"] is True
+    sock.close()
+    assert wait_for(lambda: not session.links)
+
+
+def test_joiner_refused_without_agent(relay):
+    """Until the host's agent connects, joiners are hung up on"""
+    session = relay.allocate("Player1")
+    sock = socket.create_connection(("127.0.0.1", session.port), timeout=2)
+    assert sock.recv(10) == b""
+
+
+def test_bad_token_rejected(relay):
+    """An agent with an unknown token is disconnected"""
+    with pytest.raises(ConnectionError):
+        relay_mod.run_agent(("127.0.0.1", relay.control_port), "nope")
+
+
+def test_release_closes_port(hosted, relay):
+    """Releasing a session (game closed) frees the port without on_close"""
+    session, _ = hosted
+    relay.release(session.token)
+    assert wait_for(lambda: not relay.stats())
+    with pytest.raises(OSError):
+        socket.create_connection(("127.0.0.1", session.port), timeout=1)
+    assert relay.closed == []
+
+
+def test_idle_session_torn_down(hosted, relay):
+    """A session whose agent goes quiet past idle_timeout is closed and reported"""
+    session, _ = hosted  # the agent's first PING is a minute away
+    relay.idle_timeout = 0.2
+    assert wait_for(lambda: relay.closed == [session], timeout=3)
+    assert relay.stats() == []
+
+
+def test_waiting_lobby_kept_alive_by_agent(relay):
+    """With the agent connected and no joiners, PINGs outlast idle_timeout"""
+    game = FakeGameHost()
+    session = relay.allocate("Player1")
+    ready = threading.Event()
+    threading.Thread(
+        target=relay_mod.run_agent,
+        args=(("127.0.0.1", relay.control_port), session.token, game.addr),
+        kwargs={"ready": lambda port: ready.set(), "keepalive": 0.05},
+        daemon=True,
+    ).start()
+    assert ready.wait(2)
+    relay.idle_timeout = 0.3
+    time.sleep(1.0)
+    assert relay.closed == [] and len(relay.stats()) == 1
+    join(session).close()  # and it still takes joiners
+    game.close()
+
+
+def test_buddy_hosts_through_relay(relay, setup_test_config, monkeypatch):
+    """With the relay on, !host advertises a relay port and PMs the token"""
+    from unittest.mock import Mock
+
+    from wormnet import buddy, config, games, state
+    from wormnet.irc import IRCClient
+
+    monkeypatch.setattr(relay_mod, "relay", relay)
+    monkeypatch.setattr(config, "RELAY_HOST", "relay.example.com")
+    bot = buddy.HostingBuddy("HostingBuddy")
+    bot.join(list(state.irc_channels))
+    player = IRCClient(Mock(), ("100.64.0.9", 4000))
+    player.nickname = player.username = "Player1"
+    player.registered = True
+    player.channels.add("#heaven")
+    state.irc_clients.append(player)
+
+    bot.handle_line(":Player1!~Player1@100.64.0.9 PRIVMSG HostingBuddy :!host")
+    [game] = games.for_channel("heaven")
+    [session] = bot.relayed.values()
+    assert game["address"] == f"relay.example.com:{session.port}"
+    assert session.game_id == game["id"]
+    replies = [c[0][0].decode() for c in player.sock.sendall.call_args_list]
+    assert (
+        f"agent relay.example.com:{relay.control_port} {session.token}" in replies[-1]
+    )
+
+    bot.handle_line(":Player1!~Player1@100.64.0.9 PRIVMSG HostingBuddy :!close")
+    assert wait_for(lambda: not relay.stats())
+    bot.leave()
+
+
+def test_relay_close_closes_game(setup_test_config):
+    """When the relay drops a session its game leaves the lobby"""
+    from types import SimpleNamespace
+
+    from wormnet import buddy, games
+
+    gid = games.create("g", "Player1", "relay:17100", "heaven")
+    buddy.relay_closed(SimpleNamespace(game_id=gid))
+    assert games.get(gid) is None
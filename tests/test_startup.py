@@ -0,0 +1,31 @@
+"""
+Tests for role-split startup
+"""
+
+import socket
+import subprocess
+import sys
+
+import pytest
+from bench import harness
+
+
+def test_irc_role_does_not_import_flask():
+    code = (
+        "import sys, wormnet, wormnet.irc;"
+        "assert 'flask' not in sys.modules, 'flask imported';"
+        "wormnet.http;"
+        "assert 'flask' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=harness.ROOT, check=True)
+
+
+@pytest.mark.parametrize("role", ["irc", "http"])
+def test_role_opens_only_its_listener(role):
+    server = harness.start_subprocess(role=role)
+    try:
+        other = server.http_port if role == "irc" else server.irc_port
+        with pytest.raises(OSError):
+            socket.create_connection((server.host, other), timeout=0.5).close()
+    finally:
+        server.stop()
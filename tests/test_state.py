@@ -0,0 +1,109 @@
+"""
+Tests for the copy-on-write state layer
+"""
+
+import threading
+from unittest.mock import Mock
+
+from wormnet import games, state
+from wormnet.irc import IRCClient
+
+
+def client(nick, *channels):
+    c = IRCClient(Mock(), ("192.0.2.1", 5000))
+    c.nickname = c.username = nick
+    c.registered = True
+    for name in channels:
+        c.channels.add(name)
+    return c
+
+
+def test_snapshot_is_unaffected_by_later_writes():
+    items = state.SnapshotSet(["a", "b"])
+    snap = items.snapshot()
+    items.add("c")
+    items.discard("a")
+    assert snap == ("a", "b")
+    assert list(items) == ["b", "c"] and "c" in items and len(items) == 2
+
+
+def test_concurrent_writers_lose_nothing():
+    items = state.SnapshotSet()
+
+    def writer(base):
+        for i in range(500):
+            items.add(base + i)
+
+    threads = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(items) == 2000
+
+
+def test_registry_indexes_nicks_and_channel_members(setup_test_config):
+    alice = client("alice", "#heaven")
+    bob = client("bob", "#heaven", "#AnythingGoes")
+    state.irc_clients.append(alice)
+    state.irc_clients.append(bob)
+    assert state.irc_clients.find("alice") is alice
+    assert state.members("#heaven") == (alice, bob)
+    assert state.members("#nowhere") == ()
+
+    # channel changes on a registered client are mirrored
+    alice.channels.add("#AnythingGoes")
+    bob.channels.discard("#heaven")
+    assert state.members("#heaven") == (alice,)
+    assert set(state.members("#AnythingGoes")) == {alice, bob}
+
+    state.irc_clients.remove(bob)
+    assert state.irc_clients.find("bob") is None
+    assert state.members("#AnythingGoes") == (alice,)
+
+
+def test_registry_rename(setup_test_config):
+    alice = client("alice")
+    state.irc_clients.append(alice)
+    alice.process_line("NICK alicia")
+    assert state.irc_clients.find("alicia") is alice
+    assert state.irc_clients.find("alice") is None
+
+
+def test_shared_nick_goes_to_the_first_holder(setup_test_config):
+    first, second, third = client("alice"), client("alice"), client("bob")
+    for c in (first, second, third):
+        state.irc_clients.append(c)
+    assert state.irc_clients.find("alice") is first
+
+    # a later client renaming onto the nick doesn't take it over either
+    third.process_line("NICK alice")
+    assert state.irc_clients.find("alice") is first
+
+    # the duplicates leaving doesn't lose the holder
+    state.irc_clients.remove(second)
+    state.irc_clients.remove(third)
+    assert state.irc_clients.find("alice") is first
+
+    # and the holder leaving passes the nick on in join order
+    state.irc_clients.append(second)
+    state.irc_clients.remove(first)
+    assert state.irc_clients.find("alice") is second
+    state.irc_clients.remove(second)
+    assert state.irc_clients.find("alice") is None and not state.irc_clients.nicks
+
+
+def test_unregistered_clients_are_not_members(setup_test_config):
+    alice = client("alice", "#heaven")
+    assert state.members("#heaven") == ()
+    state.irc_clients.append(alice)
+    assert state.members("#heaven") == (alice,)
+
+
+def test_game_snapshot_follows_changes():
+    gid = games.create("first", "alice", "192.0.2.1", "heaven")
+    assert [g["name"] for g in games.for_channel("heaven")] == ["first"]
+    games.create("second", "bob", "192.0.2.2", "heaven")
+    games.close(gid)
+    assert [g["name"] for g in games.for_channel("heaven")] == ["second"]
+    assert games.for_channel("AnythingGoes") == []
@@ -0,0 +1,99 @@
+"""
+Tests for the /status lobby view
+"""
+
+from unittest.mock import Mock
+
+import pytest
+from wormnet import games, status
+from wormnet.http import app
+from wormnet.irc import IRCClient
+
+
+def online(nick, realname, *channels):
+    client = IRCClient(Mock(), ("192.0.2.1", 5000))
+    for line in ("PASS ELSILRACLIHP", f"NICK {nick}", f"USER {nick} h s :{realname}"):
+        client.process_line(line)
+    if channels:
+        client.process_line(f"JOIN {','.join(channels)}")
+    return client
+
+
+@pytest.fixture
+def lobby(setup_test_config, monkeypatch):
+    lobby = status.Lobby(max_age=0)
+    lobby.start()
+    monkeypatch.setattr(status, "lobby", lobby)
+    yield lobby
+    lobby.stop()
+
+
+def channel(data, name):
+    return next(c for c in data["channels"] if c["name"] == name)
+
+
+def test_parse_realname():
+    assert status.parse_realname("48 11 US 3.8.1") == (11, "US")
+    assert status.parse_realname("48 x") == (None, None)
+    assert status.parse_realname(None) == (None, None)
+
+
+def test_aggregates_follow_joins_parts_and_quits(lobby):
+    alice = online("alice", "48 11 US 3.8.1", "#heaven", "#AnythingGoes")
+    online("bob", "48 3 GB 3.8.1", "#heaven")
+    online("carol", "48 3 GB 3.8.1")
+    data = lobby.build()
+    assert data["users"] == 3
+    assert channel(data, "#heaven")["users"] == ["alice", "bob"]
+    assert data["countries"] == {"GB": 2, "US": 1}
+    assert data["ranks"] == {"3": 2, "11": 1}
+
+    alice.process_line("PART #heaven")
+    alice.process_line("NICK alicia")
+    data = lobby.build()
+    assert channel(data, "#heaven")["users"] == ["bob"]
+    assert channel(data, "#AnythingGoes")["users"] == ["alicia"]
+
+    alice.cleanup()
+    data = lobby.build()
+    assert data["users"] == 2 and data["countries"] == {"GB": 2}
+    assert channel(data, "#AnythingGoes")["users"] == []
+
+
+def test_users_online_before_start_are_counted(setup_test_config):
+    online("alice", "48 11 US 3.8.1", "#heaven")
+    lobby = status.Lobby()
+    lobby.start()
+    try:
+        data = lobby.build()
+    finally:
+        lobby.stop()
+    assert data["users"] == 1 and channel(data, "#heaven")["users"] == ["alice"]
+
+
+def test_snapshot_is_reused_until_max_age(lobby):
+    lobby.max_age = 60
+    first = lobby.snapshot()
+    online("alice", "48 11 US 3.8.1")
+    assert lobby.snapshot() is first and lobby.rebuilds == 1
+    lobby.max_age = 0
+    assert lobby.snapshot()[0]["users"] == 1
+
+
+def test_endpoints(lobby):
+    online("alice", "48 11 <b> 3.8.1", "#heaven")
+    games.create("g", "alice", "192.0.2.1:17011", "heaven")
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        data = client.get("/status.json").get_json()
+        assert data["games"] == 1 and channel(data, "#heaven")["games"] == 1
+        page = client.get("/status")
+        assert page.mimetype == "text/html"
+        assert "&lt;b&gt;" in page.get_data(as_text=True)
+
+
+def test_endpoints_off(monkeypatch):
+    monkeypatch.setattr(status, "lobby", None)
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        assert client.get("/status.json").status_code == 404
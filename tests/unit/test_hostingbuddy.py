@@ -276,3 +276,178 @@ def test_handle_close_command_no_game(mock_close):
     mock_close.assert_not_called()
     call_text = mock_sock.sendall.call_args[0][0].decode()
     assert "don't have" in call_text.lower() or "no" in call_text.lower()
+
+
+def test_dispatcher_keeps_order_per_nick():
+    """Commands from one nick run in order even when others run concurrently"""
+    import threading
+    import time
+
+    ran = []
+    lock = threading.Lock()
+
+    def work(nick, seq, delay):
+        time.sleep(delay)
+        with lock:
+            ran.append((nick, seq))
+
+    dispatcher = hostingbuddy.CommandDispatcher(workers=4)
+    for seq in range(5):
+        # earlier commands are slower, so only the queue keeps them in order
+        dispatcher.submit("Player1", work, "Player1", seq, 0.01 * (5 - seq))
+        dispatcher.submit("Player2", work, "Player2", seq, 0)
+    dispatcher.shutdown(wait=True)
+
+    assert [s for n, s in ran if n == "Player1"] == list(range(5))
+    assert [s for n, s in ran if n == "Player2"] == list(range(5))
+    # Player2 was not stuck behind Player1's slow commands
+    assert ran.index(("Player2", 4)) < ran.index(("Player1", 4))
+
+
+def test_dispatcher_survives_failing_command():
+    """An exception in one command doesn't stop that nick's queue"""
+    done = []
+    dispatcher = hostingbuddy.CommandDispatcher(workers=2)
+    dispatcher.submit("Player1", lambda: 1 / 0)
+    dispatcher.submit("Player1", done.append, "ok")
+    dispatcher.shutdown(wait=True)
+    assert done == ["ok"]
+
+
+@patch("hostingbuddy.handle_host_command")
+def test_dispatch_command_host(mock_host):
+    """!host in a channel is queued with the channel name"""
+    mock_sock = Mock()
+    state = hostingbuddy.GameState()
+    dispatcher = hostingbuddy.CommandDispatcher(workers=1)
+    msg = hostingbuddy.parse_privmsg(":Player1!u@1.2.3.4 PRIVMSG #AnythingGoes :!host")
+
+    hostingbuddy.dispatch_command(
+        mock_sock, msg, state, dispatcher, public_ip="5.6.7.8"
+    )
+    dispatcher.shutdown(wait=True)
+
+    mock_host.assert_called_once_with(mock_sock, msg, state, "AnythingGoes", "5.6.7.8")
+
+
+def test_configure_http_uses_session():
+    """Game.asp calls go through one keep-alive session once configured"""
+    import requests
+
+    try:
+        session = hostingbuddy.configure_http("http://wormnet:8081/", pool_size=4)
+        assert hostingbuddy.HTTP_BASE == "http://wormnet:8081"
+        assert hostingbuddy.http_client is session
+
+        with patch.object(session, "get") as mock_get:
+            mock_get.return_value = Mock(status_code=200)
+            assert hostingbuddy.close_game(5) is True
+        url = mock_get.call_args[0][0]
+        assert url == "http://wormnet:8081/wormageddonweb/Game.asp"
+    finally:
+        hostingbuddy.HTTP_BASE = "http://localhost:8081"
+        hostingbuddy.http_client = requests
+
+
+def test_locked_socket_delegates():
+    """LockedSocket forwards sendall and everything else to the socket"""
+    mock_sock = Mock()
+    sock = hostingbuddy.LockedSocket(mock_sock)
+    hostingbuddy.send_line(sock, "PONG :x")
+    sock.close()
+    mock_sock.sendall.assert_called_once_with(b"PONG :x\r\n")
+    mock_sock.close.assert_called_once()
+
+
+def test_game_state_expires_by_deadline():
+    """Games past the server timeout read as gone and come off the heap"""
+    state = hostingbuddy.GameState(ttl=300)
+    state.store_game("Old", 1, "heaven", now=1000)
+    state.store_game("New", 2, "heaven", now=1200)
+
+    assert state.expire(now=1299) == []
+    assert state.expire(now=1300) == ["Old"]
+    assert "Old" not in state.games
+    assert state.expire(now=1500) == ["New"]
+
+
+def test_game_state_lookup_ignores_expired():
+    """has_game is False once the deadline passed, even before expire()"""
+    state = hostingbuddy.GameState(ttl=300)
+    state.store_game("Player1", 1, "heaven", now=1000)
+    assert state.has_game("Player1") is False
+
+
+def test_game_state_refresh_supersedes_old_deadline():
+    """A refreshed game isn't expired by its original heap entry"""
+    state = hostingbuddy.GameState(ttl=300)
+    state.store_game("Player1", 1, "heaven", now=1000)
+    assert state.refresh_game("Player1", 1, now=1250) is True
+    assert state.expire(now=1300) == []
+    assert state.expire(now=1550) == ["Player1"]
+    # refreshing a game the user no longer has is refused
+    assert state.refresh_game("Player1", 1) is False
+
+
+def gamelist_response(status, ids=(), etag='"7"'):
+    body = "<GAMELISTSTART>\r\n"
+    for gid in ids:
+        body += f"<GAME g{gid} host 1.2.3.4:17011 48 1 0 {gid} 0><BR>\r\n"
+    body += "<GAMELISTEND>\r\n"
+    return Mock(status_code=status, text=body, headers={"ETag": etag})
+
+
+@patch("hostingbuddy.http_client")
+def test_reconcile_drops_unlisted_games(mock_http):
+    """Games missing from GameList.asp are forgotten; the ETag is reused"""
+    state = hostingbuddy.GameState()
+    state.store_game("Gone", 1, "heaven", now=1)
+    state.store_game("Live", 2, "heaven", now=1)
+    reconciler = hostingbuddy.Reconciler(state)
+
+    mock_http.get.return_value = gamelist_response(200, ids=[2])
+    assert reconciler.reconcile() == ["Gone"]
+    assert "Live" in state.games
+
+    mock_http.get.return_value = Mock(status_code=304, headers={})
+    state.store_game("Other", 3, "heaven", now=1)
+    assert reconciler.reconcile() == []
+    assert mock_http.get.call_args[1]["headers"] == {"If-None-Match": '"7"'}
+
+
+@patch("hostingbuddy.http_client")
+def test_reconcile_keeps_games_created_during_fetch(mock_http):
+    """A game stored after the list was requested isn't dropped"""
+    state = hostingbuddy.GameState()
+    state.store_game("Fresh", 5, "heaven", now=10**10)
+    mock_http.get.return_value = gamelist_response(200, ids=[])
+    assert hostingbuddy.Reconciler(state).reconcile() == []
+
+
+@patch("hostingbuddy.refresh_game")
+def test_keepalive_refreshes_due_games(mock_refresh):
+    """With keepalive, games near their deadline are refreshed or dropped"""
+    state = hostingbuddy.GameState(ttl=300)
+    state.store_game("Kept", 1, "heaven", now=1000)
+    state.store_game("Lost", 2, "heaven", now=1000)
+    mock_refresh.side_effect = lambda gid, http_base=None: gid == 1
+    reconciler = hostingbuddy.Reconciler(state, interval=10**9, keepalive=True)
+
+    reconciler.tick(now=1250)  # inside the last fifth of the ttl
+    assert state.games["Kept"]["deadline"] == 1550
+    assert "Lost" not in state.games
+
+
+@patch("hostingbuddy.refresh_game")
+def test_keepalive_stops_at_max_age(mock_refresh):
+    """Games older than max_age are left to expire"""
+    state = hostingbuddy.GameState(ttl=300)
+    state.store_game("Ancient", 1, "heaven", now=1000)
+    reconciler = hostingbuddy.Reconciler(
+        state, interval=10**9, keepalive=True, max_age=100
+    )
+
+    reconciler.tick(now=1250)
+    mock_refresh.assert_not_called()
+    reconciler.tick(now=1300)
+    assert "Ancient" not in state.games
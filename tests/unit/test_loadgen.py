@@ -0,0 +1,11 @@
+from bench.loadgen import percentile
+
+
+def test_percentile_nearest_rank():
+    """p50 of 1..10 is 5 and p99 of 1..100 is 99, not one rank higher"""
+    assert percentile(list(range(10, 0, -1)), 50) == 5
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile(list(range(1, 101)), 100) == 100
+    assert percentile(list(range(1, 11)), 0) == 1
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
@@ -3,11 +3,38 @@
 # dependencies = ["flask", "tomli"]
 # ///
 """minimal wormnet server for worms armageddon"""
+
 import argparse
 import logging
+import signal
+import sys
 import threading
+import time
 from pathlib import Path
-from wormnet import config, http, irc
+
+# time-to-listen counts from here: our own imports onwards
+STARTED = time.perf_counter()
+
+# only what every role needs; irc, http (flask) and buddy load in main()
+from wormnet import config, ipfilter, overload, profiling, proxy, record  # noqa: E402
+
+ROLES = ("all", "irc", "http")
+
+
+def reload_ipfilter():
+    """SIGHUP: re-read the ip filter rules, keeping the old ones on error"""
+    try:
+        ipfilter.reload()
+    except (OSError, ValueError) as e:
+        logging.error(f"IP filter reload failed: {e}")
+
+
+def listening(what):
+    """log time-to-listen for one listener"""
+    logging.info(
+        f"{what} listening {time.perf_counter() - STARTED:.3f}s after start"
+        f" ({len(sys.modules)} modules loaded)"
+    )
 
 
 def main():
@@ -22,6 +49,22 @@ def main():
         default="wormnet.toml",
         help="path to config file (default: wormnet.toml)",
     )
+    parser.add_argument(
+        "--buddy",
+        action="store_true",
+        help="run hostingbuddy inside the server instead of as a separate bot",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="record inbound irc lines and http requests to FILE for replay",
+    )
+    parser.add_argument(
+        "--role",
+        choices=ROLES,
+        default="all",
+        help="which servers to run in this process (default: all)",
+    )
     args = parser.parse_args()
 
     # load config if file exists, otherwise use defaults
@@ -42,14 +85,75 @@ def main():
         logging.info(f"  Channels: {', '.join(config.CHANNELS.keys())}")
         config.build_irc_channels()
 
-    # start irc server in background
-    irc_thread = threading.Thread(target=irc.run_server, daemon=True)
-    irc_thread.start()
+    if args.record:
+        config.RECORD_FILE = args.record
+    if config.RECORD_FILE:
+        record.start(config.RECORD_FILE)
+
+    profiling.install_signal_handlers()
+
+    ipfilter.load()
+    proxy.load()
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_ipfilter())
+
+    if config.OVERLOAD_ENABLED:
+        overload.start()
+
+    if config.FEDERATION_ENABLED:
+        from wormnet import federation
+
+        federation.start()
+
+    if args.buddy:
+        config.BUDDY_ENABLED = True
+    # buddy registers games and joins channels, so it needs both tables here
+    if (config.BUDDY_ENABLED or config.RELAY_ENABLED) and args.role != "all":
+        logging.warning(f"HostingBuddy and relay need --role all, not {args.role}")
+    elif config.BUDDY_ENABLED or config.RELAY_ENABLED:
+        from wormnet import buddy, relay
+
+        if config.RELAY_ENABLED:
+            relay.start(on_close=buddy.relay_closed)
+        if config.BUDDY_ENABLED:
+            buddy.start()
+
+    serve = []
+    if args.role in ("all", "irc"):
+        from wormnet import irc
+
+        irc_sock = irc.listen()
+        listening("IRC")
+        serve.append(lambda: irc.run_server(irc_sock))
+        if config.POOL_REPORT_TO:
+            from wormnet import pool
+
+            pool.start_reporter()
+
+    if args.role in ("all", "http"):
+        from wormnet import http
+
+        if config.POOL_NODES:
+            from wormnet import pool
+
+            pool.start()
+        if config.PLAYERS_ENABLED:
+            from wormnet import players
+
+            players.start()
+        if config.STATUS_ENABLED:
+            from wormnet import status
+
+            status.start()
+        httpd = http.make_server("0.0.0.0", config.HTTP_PORT)
+        listening("HTTP")
+        logging.info(f"Configure Worms to connect to: {config.IRC_HOST}")
+        serve.append(httpd.serve_forever)
 
-    # start http server
-    logging.info(f"HTTP server starting on port {config.HTTP_PORT}")
-    logging.info(f"Configure Worms to connect to: {config.IRC_HOST}")
-    http.app.run(host="0.0.0.0", port=config.HTTP_PORT, threaded=True)
+    # the last server runs on the main thread
+    for run in serve[:-1]:
+        threading.Thread(target=run, daemon=True).start()
+    serve[-1]()
 
 
 if __name__ == "__main__":
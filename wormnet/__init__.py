@@ -1,7 +1,14 @@
 """wormnet - minimal worms armageddon server"""
 
-__version__ = "0.1.0"
+import importlib
 
-from . import state, config, http, irc
+__version__ = "0.1.0"
 
 __all__ = ["state", "config", "http", "irc"]
+
+
+def __getattr__(name):
+    # submodules load on first use, so an irc-only process never pulls in flask
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,170 @@
+"""operator endpoints for wormnet (under /admin/)
+
+disabled unless [admin] token is set. every request must carry the token in
+an X-Admin-Token header or a token= query parameter.
+"""
+
+import collections
+import hmac
+
+from flask import Blueprint, abort, jsonify, request
+
+from . import admission, config, events, federation, games, ipfilter, irc, overload
+from . import players, pool, profiling, relay, state
+
+bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@bp.before_request
+def require_token():
+    """404 when admin is off, 403 on a bad token"""
+    if not config.ADMIN_TOKEN:
+        abort(404)
+    token = request.headers.get("X-Admin-Token") or request.args.get("token", "")
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        abort(403)
+
+
+@bp.route("/profile/cpu", methods=["POST"])
+def profile_cpu():
+    """start sampling all threads for ?seconds=N in the background"""
+    seconds = request.args.get("seconds", type=float)
+    if not profiling.start_cpu_profile(seconds):
+        return jsonify(error="cpu profile already running"), 409
+    return jsonify(started=True, dir=str(config.PROFILE_DIR)), 202
+
+
+@bp.route("/profile/memory", methods=["POST"])
+def profile_memory_start():
+    """start tracemalloc and take the baseline snapshot"""
+    if not profiling.start_memory():
+        return jsonify(error="memory tracking already running"), 409
+    return jsonify(started=True), 202
+
+
+@bp.route("/profile/memory", methods=["DELETE"])
+def profile_memory_stop():
+    """write the growth-by-allocation-site diff and stop tracemalloc"""
+    path = profiling.stop_memory()
+    if path is None:
+        return jsonify(error="memory tracking not running"), 409
+    return jsonify(path=str(path))
+
+
+@bp.route("/clients")
+def clients():
+    """per-connection counters
+
+    ?sort=<key>&order=asc|desc&match=<nick or ip substring>&idle_min=<s>&limit=<n>
+    """
+    sort = request.args.get("sort", "bytes_in")
+    if sort not in irc.SORT_KEYS:
+        return jsonify(error=f"sort must be one of {', '.join(irc.SORT_KEYS)}"), 400
+    rows = irc.list_connections(
+        sort=sort,
+        reverse=request.args.get("order", "desc") != "asc",
+        match=request.args.get("match"),
+        idle_min=request.args.get("idle_min", type=float),
+        limit=request.args.get("limit", type=int),
+    )
+    return jsonify(clients=rows)
+
+
+@bp.route("/clients/<target>/kill", methods=["POST"])
+def kill_client(target):
+    """disconnect a connection by nick or numeric id"""
+    client = irc.find_connection(f"#{target}" if target.isdigit() else target)
+    if client is None:
+        return jsonify(error="no such connection"), 404
+    client.kill(request.args.get("reason", "Killed by admin"))
+    return jsonify(killed=client.id)
+
+
+@bp.route("/admission")
+def admission_stats():
+    """active/admitted/rejected counts and busiest ips per listener"""
+    return jsonify({name: gate.stats() for name, gate in admission.gates.items()})
+
+
+@bp.route("/games")
+def game_table():
+    """game table size against its cap, evictions and refused creates"""
+    table, _ = games.snapshot()
+    creators = collections.Counter(
+        ip for ip in state.game_creators.values() if ip is not None
+    )
+    return jsonify(
+        games=len(table),
+        max=config.GAME_MAX,
+        evicted=games.evicted,
+        refused=dict(games.refused),
+        top_creators=dict(creators.most_common(10)),
+        feed={"changes": len(games.changes), "waiting": games.waiting},
+    )
+
+
+@bp.route("/events")
+def event_bus():
+    """subscribers, queued events, batches and events delivered by type"""
+    return jsonify(events.bus.stats())
+
+
+@bp.route("/players")
+def player_info():
+    """store counters, a player by ?nick=, or the top ?limit= by ?by="""
+    if players.store is None:
+        return jsonify(error="player info not enabled"), 404
+    nick = request.args.get("nick")
+    if nick:
+        player = players.store.get(nick)
+        return jsonify(player) if player else (jsonify(error="not found"), 404)
+    top = players.store.top(
+        request.args.get("limit", 10, type=int), request.args.get("by", "updates")
+    )
+    return jsonify(players.store.stats(), top=top)
+
+
+@bp.route("/overload")
+def overload_stats():
+    """shedding state, current signals, transition counts and history"""
+    return jsonify(overload.controller.stats())
+
+
+@bp.route("/relay")
+def relay_sessions():
+    """relayed games with per-session byte counts"""
+    if relay.relay is None:
+        return jsonify(error="relay not enabled"), 404
+    return jsonify(sessions=relay.relay.stats())
+
+
+@bp.route("/federation")
+def federation_links():
+    """linked nodes with their users, channels and round trip times"""
+    if not config.FEDERATION_ENABLED:
+        return jsonify(error="federation not enabled"), 404
+    return jsonify(federation.stats())
+
+
+@bp.route("/pool")
+def pool_nodes():
+    """irc pool nodes with their last reported load and health"""
+    if pool.pool is None:
+        return jsonify(error="irc pool not configured"), 404
+    return jsonify(pool.pool.stats())
+
+
+@bp.route("/ipfilter")
+def ipfilter_stats():
+    """ip filter rules by hit count (?limit=<n>)"""
+    return jsonify(ipfilter.active.stats(request.args.get("limit", 100, type=int)))
+
+
+@bp.route("/ipfilter/reload", methods=["POST"])
+def ipfilter_reload():
+    """re-read [ipfilter] from the config file; counters start over"""
+    try:
+        active = ipfilter.reload()
+    except (OSError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(rules=len(active.rules), default=active.default)
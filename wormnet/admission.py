@@ -0,0 +1,165 @@
+"""admission control for the irc and http listeners
+
+each listener has a gate: a token bucket that paces accepts (connections
+wait in the kernel backlog while it's empty), a cap on concurrent
+connections and a cap per client ip. rejected connections get a short
+protocol-appropriate error before they're closed.
+
+an http connection from a trusted proxy only counts against the global cap
+when it's accepted; its client is counted per ip (admit_address) once
+X-Forwarded-For has been read, see http.GatedWSGIServer.
+"""
+
+import collections
+import threading
+import time
+
+from . import config
+
+# listener name -> Gate, for the admin endpoint
+gates = {}
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst banked; rate <= 0 means unlimited"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self):
+        """take a token if one is available"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refund(self):
+        """give back a token taken for an accept that found nothing"""
+        if self.rate > 0:
+            with self.lock:
+                self.tokens = min(self.burst, self.tokens + 1)
+
+    def wait(self):
+        """block until a token is available, then take it"""
+        while not self.take():
+            with self.lock:
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class Gate:
+    """connection caps for one listener (0 disables a cap)"""
+
+    def __init__(self, name, max_clients=0, max_per_ip=0, rate=0, burst=1, exempt=()):
+        self.name = name
+        self.max_clients = max_clients
+        self.max_per_ip = max_per_ip
+        self.exempt = set(exempt)
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.per_ip = collections.Counter()
+        self.admitted = 0
+        self.rejected = collections.Counter()
+
+    def throttle(self):
+        """pace accepts to the configured rate"""
+        self.bucket.wait()
+
+    def admit(self, ip):
+        """count a new connection in; returns a rejection reason or None
+
+        ip None skips the per-ip cap (a trusted proxy's connection).
+        """
+        with self.lock:
+            if self.max_clients and self.active >= self.max_clients:
+                self.rejected["server full"] += 1
+                return "Server full"
+            if ip is not None and self._over(ip):
+                return "Too many connections from your address"
+            self.active += 1
+            if ip is not None:
+                self.per_ip[ip] += 1
+            self.admitted += 1
+            return None
+
+    def release(self, ip):
+        """count an admitted connection out"""
+        with self.lock:
+            self.active -= 1
+            if ip is not None:
+                self._drop(ip)
+
+    def admit_address(self, ip):
+        """count a client behind a trusted proxy in against the per-ip cap"""
+        with self.lock:
+            if self._over(ip):
+                return "Too many connections from your address"
+            self.per_ip[ip] += 1
+            return None
+
+    def release_address(self, ip):
+        with self.lock:
+            self._drop(ip)
+
+    def _over(self, ip):
+        if self.max_per_ip and ip not in self.exempt:
+            if self.per_ip[ip] >= self.max_per_ip:
+                self.rejected["per ip"] += 1
+                return True
+        return False
+
+    def _drop(self, ip):
+        self.per_ip[ip] -= 1
+        if self.per_ip[ip] <= 0:
+            del self.per_ip[ip]
+
+    def stats(self, top=10):
+        with self.lock:
+            return {
+                "active": self.active,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "max_clients": self.max_clients,
+                "max_per_ip": self.max_per_ip,
+                "accept_rate": self.bucket.rate,
+                "top_ips": dict(self.per_ip.most_common(top)),
+            }
+
+
+def irc_gate():
+    """gate for the irc listener, from config"""
+    gates["irc"] = Gate(
+        "irc",
+        max_clients=config.IRC_MAX_CLIENTS,
+        max_per_ip=config.IRC_MAX_PER_IP,
+        rate=config.IRC_ACCEPT_RATE,
+        burst=config.IRC_ACCEPT_BURST,
+        exempt=config.ADMISSION_EXEMPT,
+    )
+    return gates["irc"]
+
+
+def http_gate():
+    """gate for the http listener, from config"""
+    gates["http"] = Gate(
+        "http",
+        max_clients=config.HTTP_MAX_CLIENTS,
+        max_per_ip=config.HTTP_MAX_PER_IP,
+        rate=config.HTTP_ACCEPT_RATE,
+        burst=config.HTTP_ACCEPT_BURST,
+        exempt=config.ADMISSION_EXEMPT,
+    )
+    return gates["http"]
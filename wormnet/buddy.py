@@ -0,0 +1,221 @@
+"""embedded hostingbuddy: a virtual irc user living inside the server
+
+the standalone hostingbuddy.py logs in over irc and calls Game.asp over
+http. this one is registered straight into state.irc_clients, so channel and
+private PRIVMSGs reach it through the normal routing, and it creates and
+closes games through the game store with no network round trip.
+
+messages are handed to it on the sender's thread, so send() only queues
+them; a single worker thread does the actual handling.
+"""
+
+import logging
+import queue
+import re
+import threading
+
+from . import events, state, config, games, relay
+
+# ":nick[!user@host] PRIVMSG target :[!]command args"
+PRIVMSG_RE = re.compile(r":([^! ]+)\S* PRIVMSG (\S+) :!?(\w+)")
+
+# running instance, None when the embedded buddy is off
+bot = None
+
+
+class HostingBuddy:
+    """virtual irc user that hosts games on behalf of players"""
+
+    # not announced to linked nodes; each node runs its own
+    federated = False
+
+    def __init__(self, nick, public_ip="", game_port=17011, scheme=""):
+        self.nickname = nick
+        self.username = nick
+        self.realname = "51 11 ZZ 3.8.1"
+        self.addr = ("127.0.0.1", 0)
+        self.registered = True
+        self.oper = False
+        self.channels = state.ChannelSet(self)
+        self.public_ip = public_ip
+        self.game_port = game_port
+        self.scheme = scheme
+        self.hosted = {}  # player nick -> game id
+        self.relayed = {}  # player nick -> relay session
+        self.inbox = queue.Queue()
+        self._thread = None
+
+    def send(self, msg, data=None):
+        """called by the irc server for every line routed to this user"""
+        self.inbox.put(msg)
+
+    def join(self, channels):
+        """register with the server and sit in the given channels"""
+        state.irc_clients.append(self)
+        events.publish(events.UserRegistered(self))
+        for channame in channels:
+            if channame in state.irc_channels:
+                self.channels.add(channame)
+                state.irc_channels[channame]["users"].add(self.nickname)
+                events.publish(events.ChannelJoined(self, channame))
+
+    def leave(self):
+        state.irc_clients.discard(self)
+        for channame in self.channels:
+            if channame in state.irc_channels:
+                state.drop_user(channame, self.nickname)
+        events.publish(events.UserQuit(self, tuple(self.channels), "Leaving"))
+        self.channels.clear()
+        self.inbox.put(None)
+
+    def start(self, channels):
+        self.join(channels)
+        self._thread = threading.Thread(
+            target=self.run, name="hostingbuddy", daemon=True
+        )
+        self._thread.start()
+        logging.info(
+            f"HostingBuddy: embedded as {self.nickname} in {', '.join(sorted(self.channels))}"
+        )
+
+    def run(self):
+        while True:
+            line = self.inbox.get()
+            if line is None:
+                return
+            try:
+                self.handle_line(line)
+            except Exception:
+                logging.exception(f"HostingBuddy: failed on {line!r}")
+
+    def handle_line(self, line):
+        match = PRIVMSG_RE.match(line)
+        if not match:
+            return
+        nick, target, command = match.groups()
+        player = self.find_client(nick)
+        if player is None:
+            return
+        reply_to = target if target.startswith("#") else nick
+
+        if command.lower() == "host":
+            channel = target if target.startswith("#") else self.home_channel(player)
+            if channel is None:
+                self.reply(reply_to, f"{nick}: Join a channel first")
+                return
+            self.host(player, channel, reply_to)
+        elif command.lower() == "close":
+            self.close(nick, reply_to)
+
+    def find_client(self, nick):
+        client = state.irc_clients.find(nick)
+        return client if client is not self else None
+
+    def home_channel(self, player):
+        """channel to list a game in when !host came as a private message"""
+        candidates = sorted(player.channels & self.channels) or sorted(player.channels)
+        return candidates[0] if candidates else None
+
+    def host(self, player, channel, reply_to):
+        nick = player.nickname
+        gid = self.hosted.get(nick)
+        if gid is not None and games.get(gid) is not None:
+            self.reply(reply_to, f"{nick}: Close your existing game first")
+            return
+
+        self.release_relay(nick)
+        host_ip, port = self.public_ip or player.addr[0], self.game_port
+        session = None
+        if relay.relay:
+            try:
+                session = relay.relay.allocate(nick)
+            except OSError:
+                self.reply(reply_to, f"{nick}: No relay port free, try again later")
+                return
+            host_ip, port = self.relay_host(), session.port
+
+        scheme = self.scheme or "Intermediate"
+        gid = games.create(
+            name=f"{scheme}.for.{nick}",
+            host=nick,
+            address=f"{host_ip}:{port}",
+            channel=channel.lstrip("#"),
+            location="48",
+            type="0",
+            scheme=scheme,
+            host_ip=player.addr[0],
+        )
+        self.hosted[nick] = gid
+        logging.info(f"HostingBuddy: created game {gid} for {nick} in {channel}")
+        self.reply(
+            reply_to,
+            f"{nick}: Game created (ID: {gid}, IP: {host_ip}:{port}). Use !close to remove it.",
+        )
+        if session:
+            session.game_id = gid
+            self.relayed[nick] = session
+            # the token is the host's only credential, so never say it in a channel
+            self.reply(
+                nick,
+                f"{nick}: Relay token {session.token} - run: python -m wormnet.relay"
+                f" agent {self.relay_host()}:{relay.relay.control_port} {session.token}",
+            )
+
+    def relay_host(self):
+        return config.RELAY_HOST or self.public_ip or config.IRC_HOST or "127.0.0.1"
+
+    def release_relay(self, nick):
+        session = self.relayed.pop(nick, None)
+        if session and relay.relay:
+            relay.relay.release(session.token)
+
+    def close(self, nick, reply_to):
+        self.release_relay(nick)
+        gid = self.hosted.pop(nick, None)
+        if gid is None or not games.close(gid):
+            self.reply(reply_to, f"{nick}: You don't have an active game")
+            return
+        logging.info(f"HostingBuddy: closed game {gid} for {nick}")
+        self.reply(reply_to, f"{nick}: Game closed.")
+
+    def reply(self, target, text):
+        """PRIVMSG a channel or a user as if sent over irc"""
+        msg = (
+            f":{self.nickname}!~{self.username}@{self.addr[0]} PRIVMSG {target} :{text}"
+        )
+        if target.startswith("#"):
+            recipients = state.members(target)
+        else:
+            recipients = [state.irc_clients.find(target)]
+        for client in recipients:
+            if client is not None and client is not self:
+                client.send(msg)
+
+
+def start():
+    """start the embedded buddy from config, returns it"""
+    global bot
+    channels = [f"#{c.lstrip('#')}" for c in config.BUDDY_CHANNELS] or list(
+        state.irc_channels
+    )
+    bot = HostingBuddy(
+        config.BUDDY_NICK,
+        public_ip=config.BUDDY_PUBLIC_IP,
+        game_port=config.BUDDY_GAME_PORT,
+        scheme=config.BUDDY_SCHEME,
+    )
+    bot.start(channels)
+    return bot
+
+
+def relay_closed(session):
+    """relay callback: the agent left or went idle, so the game is dead"""
+    if session.game_id is not None:
+        games.close(session.game_id)
+
+
+def stop():
+    global bot
+    if bot:
+        bot.leave()
+        bot = None
@@ -11,6 +11,7 @@ DEFAULT_IRC_HOST = ""  # empty = auto-detect
 DEFAULT_CONNECT_PORT = None  # port to announce in <CONNECT> (None = use default 6667)
 DEFAULT_PASSWORD = "ELSILRACLIHP"
 DEFAULT_GAME_TIMEOUT = 300  # 5 minutes
+DEFAULT_GAME_MAX = 2000
 DEFAULT_CHANNELS = {
     "AnythingGoes": {"topic": "Anything goes!", "icon": 0, "scheme": "Pf,Be"},
     "PartyTime": {"topic": "Party time!", "icon": 1, "scheme": "Pa,Ba"},
@@ -23,25 +24,147 @@ IRC_HOST = DEFAULT_IRC_HOST
 CONNECT_PORT = DEFAULT_CONNECT_PORT
 PASSWORD = DEFAULT_PASSWORD
 GAME_TIMEOUT = DEFAULT_GAME_TIMEOUT
+GAME_MAX = DEFAULT_GAME_MAX  # listed games; past this the oldest is evicted
+GAME_MAX_PER_IP = 4  # games listed through Game.asp per address (0 = no cap)
+GAME_MAX_PER_NICK = 2
+GAME_CREATE_RATE = 0.2  # Game.asp creates per second per address (0 = no limit)
+GAME_CREATE_BURST = 5
+GAME_FEED_SIZE = 1000  # changes kept for /games/changes; older asks for a resync
+GAME_FEED_TIMEOUT = 30  # longest a /games/changes request waits for one
 CHANNELS = DEFAULT_CHANNELS.copy()
 MOTD_FILE = None
 NEWS_FILE = None
+OPERS = {}  # irc operator name -> password
+RECORD_FILE = None  # traffic log path (None = not recording)
+ADMIN_TOKEN = ""  # empty = /admin/ endpoints disabled
+PROFILE_DIR = "."
+PROFILE_SECONDS = 30
+PROFILE_INTERVAL = 0.005  # seconds between cpu samples
+PROFILE_MEMORY_FRAMES = 10  # traceback depth kept by tracemalloc
+BUDDY_ENABLED = False  # run hostingbuddy inside the server
+BUDDY_NICK = "HostingBuddy"
+BUDDY_CHANNELS = []  # empty = every configured channel
+BUDDY_PUBLIC_IP = ""  # empty = the player's own ip
+BUDDY_GAME_PORT = 17011
+BUDDY_SCHEME = "Intermediate"
+IRC_BACKLOG = 128  # listen() queue; storms wait here while accepts are paced
+IRC_MAX_CLIENTS = 5000  # concurrent connections (0 = unlimited)
+IRC_MAX_PER_IP = 16
+IRC_ACCEPT_RATE = 200  # new connections per second (0 = unlimited)
+IRC_ACCEPT_BURST = 1000
+IRC_ACCEPT_BATCH = 64  # accepts per wakeup
+IRC_WORKERS = 32  # threads serving all clients (0 = a thread per client)
+IRC_TRUSTED_PROXIES = []  # cidrs of balancers that send a PROXY header
+IRC_PROXY_TIMEOUT = 5  # seconds a trusted balancer has to send it
+IRC_RAW = True  # pass text bytes through unchanged (False = decode as utf-8)
+IRC_CODEPAGE = "cp1252"  # what the game displays; our own text is sent in it
+HTTP_BACKLOG = 128
+HTTP_MAX_CLIENTS = 256  # requests in flight
+HTTP_MAX_PER_IP = 32
+HTTP_ACCEPT_RATE = 0
+HTTP_ACCEPT_BURST = 1000
+HTTP_TRUSTED_PROXIES = []  # cidrs whose X-Forwarded-For is believed
+ADMISSION_EXEMPT = ["127.0.0.1", "::1"]  # not subject to per-ip caps
+RELAY_ENABLED = False  # relay buddy-hosted games through this server
+RELAY_HOST = ""  # address advertised for relayed games (empty = buddy/irc ip)
+RELAY_CONTROL_PORT = 17000
+RELAY_PORT_MIN = 17100  # public ports handed out, one per hosted game
+RELAY_PORT_MAX = 17999
+RELAY_IDLE_TIMEOUT = 300
+RELAY_CLAIM_TIMEOUT = 60  # seconds the host's agent has to connect
+IPFILTER_DEFAULT = "allow"  # action for addresses no rule matches
+IPFILTER_ALLOW = []  # cidrs; the most specific matching rule wins
+IPFILTER_DENY = []
+IPFILTER_ALLOW_FILE = None  # extra cidrs, one per line
+IPFILTER_DENY_FILE = None
+OVERLOAD_ENABLED = True  # shed load when the server is saturated
+OVERLOAD_INTERVAL = 0.5  # seconds between samples
+OVERLOAD_MAX_LAG = 0.1  # monitor wakeup lateness, seconds
+OVERLOAD_MAX_THREADS = 0  # live threads (0 = ignore)
+OVERLOAD_MAX_SEND_QUEUE = 32 * 1024 * 1024  # unacked bytes, all clients
+OVERLOAD_MAX_HTTP_LATENCY = 0.5  # p95 seconds
+OVERLOAD_THRESHOLDS = [1.0, 1.5, 2.0]  # pressure for reject, throttle, stale
+OVERLOAD_COOLDOWN = 10  # calm seconds before stepping down a level
+OVERLOAD_QUERY_INTERVAL = 10  # WHO/LIST per client while throttling
+OVERLOAD_STALE_MAX = 30  # oldest cached GameList served while stale
+FEDERATION_ENABLED = False  # link with other wormnet nodes into one network
+FEDERATION_NAME = ""  # unique per node (empty = irc ip, else the hostname)
+FEDERATION_NODE_ID = 1  # unique per node, 1-63; tags the ids of its games
+FEDERATION_IP = "0.0.0.0"
+FEDERATION_PORT = 6900
+FEDERATION_PASSWORD = ""  # shared by all nodes; required
+FEDERATION_PEERS = []  # "host:port" of nodes this one dials
+FEDERATION_RECONNECT = 5  # seconds between dial attempts
+FEDERATION_PING_INTERVAL = 15  # a link silent for 3 intervals is dropped
+POOL_NODES = []  # [irc.pool] nodes Login.asp spreads players across
+POOL_STATUS_IP = "127.0.0.1"  # where the http node takes udp load reports
+POOL_STATUS_PORT = 6668
+POOL_REPORT_TO = ""  # "host:port" this irc node reports to (empty = don't)
+POOL_NAME = ""  # this irc node's name in the pool (empty = irc ip / hostname)
+POOL_INTERVAL = 1.0  # seconds between reports
+POOL_STICKY = 600  # seconds an ip keeps getting the same node
+PLAYERS_ENABLED = True  # keep UpdatePlayerInfo.asp reports
+PLAYERS_DB = ""  # sqlite file they're written behind to (empty = memory only)
+PLAYERS_MAX = 10000  # players kept in memory, least recently seen evicted
+PLAYERS_FLUSH_INTERVAL = 2.0  # seconds between database writes
+STATUS_ENABLED = True  # serve /status and /status.json
+STATUS_MAX_AGE = 1.0  # seconds a rendered status page is reused
+CONFIG_FILE = None  # path loaded at startup, re-read on ip filter reload
 
 
 def build_irc_channels():
     """build irc channels from config"""
     state.irc_channels = {
-        f"#{name}": {"users": set(), "topic": f"{ch['icon']:02d} {ch['topic']}"}
+        f"#{name}": state.new_channel(f"{ch['icon']:02d} {ch['topic']}")
         for name, ch in CHANNELS.items()
     }
 
 
+def load_ipfilter(section):
+    """apply an [ipfilter] table (also used on reload)"""
+    global IPFILTER_DEFAULT, IPFILTER_ALLOW, IPFILTER_DENY
+    global IPFILTER_ALLOW_FILE, IPFILTER_DENY_FILE
+    default = section.get("default", "allow")
+    if default not in ("allow", "deny"):
+        raise ValueError(f"ipfilter default must be allow or deny, not {default!r}")
+    IPFILTER_DEFAULT = default
+    IPFILTER_ALLOW = section.get("allow", [])
+    IPFILTER_DENY = section.get("deny", [])
+    IPFILTER_ALLOW_FILE = section.get("allow_file")
+    IPFILTER_DENY_FILE = section.get("deny_file")
+
+
 def load_config(config_file):
     """load configuration from TOML file"""
     global HTTP_PORT, IRC_PORT, IRC_HOST, CONNECT_PORT, MOTD_FILE, NEWS_FILE, CHANNELS
+    global RECORD_FILE, OPERS, ADMIN_TOKEN, PROFILE_DIR, PROFILE_SECONDS
+    global BUDDY_ENABLED, BUDDY_NICK, BUDDY_CHANNELS, BUDDY_PUBLIC_IP
+    global BUDDY_GAME_PORT, BUDDY_SCHEME
+    global RELAY_ENABLED, RELAY_HOST, RELAY_CONTROL_PORT, RELAY_PORT_MIN
+    global RELAY_PORT_MAX, RELAY_IDLE_TIMEOUT, RELAY_CLAIM_TIMEOUT
+    global IRC_BACKLOG, IRC_MAX_CLIENTS, IRC_MAX_PER_IP, IRC_ACCEPT_RATE
+    global IRC_ACCEPT_BURST, IRC_ACCEPT_BATCH, IRC_WORKERS, HTTP_BACKLOG
+    global HTTP_MAX_CLIENTS, IRC_TRUSTED_PROXIES, IRC_PROXY_TIMEOUT, IRC_RAW
+    global IRC_CODEPAGE
+    global HTTP_TRUSTED_PROXIES
+    global HTTP_MAX_PER_IP, HTTP_ACCEPT_RATE, HTTP_ACCEPT_BURST, ADMISSION_EXEMPT
+    global CONFIG_FILE, OVERLOAD_ENABLED, OVERLOAD_INTERVAL, OVERLOAD_MAX_LAG
+    global OVERLOAD_MAX_THREADS, OVERLOAD_MAX_SEND_QUEUE, OVERLOAD_MAX_HTTP_LATENCY
+    global OVERLOAD_THRESHOLDS, OVERLOAD_COOLDOWN, OVERLOAD_QUERY_INTERVAL
+    global OVERLOAD_STALE_MAX
+    global FEDERATION_ENABLED, FEDERATION_NAME, FEDERATION_NODE_ID, FEDERATION_IP
+    global FEDERATION_PORT, FEDERATION_PASSWORD, FEDERATION_PEERS
+    global FEDERATION_RECONNECT, FEDERATION_PING_INTERVAL
+    global POOL_NODES, POOL_STATUS_IP, POOL_STATUS_PORT, POOL_REPORT_TO, POOL_NAME
+    global POOL_INTERVAL, POOL_STICKY
+    global GAME_TIMEOUT, GAME_MAX, GAME_MAX_PER_IP, GAME_MAX_PER_NICK
+    global GAME_CREATE_RATE, GAME_CREATE_BURST, GAME_FEED_SIZE, GAME_FEED_TIMEOUT
+    global PLAYERS_ENABLED, PLAYERS_DB, PLAYERS_MAX, PLAYERS_FLUSH_INTERVAL
+    global STATUS_ENABLED, STATUS_MAX_AGE
 
     with open(config_file, "rb") as f:
         config = tomli.load(f)
+    CONFIG_FILE = config_file
 
     # configure logging
     log_level = config.get("logging", {}).get("level", "INFO")
@@ -55,11 +178,131 @@ def load_config(config_file):
     IRC_PORT = config.get("irc", {}).get("port", IRC_PORT)
     IRC_HOST = config.get("irc", {}).get("ip", IRC_HOST)
     MOTD_FILE = config.get("irc", {}).get("motd_file")
+    OPERS = config.get("irc", {}).get("opers", {})
+    IRC_BACKLOG = config.get("irc", {}).get("backlog", IRC_BACKLOG)
+    IRC_MAX_CLIENTS = config.get("irc", {}).get("max_clients", IRC_MAX_CLIENTS)
+    IRC_MAX_PER_IP = config.get("irc", {}).get("max_per_ip", IRC_MAX_PER_IP)
+    IRC_ACCEPT_RATE = config.get("irc", {}).get("accept_rate", IRC_ACCEPT_RATE)
+    IRC_ACCEPT_BURST = config.get("irc", {}).get("accept_burst", IRC_ACCEPT_BURST)
+    IRC_ACCEPT_BATCH = config.get("irc", {}).get("accept_batch", IRC_ACCEPT_BATCH)
+    IRC_WORKERS = config.get("irc", {}).get("workers", IRC_WORKERS)
+    IRC_TRUSTED_PROXIES = config.get("irc", {}).get(
+        "trusted_proxies", IRC_TRUSTED_PROXIES
+    )
+    IRC_PROXY_TIMEOUT = config.get("irc", {}).get("proxy_timeout", IRC_PROXY_TIMEOUT)
+    IRC_RAW = config.get("irc", {}).get("raw", IRC_RAW)
+    IRC_CODEPAGE = config.get("irc", {}).get("codepage", IRC_CODEPAGE)
+
+    # load irc node pool config
+    pool = config.get("irc", {}).get("pool", {})
+    POOL_NODES = pool.get("nodes", POOL_NODES)
+    POOL_STATUS_IP = pool.get("status_ip", POOL_STATUS_IP)
+    POOL_STATUS_PORT = pool.get("status_port", POOL_STATUS_PORT)
+    POOL_REPORT_TO = pool.get("report_to", POOL_REPORT_TO)
+    POOL_NAME = pool.get("name", POOL_NAME)
+    POOL_INTERVAL = pool.get("interval", POOL_INTERVAL)
+    POOL_STICKY = pool.get("sticky", POOL_STICKY)
+    for node in POOL_NODES:
+        if "name" not in node or "host" not in node:
+            raise ValueError(f"irc.pool nodes need a name and host: {node}")
 
     # load http config
     HTTP_PORT = config.get("http", {}).get("port", HTTP_PORT)
     CONNECT_PORT = config.get("http", {}).get("connect_port")
     NEWS_FILE = config.get("http", {}).get("news_file")
+    HTTP_BACKLOG = config.get("http", {}).get("backlog", HTTP_BACKLOG)
+    HTTP_MAX_CLIENTS = config.get("http", {}).get("max_clients", HTTP_MAX_CLIENTS)
+    HTTP_MAX_PER_IP = config.get("http", {}).get("max_per_ip", HTTP_MAX_PER_IP)
+    HTTP_ACCEPT_RATE = config.get("http", {}).get("accept_rate", HTTP_ACCEPT_RATE)
+    HTTP_ACCEPT_BURST = config.get("http", {}).get("accept_burst", HTTP_ACCEPT_BURST)
+    HTTP_TRUSTED_PROXIES = config.get("http", {}).get(
+        "trusted_proxies", HTTP_TRUSTED_PROXIES
+    )
+    ADMISSION_EXEMPT = config.get("admission", {}).get("exempt", ADMISSION_EXEMPT)
+
+    # load game table limits
+    table = config.get("games", {})
+    GAME_TIMEOUT = table.get("timeout", GAME_TIMEOUT)
+    GAME_MAX = table.get("max", GAME_MAX)
+    GAME_MAX_PER_IP = table.get("max_per_ip", GAME_MAX_PER_IP)
+    GAME_MAX_PER_NICK = table.get("max_per_nick", GAME_MAX_PER_NICK)
+    GAME_CREATE_RATE = table.get("create_rate", GAME_CREATE_RATE)
+    GAME_CREATE_BURST = table.get("create_burst", GAME_CREATE_BURST)
+    GAME_FEED_SIZE = table.get("feed_size", GAME_FEED_SIZE)
+    GAME_FEED_TIMEOUT = table.get("feed_timeout", GAME_FEED_TIMEOUT)
+
+    # load player info store config
+    players = config.get("players", {})
+    PLAYERS_ENABLED = players.get("enabled", PLAYERS_ENABLED)
+    PLAYERS_DB = players.get("db", PLAYERS_DB)
+    PLAYERS_MAX = players.get("max", PLAYERS_MAX)
+    PLAYERS_FLUSH_INTERVAL = players.get("flush_interval", PLAYERS_FLUSH_INTERVAL)
+
+    # load status page config
+    status = config.get("status", {})
+    STATUS_ENABLED = status.get("enabled", STATUS_ENABLED)
+    STATUS_MAX_AGE = status.get("max_age", STATUS_MAX_AGE)
+
+    # load traffic recorder config
+    RECORD_FILE = config.get("record", {}).get("file", RECORD_FILE)
+
+    # load admin and profiling config
+    ADMIN_TOKEN = config.get("admin", {}).get("token", ADMIN_TOKEN)
+    PROFILE_DIR = config.get("profiling", {}).get("dir", PROFILE_DIR)
+    PROFILE_SECONDS = config.get("profiling", {}).get("seconds", PROFILE_SECONDS)
+
+    # load embedded hostingbuddy config
+    buddy = config.get("hostingbuddy", {})
+    BUDDY_ENABLED = buddy.get("enabled", BUDDY_ENABLED)
+    BUDDY_NICK = buddy.get("nick", BUDDY_NICK)
+    BUDDY_CHANNELS = buddy.get("channels", BUDDY_CHANNELS)
+    BUDDY_PUBLIC_IP = buddy.get("public_ip", BUDDY_PUBLIC_IP)
+    BUDDY_GAME_PORT = buddy.get("game_port", BUDDY_GAME_PORT)
+    BUDDY_SCHEME = buddy.get("scheme", BUDDY_SCHEME)
+
+    # load nat relay config
+    relay = config.get("relay", {})
+    RELAY_ENABLED = relay.get("enabled", RELAY_ENABLED)
+    RELAY_HOST = relay.get("host", RELAY_HOST)
+    RELAY_CONTROL_PORT = relay.get("control_port", RELAY_CONTROL_PORT)
+    RELAY_PORT_MIN = relay.get("port_min", RELAY_PORT_MIN)
+    RELAY_PORT_MAX = relay.get("port_max", RELAY_PORT_MAX)
+    RELAY_IDLE_TIMEOUT = relay.get("idle_timeout", RELAY_IDLE_TIMEOUT)
+    RELAY_CLAIM_TIMEOUT = relay.get("claim_timeout", RELAY_CLAIM_TIMEOUT)
+
+    # load overload shedding config
+    overload = config.get("overload", {})
+    OVERLOAD_ENABLED = overload.get("enabled", OVERLOAD_ENABLED)
+    OVERLOAD_INTERVAL = overload.get("interval", OVERLOAD_INTERVAL)
+    OVERLOAD_MAX_LAG = overload.get("max_lag", OVERLOAD_MAX_LAG)
+    OVERLOAD_MAX_THREADS = overload.get("max_threads", OVERLOAD_MAX_THREADS)
+    OVERLOAD_MAX_SEND_QUEUE = overload.get("max_send_queue", OVERLOAD_MAX_SEND_QUEUE)
+    OVERLOAD_MAX_HTTP_LATENCY = overload.get(
+        "max_http_latency", OVERLOAD_MAX_HTTP_LATENCY
+    )
+    OVERLOAD_THRESHOLDS = overload.get("thresholds", OVERLOAD_THRESHOLDS)
+    OVERLOAD_COOLDOWN = overload.get("cooldown", OVERLOAD_COOLDOWN)
+    OVERLOAD_QUERY_INTERVAL = overload.get("query_interval", OVERLOAD_QUERY_INTERVAL)
+    OVERLOAD_STALE_MAX = overload.get("stale_max", OVERLOAD_STALE_MAX)
+
+    # load federation config
+    federation = config.get("federation", {})
+    FEDERATION_ENABLED = federation.get("enabled", FEDERATION_ENABLED)
+    FEDERATION_NAME = federation.get("name", FEDERATION_NAME)
+    FEDERATION_NODE_ID = federation.get("node_id", FEDERATION_NODE_ID)
+    FEDERATION_IP = federation.get("ip", FEDERATION_IP)
+    FEDERATION_PORT = federation.get("port", FEDERATION_PORT)
+    FEDERATION_PASSWORD = federation.get("password", FEDERATION_PASSWORD)
+    FEDERATION_PEERS = federation.get("peers", FEDERATION_PEERS)
+    FEDERATION_RECONNECT = federation.get("reconnect", FEDERATION_RECONNECT)
+    FEDERATION_PING_INTERVAL = federation.get("ping_interval", FEDERATION_PING_INTERVAL)
+    if FEDERATION_ENABLED and not 1 <= FEDERATION_NODE_ID <= 63:
+        raise ValueError(f"federation node_id must be 1-63, not {FEDERATION_NODE_ID}")
+    if FEDERATION_ENABLED and not FEDERATION_PASSWORD:
+        raise ValueError("federation needs a password")
+
+    # load ip filter config
+    load_ipfilter(config.get("ipfilter", {}))
 
     # load channels
     if "channels" in config:
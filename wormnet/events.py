@@ -0,0 +1,143 @@
+"""in-process bus for changes to the shared state
+
+the places that change who is online, who is in which channel and which
+games are listed publish an event here after the change; caches, indexes,
+metrics and journals subscribe instead of hooking into each of them.
+
+subscribers get lists of events, in the order they were published. there's
+no dispatcher thread: the publisher delivers, and while one thread is
+delivering, events published by others queue up and reach the subscribers
+as one batch from that thread. so publish() may return before its event is
+delivered, and subscribers run on irc and http threads and must be quick
+and must not block.
+
+changes made under a lock post() their events there, so the order on the
+bus is the order the changes were made in, and drain() after letting go.
+with no subscribers posting does nothing.
+
+a user's channels end with ChannelParted or with the UserQuit that lists
+them. remote users (federation.RemoteClient) publish the same events.
+"""
+
+import collections
+import logging
+import threading
+from typing import NamedTuple
+
+MAX_BATCH = 256
+
+
+class UserRegistered(NamedTuple):
+    client: object
+
+
+class UserQuit(NamedTuple):
+    client: object
+    channels: tuple  # channels it was still in
+    reason: str
+
+
+class NickChanged(NamedTuple):
+    client: object  # client.nickname is the new nick
+    old: str
+
+
+class ChannelJoined(NamedTuple):
+    client: object
+    channel: str
+
+
+class ChannelParted(NamedTuple):
+    client: object
+    channel: str
+
+
+class GameCreated(NamedTuple):
+    game: dict  # as games.changes shows it
+
+
+class GameUpdated(NamedTuple):
+    game: dict  # changed on the node that listed it
+
+
+class GameClosed(NamedTuple):
+    game: dict
+
+
+class GameExpired(NamedTuple):
+    game: dict
+
+
+class Bus:
+    """ordered, batching event dispatch to subscribers"""
+
+    def __init__(self):
+        self.subscribers = ()  # (fn, types or None), replaced on subscribe
+        self.queue = collections.deque()
+        self.dispatching = threading.Lock()
+        self.delivered = collections.Counter()  # event type -> count
+        self.batches = 0
+        self.errors = 0
+
+    def subscribe(self, fn, *types):
+        """call fn(events) with every later event, or only those of types"""
+        self.subscribers += ((fn, frozenset(types) or None),)
+
+    def unsubscribe(self, fn):
+        self.subscribers = tuple(s for s in self.subscribers if s[0] != fn)
+
+    def post(self, event):
+        """queue an event without delivering it (safe under any lock)"""
+        if self.subscribers:
+            self.queue.append(event)
+
+    def publish(self, event):
+        """queue an event and deliver everything queued"""
+        if self.subscribers:
+            self.queue.append(event)
+            self.drain()
+
+    def drain(self):
+        """deliver queued events unless another thread already is"""
+        # whoever lets go of dispatching looks at the queue again, so an
+        # event queued while it was delivering is never left behind
+        while self.queue and self.dispatching.acquire(blocking=False):
+            try:
+                while self.queue:
+                    batch = []
+                    while self.queue and len(batch) < MAX_BATCH:
+                        batch.append(self.queue.popleft())
+                    self._deliver(batch)
+            finally:
+                self.dispatching.release()
+
+    def _deliver(self, batch):
+        self.batches += 1
+        for event in batch:
+            self.delivered[type(event).__name__] += 1
+        for fn, types in self.subscribers:
+            events = batch if types is None else [e for e in batch if type(e) in types]
+            if not events:
+                continue
+            try:
+                fn(events)
+            except Exception:
+                self.errors += 1
+                logging.exception(f"Events: subscriber {fn.__qualname__} failed")
+
+    def stats(self):
+        return {
+            "subscribers": [fn.__qualname__ for fn, _ in self.subscribers],
+            "queued": len(self.queue),
+            "batches": self.batches,
+            "errors": self.errors,
+            "delivered": dict(self.delivered),
+        }
+
+
+bus = Bus()
+subscribe = bus.subscribe
+unsubscribe = bus.unsubscribe
+post = bus.post
+publish = bus.publish
+drain = bus.drain
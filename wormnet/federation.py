@@ -0,0 +1,627 @@
+"""server links: several wormnet nodes acting as one network
+
+nodes link in a full mesh: every node dials the ones in its [federation]
+peers and accepts the rest on the federation port. each line on a link
+describes one change made on the sending node. nothing is passed on a second
+hop, so there are no loops to break.
+
+    SERVER <name> <node id> <password>                   handshake, both ways
+    UID <nick> <ts> <user> <ip> <#chans|*> :<realname>   a user on the sender
+    NICK <old> <new> <ts>
+    JOIN <nick> <#chan>
+    PART <nick> <#chan>
+    QUIT <nick> :<reason>
+    PRIVMSG <nick> <#chan> :<text>   sent only to nodes with members there
+    ROUTE <nick> <line>              deliver a line to a user on the receiver
+    GAME <age> <json>                a game was listed or refreshed
+    UNGAME <id>
+    EOB                              end of the burst sent after the handshake
+    PING <token> / PONG <token>
+
+remote users are registered in state.irc_clients as RemoteClient, the way
+the embedded hostingbuddy is, so nick lookups, WHO and NAMES see them. they
+stay out of the channel member snapshots, which hold local clients only: a
+channel message is delivered here, then sent once to each node that has
+members in the channel.
+
+a nick collision (a netjoin, or two nodes registering a nick at once)
+resolves the same way on every node: the older nick timestamp wins, the
+lower server name breaks a tie, and the losing user's own node kills it.
+when a link drops, the users behind it quit with "<here> <there>" and that
+node's games are unlisted; the burst after the rejoin brings them back.
+"""
+
+import collections
+import hmac
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+
+from . import config, events, games, state, wire
+
+HANDSHAKE_TIMEOUT = 10
+
+# established links
+links = state.SnapshotSet()
+_lock = threading.Lock()  # link registration and teardown
+_stop = threading.Event()
+_listener = None
+
+
+class RemoteClient:
+    """a user registered on another node"""
+
+    __slots__ = (
+        "link",
+        "nickname",
+        "nick_ts",
+        "username",
+        "realname",
+        "addr",
+        "channels",
+    )
+
+    registered = True
+    oper = False
+
+    def __init__(self, link, nick, ts, username, ip, realname):
+        self.link = link
+        self.nickname = sys.intern(nick)
+        self.nick_ts = ts
+        self.username = sys.intern(username)
+        self.realname = sys.intern(realname)
+        self.addr = (ip, 0)
+        # no owner, so joins don't reach the local member snapshots
+        self.channels = state.ChannelSet()
+
+    def send(self, msg):
+        """lines addressed to this user go to its node"""
+        self.link.send(f"ROUTE {self.nickname} {msg}")
+
+    def __repr__(self):
+        return f"RemoteClient({self.nickname!r} on {self.link.name})"
+
+
+class Link:
+    """an established connection to another node"""
+
+    def __init__(self, sock, name, node_id, outbound):
+        self.sock = sock
+        self.name = name
+        self.node_id = node_id
+        self.outbound = outbound
+        self.clients = {}  # nick -> RemoteClient behind this link
+        self.channels = collections.Counter()  # channel -> members behind it
+        self.send_lock = threading.Lock()
+        self.synced = threading.Event()
+        self.closed = False
+        self.since = self.last_seen = time.monotonic()
+        self.rtt = None
+        self.lines_in = 0
+        self.lines_out = 0
+
+    @property
+    def dialer(self):
+        """name of the node that opened this connection"""
+        return config.FEDERATION_NAME if self.outbound else self.name
+
+    def send(self, line):
+        data = f"{line}\n".encode("utf-8")
+        try:
+            with self.send_lock:
+                self.sock.sendall(data)
+            self.lines_out += 1
+        except OSError:
+            self.close()
+
+    def close(self):
+        """drop the connection; its reader then splits it off"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "node_id": self.node_id,
+            "outbound": self.outbound,
+            "synced": self.synced.is_set(),
+            "users": len(self.clients),
+            "channels": {k: v for k, v in self.channels.items() if v},
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "age": round(time.monotonic() - self.since, 3),
+            "rtt_ms": None if self.rtt is None else round(self.rtt * 1000, 3),
+        }
+
+
+def is_remote(nick):
+    """True if a user on another node holds this nick"""
+    return isinstance(state.irc_clients.find(nick), RemoteClient)
+
+
+def _announced(client):
+    # hostingbuddy sets federated = False: it serves its own node only
+    return not isinstance(client, RemoteClient) and getattr(client, "federated", True)
+
+
+def _send_all(line):
+    for link in links.items:
+        link.send(line)
+
+
+def _uid(client):
+    chans = ",".join(client.channels) or "*"
+    return (
+        f"UID {client.nickname} {client.nick_ts!r} {client.username}"
+        f" {client.addr[0]} {chans} :{client.realname or ''}"
+    )
+
+
+def _game(game):
+    data = {k: v for k, v in game.items() if k != "created"}
+    age = max(0.0, time.time() - game["created"])
+    return f"GAME {age:.3f} {json.dumps(data, separators=(',', ':'))}"
+
+
+# local changes, called by the irc server (cheap no-ops without links)
+
+
+def introduce(client):
+    if links.items:
+        _send_all(_uid(client))
+
+
+def nick(client, old):
+    if links.items:
+        _send_all(f"NICK {old} {client.nickname} {client.nick_ts!r}")
+
+
+def join(client, channame):
+    if links.items:
+        _send_all(f"JOIN {client.nickname} {channame}")
+
+
+def part(client, channame):
+    if links.items:
+        _send_all(f"PART {client.nickname} {channame}")
+
+
+def quit(client, reason):
+    if links.items:
+        _send_all(f"QUIT {client.nickname} :{reason}")
+
+
+def privmsg(client, channame, text):
+    """pass a channel message to the nodes with members in the channel"""
+    line = None
+    for link in links.items:
+        if link.channels.get(channame):
+            line = line or f"PRIVMSG {client.nickname} {channame} :{text}"
+            link.send(line)
+
+
+def _game_changed(kind, game):
+    if links.items:
+        _send_all(f"UNGAME {game['id']}" if kind == "close" else _game(game))
+
+
+games.hooks.append(_game_changed)
+
+
+# applying changes from other nodes
+
+
+def _deliver(channame, msg):
+    """send a line to the local members of a channel"""
+    data = wire.line(msg)
+    for client in state.members(channame):
+        client.send(msg, data)
+
+
+def _claim(nick, ts, server):
+    """settle who holds a nick; True if (ts, server) takes it
+
+    every node compares the same two claims, so they all agree. a losing
+    holder is removed here; a losing claim is ignored, and its own node
+    kills that user when it sees the winner.
+    """
+    holder = state.irc_clients.find(nick)
+    if holder is None:
+        return True
+    if isinstance(holder, RemoteClient):
+        held = (holder.nick_ts, holder.link.name)
+    elif _announced(holder):
+        held = (holder.nick_ts, config.FEDERATION_NAME)
+    else:
+        return False  # a node-local service keeps its nick
+    if held <= (ts, server):
+        return False
+    logging.info(f"Federation: nick collision on {nick}, {server}'s user wins")
+    if isinstance(holder, RemoteClient):
+        _drop(holder, "Nick collision")
+    else:
+        holder.unregister("Nick collision")
+        holder.kill("Nick collision")
+    return True
+
+
+def _join(client, channame, announce=True):
+    chan = state.irc_channels.get(channame)
+    if chan is None or channame in client.channels:
+        return
+    channame = sys.intern(channame)
+    client.channels.add(channame)
+    chan["users"].add(client.nickname)
+    chan["remote"].add(client)
+    client.link.channels[channame] += 1
+    events.publish(events.ChannelJoined(client, channame))
+    if announce:
+        mask = f"{client.nickname}!~{client.username}@{client.addr[0]}"
+        _deliver(channame, f":{mask} JOIN :{channame}")
+
+
+def _part(client, channame, msg=None):
+    if msg:
+        _deliver(channame, msg)
+    client.channels.discard(channame)
+    state.drop_user(channame, client.nickname)
+    chan = state.irc_channels.get(channame)
+    if chan is not None:
+        chan["remote"].discard(client)
+    client.link.channels[channame] -= 1
+    events.publish(events.ChannelParted(client, channame))
+
+
+def _drop(client, reason):
+    """remove a remote user, telling local channel members it quit"""
+    link = client.link
+    if link.clients.get(client.nickname) is client:
+        del link.clients[client.nickname]
+    state.irc_clients.discard(client)
+    games.host_left(client)
+    msg = f":{client.nickname} QUIT :{reason}"
+    for channame in tuple(client.channels):
+        _part(client, channame, msg)
+    events.publish(events.UserQuit(client, (), reason))
+
+
+def _on_uid(link, rest):
+    head, _, realname = rest.partition(" :")
+    nick, ts, username, ip, chans = head.split(" ")
+    ts = float(ts)
+    old = link.clients.get(nick)
+    if old is not None:
+        # sent again (the burst raced a live change): replace it quietly
+        del link.clients[nick]
+        state.irc_clients.discard(old)
+        for channame in tuple(old.channels):
+            _part(old, channame)
+        events.publish(events.UserQuit(old, (), "Replaced"))
+    elif not _claim(nick, ts, link.name):
+        return
+    client = RemoteClient(link, nick, ts, username, ip, realname)
+    link.clients[client.nickname] = client
+    state.irc_clients.add(client)
+    events.publish(events.UserRegistered(client))
+    if chans != "*":
+        for channame in chans.split(","):
+            _join(client, channame, announce=old is None)
+
+
+def _on_nick(link, rest):
+    old, new, ts = rest.split(" ")
+    client = link.clients.get(old)
+    if client is None:
+        return
+    if not _claim(new, float(ts), link.name):
+        _drop(client, "Nick collision")
+        return
+    del link.clients[old]
+    client.nickname, client.nick_ts = sys.intern(new), float(ts)
+    link.clients[client.nickname] = client
+    state.irc_clients.rename(client, old, client.nickname)
+    for channame in client.channels:
+        state.drop_user(channame, old)
+        state.irc_channels[channame]["users"].add(client.nickname)
+    events.publish(events.NickChanged(client, old))
+
+
+def _on_join(link, rest):
+    nick, channame = rest.split(" ")
+    client = link.clients.get(nick)
+    if client is not None:
+        _join(client, channame)
+
+
+def _on_part(link, rest):
+    nick, channame = rest.split(" ")
+    client = link.clients.get(nick)
+    if client is not None and channame in client.channels:
+        _part(client, channame, f":{nick} PART {channame}")
+
+
+def _on_quit(link, rest):
+    nick, _, reason = rest.partition(" :")
+    client = link.clients.get(nick)
+    if client is not None:
+        _drop(client, reason)
+
+
+def _on_privmsg(link, rest):
+    head, _, text = rest.partition(" :")
+    nick, channame = head.split(" ")
+    client = link.clients.get(nick)
+    if client is not None and channame in client.channels:
+        _deliver(channame, f":{nick} PRIVMSG {channame} :{text}")
+
+
+def _on_route(link, rest):
+    nick, _, msg = rest.partition(" ")
+    client = state.irc_clients.find(nick)
+    if client is not None and not isinstance(client, RemoteClient):
+        client.send(msg)
+
+
+def _on_game(link, rest):
+    age, _, data = rest.partition(" ")
+    game = json.loads(data)
+    game["created"] = time.time() - float(age)
+    games.merge(game)
+
+
+def _on_ungame(link, rest):
+    games.close(int(rest), notify=False)
+
+
+def _on_eob(link, rest):
+    link.synced.set()
+    logging.info(
+        f"Federation: synced with {link.name}"
+        f" ({len(link.clients)} users, {sum(link.channels.values())} joins)"
+    )
+
+
+def _on_ping(link, rest):
+    link.send(f"PONG {rest}")
+
+
+def _on_pong(link, rest):
+    link.rtt = time.monotonic() - float(rest)
+
+
+def _on_error(link, rest):
+    logging.warning(f"Federation: {link.name} says {rest.lstrip(':')}")
+    link.close()
+
+
+HANDLERS = {
+    "UID": _on_uid,
+    "NICK": _on_nick,
+    "JOIN": _on_join,
+    "PART": _on_part,
+    "QUIT": _on_quit,
+    "PRIVMSG": _on_privmsg,
+    "ROUTE": _on_route,
+    "GAME": _on_game,
+    "UNGAME": _on_ungame,
+    "EOB": _on_eob,
+    "PING": _on_ping,
+    "PONG": _on_pong,
+    "ERROR": _on_error,
+}
+
+
+def handle(link, line):
+    """apply one line from a linked node"""
+    cmd, _, rest = line.partition(" ")
+    handler = HANDLERS.get(cmd)
+    if handler is None:
+        logging.debug(f"Federation: unknown line from {link.name}: {line!r}")
+        return
+    handler(link, rest)
+
+
+# links
+
+
+def _server_line():
+    return f"SERVER {config.FEDERATION_NAME} {config.FEDERATION_NODE_ID} {config.FEDERATION_PASSWORD}"
+
+
+def _check_server(line):
+    """(name, node id) from a peer's SERVER line; ValueError if refused"""
+    parts = line.split()
+    if len(parts) != 4 or parts[0] != "SERVER":
+        raise ValueError(line.strip() or "closed during handshake")
+    _, name, node_id, password = parts
+    if not hmac.compare_digest(password.encode(), config.FEDERATION_PASSWORD.encode()):
+        raise ValueError("Bad password")
+    if name == config.FEDERATION_NAME:
+        raise ValueError(f"Server name {name} is in use")
+    if not node_id.isdigit() or int(node_id) == config.FEDERATION_NODE_ID:
+        raise ValueError(f"Node id {node_id} is in use")
+    return name, int(node_id)
+
+
+def _register(link):
+    """add an established link; False if it duplicates a better one
+
+    when two nodes dial each other at once, both keep the connection opened
+    by the node with the lower name.
+    """
+    with _lock:
+        existing = next(
+            (
+                other
+                for other in links
+                if other.name == link.name or other.node_id == link.node_id
+            ),
+            None,
+        )
+        if existing is not None and (
+            existing.name != link.name or existing.dialer <= link.dialer
+        ):
+            return False
+    if existing is not None:
+        existing.close()
+        _split(existing)
+    with _lock:
+        links.add(link)
+    return True
+
+
+def _burst(link):
+    """tell a new peer about every local user and game"""
+    for client in state.irc_clients.snapshot():
+        if _announced(client) and client.nickname:
+            link.send(_uid(client))
+    table, _ = games.snapshot()
+    for game in table:
+        if games.node_of(game["id"]) == config.FEDERATION_NODE_ID:
+            link.send(_game(game))
+    link.send("EOB")
+
+
+def _split(link):
+    """forget everything behind a link that went away"""
+    with _lock:
+        if link.closed:
+            return
+        link.closed = True
+        links.discard(link)
+    users = len(link.clients)
+    reason = f"{config.FEDERATION_NAME} {link.name}"
+    for client in tuple(link.clients.values()):
+        _drop(client, reason)
+    table, _ = games.snapshot()
+    for game in table:
+        if games.node_of(game["id"]) == link.node_id:
+            games.close(game["id"], notify=False)
+    logging.warning(f"Federation: lost {link.name}, {users} users split off")
+
+
+def serve(sock, outbound):
+    """run a link on the calling thread until it drops
+
+    returns the peer's name, or None if the handshake failed.
+    """
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    reader = sock.makefile("r", encoding="utf-8", errors="replace", newline="\n")
+    try:
+        if outbound:
+            sock.sendall(f"{_server_line()}\n".encode())
+        name, node_id = _check_server(reader.readline())
+        if not outbound:
+            sock.sendall(f"{_server_line()}\n".encode())
+    except (OSError, ValueError) as e:
+        logging.warning(f"Federation: handshake failed: {e}")
+        try:
+            sock.sendall(f"ERROR :{e}\n".encode())
+        except OSError:
+            pass
+        sock.close()
+        return None
+    sock.settimeout(None)
+
+    link = Link(sock, name, node_id, outbound)
+    if not _register(link):
+        logging.info(f"Federation: already linked to {name}")
+        try:
+            sock.sendall(b"ERROR :Already linked\n")
+        except OSError:
+            pass
+        sock.close()
+        return name
+    logging.info(f"Federation: linked to {name} (node {node_id})")
+    try:
+        _burst(link)
+        for line in reader:
+            link.last_seen = time.monotonic()
+            link.lines_in += 1
+            if link.closed:
+                break
+            try:
+                handle(link, line.rstrip("\r\n"))
+            except (ValueError, KeyError) as e:
+                logging.warning(f"Federation: bad line from {name}: {line!r} ({e})")
+    except OSError:
+        pass
+    finally:
+        _split(link)
+        sock.close()
+    return name
+
+
+def _dial(peer):
+    host, _, port = peer.rpartition(":")
+    name = None
+    while not _stop.is_set():
+        # the peer may have dialled us first; leave that link alone
+        if name is None or not any(link.name == name for link in links):
+            try:
+                sock = socket.create_connection((host, int(port)), HANDSHAKE_TIMEOUT)
+            except OSError as e:
+                logging.debug(f"Federation: can't reach {peer}: {e}")
+            else:
+                name = serve(sock, outbound=True) or name
+        _stop.wait(config.FEDERATION_RECONNECT)
+
+
+def _accept(sock):
+    while not _stop.is_set():
+        try:
+            conn, addr = sock.accept()
+        except OSError:
+            return
+        logging.info(f"Federation: link from {addr[0]}:{addr[1]}")
+        threading.Thread(target=serve, args=(conn, False), daemon=True).start()
+
+
+def _keepalive():
+    interval = config.FEDERATION_PING_INTERVAL
+    while not _stop.wait(interval):
+        now = time.monotonic()
+        for link in links.snapshot():
+            if now - link.last_seen > 3 * interval:
+                logging.warning(f"Federation: {link.name} timed out")
+                link.close()
+            else:
+                link.send(f"PING {now!r}")
+
+
+def start():
+    """listen for links and dial configured peers"""
+    global _listener
+    if not config.FEDERATION_NAME:
+        config.FEDERATION_NAME = config.IRC_HOST or socket.gethostname()
+    _stop.clear()
+    _listener = socket.create_server((config.FEDERATION_IP, config.FEDERATION_PORT))
+    threading.Thread(target=_accept, args=(_listener,), daemon=True).start()
+    for peer in config.FEDERATION_PEERS:
+        threading.Thread(target=_dial, args=(peer,), daemon=True).start()
+    threading.Thread(target=_keepalive, daemon=True).start()
+    logging.info(
+        f"Federation: {config.FEDERATION_NAME} (node {config.FEDERATION_NODE_ID})"
+        f" on port {config.FEDERATION_PORT}, peers {config.FEDERATION_PEERS}"
+    )
+
+
+def stop():
+    _stop.set()
+    if _listener is not None:
+        _listener.close()
+    for link in links.snapshot():
+        link.close()
+
+
+def stats():
+    return {
+        "name": config.FEDERATION_NAME,
+        "node_id": config.FEDERATION_NODE_ID,
+        "links": [link.stats() for link in links.snapshot()],
+    }
@@ -0,0 +1,440 @@
+"""game store: the lobby table behind Game.asp and GameList.asp
+
+every game is a dict in state.games keyed by id. http handlers and the
+embedded hostingbuddy both go through these functions so locking and expiry
+live in one place.
+
+`version` goes up on every change to the table; GameList.asp uses it as an
+etag so pollers that saw the current table get a bodyless 304.
+
+writers hold games_lock. readers (GameList polls, expiry checks) use an
+immutable snapshot of the table split by channel, rebuilt on the first read
+after a change and swapped in with one assignment, so they never wait on it.
+
+a game whose host nick is online over irc from the address that created it
+is bound to that irc session: it closes when the session ends (host_left,
+O(the host's games)) and while the host stays online its expiry clock is
+restarted instead of it timing out. unbound games (created for someone else,
+as the external hostingbuddy does, or with irc in another process) just
+time out after GAME_TIMEOUT unless refreshed.
+
+the table is bounded: past GAME_MAX the oldest game is evicted, and the same
+host listing the same address again, from the address that listed it,
+replaces its old game. creates through
+Game.asp (limited=True) are also held to per-address and per-nick quotas of
+listed games and a per-address rate, raising Refused; addresses in
+[admission] exempt skip those (an external hostingbuddy lists for everyone
+from one address).
+
+functions in `hooks` run as hook(kind, game) after a game is added, touched
+or closed here (expiry included); federation uses them to mirror the table
+to linked nodes, and applies their changes with merge() and
+close(notify=False). only the node that listed a game expires or refreshes
+it: the other nodes' copies go when it says so or when its link splits.
+
+every change to the listing (create, update from another node, close,
+expire) is also kept in `changes` as (version, kind, public game), the last
+GAME_FEED_SIZE of them, for the /games/changes feed. changes_since() returns
+what came after a version, waiting on a condition of games_lock until there
+is something; a version older than the log asks the caller to start over
+from listing(). each entry is also posted to the event bus (GameCreated,
+GameUpdated, GameClosed, GameExpired) and delivered once games_lock is let
+go; unlike hooks these include changes made on other nodes.
+"""
+
+import collections
+import threading
+import time
+
+from . import events, state, config
+from .admission import TokenBucket
+
+# starts from the clock so etags handed out before a restart never match
+version = time.time_ns()
+
+# (key, every game, channel -> games); key is (version, table size) so a
+# direct write to state.games (tests, benchmarks) also invalidates it
+_snapshot = (None, (), {})
+
+hooks = []
+
+# (version, kind, game) oldest first; versions below _floor were dropped
+changes = collections.deque()
+_floor = version
+_pending = []  # this change's entries until _changed() stamps them
+_feed = threading.Condition(state.games_lock)
+waiting = 0  # feed requests parked in changes_since
+
+# with federation on, the low bits of a game id are the node that listed it
+NODE_BITS = 6
+
+# ids stay in a signed 32 bit int for the game; they wrap, skipping live ones
+MAX_ID = 2**31 - 1
+
+# Game.asp creates per second per address; idle buckets are pruned past this
+_buckets = {}
+MAX_BUCKETS = 10000
+
+refused = collections.Counter()  # reason -> Game.asp creates turned down
+evicted = 0
+
+
+class Refused(Exception):
+    """a Game.asp create over a quota or the rate limit"""
+
+
+def node_of(gid):
+    """node id a game was listed on (0 without federation)"""
+    return gid & ((1 << NODE_BITS) - 1) if config.FEDERATION_ENABLED else 0
+
+
+def _expires_here(gid):
+    """False for another node's game, which only that node expires"""
+    return not config.FEDERATION_ENABLED or node_of(gid) == config.FEDERATION_NODE_ID
+
+
+def _notify(kind, game):
+    for hook in hooks:
+        hook(kind, game)
+
+
+def _public(game):
+    """a game as the feed shows it: whether it has a password, not which"""
+    return dict(game, password=bool(game["password"]))
+
+
+_EVENTS = {
+    "create": events.GameCreated,
+    "update": events.GameUpdated,
+    "close": events.GameClosed,
+    "expire": events.GameExpired,
+}
+
+
+def _log(kind, game):
+    """queue a feed entry for the change in progress (caller holds games_lock)"""
+    game = _public(game)
+    _pending.append((kind, game))
+    events.post(_EVENTS[kind](game))
+
+
+def _changed():
+    """bump the table version and wake the feed (caller holds games_lock)"""
+    global version, _floor
+    version += 1
+    for kind, game in _pending:
+        changes.append((version, kind, game))
+    _pending.clear()
+    while len(changes) > config.GAME_FEED_SIZE:
+        _floor = changes.popleft()[0]
+    _feed.notify_all()
+
+
+def snapshot():
+    """(every game, channel -> games) as of the last change"""
+    snap = _snapshot
+    if snap[0] != (version, len(state.games)):
+        snap = _rebuild()
+    return snap[1], snap[2]
+
+
+def _rebuild():
+    global _snapshot
+    with state.games_lock:
+        key = (version, len(state.games))
+        table = tuple(state.games.values())
+    by_channel = {}
+    for game in table:
+        by_channel.setdefault(game["channel"], []).append(game)
+    _snapshot = (key, table, {c: tuple(g) for c, g in by_channel.items()})
+    return _snapshot
+
+
+def _host_session(nick, ip):
+    """the online irc client that is nick connected from ip, or None"""
+    client = state.irc_clients.find(nick) if ip else None
+    if client is not None and client.addr[0] == ip:
+        return client
+    return None
+
+
+def _forget(gid, kind="close"):
+    """remove a game and its index entries (caller holds games_lock)"""
+    game = state.games.pop(gid, None)
+    if game is not None:
+        _log(kind, game)
+    state.game_creators.pop(gid, None)
+    client = state.game_sessions.pop(gid, None)
+    if client is not None:
+        gids = state.game_hosts.get(client)
+        if gids is not None:
+            gids.discard(gid)
+            if not gids:
+                del state.game_hosts[client]
+    return game
+
+
+def _next_id():
+    """an unused game id (caller holds games_lock)"""
+    limit = MAX_ID >> NODE_BITS if config.FEDERATION_ENABLED else MAX_ID
+    while True:
+        state.game_counter = state.game_counter % limit + 1
+        gid = state.game_counter
+        if config.FEDERATION_ENABLED:
+            gid = gid << NODE_BITS | config.FEDERATION_NODE_ID
+        if gid not in state.games:
+            return gid
+
+
+def _take_token(ip):
+    bucket = _buckets.get(ip)
+    if bucket is None:
+        if len(_buckets) >= MAX_BUCKETS:
+            now = time.monotonic()
+            for key, b in list(_buckets.items()):
+                if b.tokens + (now - b.stamp) * b.rate >= b.burst:
+                    del _buckets[key]
+        bucket = _buckets[ip] = TokenBucket(
+            config.GAME_CREATE_RATE, config.GAME_CREATE_BURST
+        )
+    return bucket.take()
+
+
+def _check_quota(host, ip, replacing):
+    """raise Refused if ip or host may not list another game
+
+    caller holds games_lock; games in `replacing` are about to go.
+    """
+    if not ip or ip in config.ADMISSION_EXEMPT:
+        return
+    mine = [gid for gid in state.game_creators if gid not in replacing]
+    if config.GAME_MAX_PER_IP and config.GAME_MAX_PER_IP <= sum(
+        1 for gid in mine if state.game_creators[gid] == ip
+    ):
+        reason = "per ip"
+    elif config.GAME_MAX_PER_NICK and config.GAME_MAX_PER_NICK <= sum(
+        1 for gid in mine if state.games.get(gid, {}).get("host") == host
+    ):
+        reason = "per nick"
+    # last, so a create refused for quota doesn't spend a token
+    elif config.GAME_CREATE_RATE > 0 and not _take_token(ip):
+        reason = "rate"
+    else:
+        reason = None
+    if reason:
+        refused[reason] += 1
+        raise Refused(reason)
+
+
+def cleanup():
+    """remove expired games, restarting the clock of those with a host online"""
+    now = time.time()
+    # the common case, nothing expired, never takes the lock
+    table, _ = snapshot()
+    if not any(
+        now - g["created"] > config.GAME_TIMEOUT and _expires_here(g["id"])
+        for g in table
+    ):
+        return
+    refreshed = []
+    gone = []
+    with state.games_lock:
+        expired = [
+            gid
+            for gid, g in state.games.items()
+            if now - g["created"] > config.GAME_TIMEOUT and _expires_here(gid)
+        ]
+        for gid in expired:
+            if state.game_sessions.get(gid) in state.irc_clients:
+                state.games[gid]["created"] = now
+                refreshed.append(dict(state.games[gid]))
+            else:
+                gone.append(_forget(gid, "expire"))
+        if gone:
+            _changed()
+    events.drain()
+    for game in refreshed:
+        _notify("touch", game)
+    for game in gone:
+        _notify("close", game)
+
+
+def create(
+    name,
+    host,
+    address,
+    channel,
+    password=None,
+    location="",
+    type="0",
+    scheme="",
+    host_ip=None,
+    limited=False,
+):
+    """add a game, returns its id
+
+    host_ip is where the request came from; see the module doc for binding
+    and for what limited (Game.asp) checks. raises Refused.
+    """
+    global evicted
+    session = _host_session(host, host_ip)
+    with state.games_lock:
+        replacing = [
+            gid
+            for gid in state.game_creators
+            if state.game_creators[gid] == host_ip
+            and state.games.get(gid, {}).get("host") == host
+            and state.games[gid]["address"] == address
+        ]
+        if limited:
+            _check_quota(host, host_ip, replacing)
+        gone = [_forget(gid) for gid in replacing]
+        while config.GAME_MAX and len(state.games) >= config.GAME_MAX:
+            oldest = next(iter(state.games))
+            if oldest in state.game_creators:
+                gone.append(_forget(oldest))
+            else:
+                _forget(oldest)  # another node's; only dropped from our copy
+            evicted += 1
+        gid = _next_id()
+        game = state.games[gid] = {
+            "id": gid,
+            "name": name[:29],
+            "host": host,
+            "address": address,
+            "password": password,
+            "channel": channel,
+            "location": location,
+            "type": type,
+            "scheme": scheme,
+            "created": time.time(),
+        }
+        state.game_creators[gid] = host_ip
+        _log("create", game)
+        if session is not None:
+            state.game_hosts.setdefault(session, set()).add(gid)
+            state.game_sessions[gid] = session
+        _changed()
+    events.drain()
+    for old in gone:
+        _notify("close", old)
+    _notify("add", dict(game))
+    return gid
+
+
+def merge(game):
+    """add or replace a game listed on another node"""
+    global evicted
+    with state.games_lock:
+        if game["id"] not in state.games and len(state.games) >= config.GAME_MAX > 0:
+            _forget(next(iter(state.games)))
+            evicted += 1
+        old = state.games.get(game["id"])
+        state.games[game["id"]] = game
+        if old is None:
+            _log("create", game)
+        elif any(old.get(k) != v for k, v in game.items() if k != "created"):
+            _log("update", game)  # a refresh from its node only moves created
+        _changed()
+    events.drain()
+
+
+def close(gid, notify=True):
+    """remove a game, returns False if it didn't exist"""
+    with state.games_lock:
+        game = _forget(gid)
+        if game is None:
+            return False
+        _changed()
+    events.drain()
+    if notify:
+        _notify("close", game)
+    return True
+
+
+def host_left(client):
+    """close the games bound to an irc session that ended, returns how many"""
+    if client not in state.game_hosts:
+        return 0
+    with state.games_lock:
+        gids = state.game_hosts.pop(client, ())
+        closed = [game for game in map(_forget, tuple(gids)) if game is not None]
+        if closed:
+            _changed()
+    events.drain()
+    for game in closed:
+        _notify("close", game)
+    return len(closed)
+
+
+def touch(gid):
+    """restart a game's expiry clock, returns False if it's already gone"""
+    with state.games_lock:
+        game = state.games.get(gid)
+        if game is None:
+            return False
+        game["created"] = time.time()
+        game = dict(game)
+    _notify("touch", game)
+    return True
+
+
+def get(gid):
+    """copy of a game, or None if it's gone (closed or expired)"""
+    game = state.games.get(gid)
+    if game is None or time.time() - game["created"] > config.GAME_TIMEOUT:
+        return None
+    return dict(game)
+
+
+def for_channel(chan):
+    """games listed in a channel (name without the #)"""
+    return list(snapshot()[1].get(chan, ()))
+
+
+def listing():
+    """(version, every game as the feed shows it), consistent with each other"""
+    with state.games_lock:
+        return version, [_public(g) for g in state.games.values()]
+
+
+def changes_since(since, timeout):
+    """(version, changes after version since), waiting up to timeout for one
+
+    changes are (version, kind, game) oldest first; an empty list means
+    nothing happened in time. they are None when since is missing, older
+    than the log or from before a restart: start over from listing().
+    the wait also wakes when the next game is due to expire, so expiry
+    shows up without anyone polling GameList.asp.
+    """
+    global waiting
+    deadline = time.monotonic() + timeout
+    while True:
+        cleanup()
+        with _feed:
+            if since is None or not _floor <= since <= version:
+                return version, None
+            new = []
+            for entry in reversed(changes):
+                if entry[0] <= since:
+                    break
+                new.append(entry)
+            remaining = deadline - time.monotonic()
+            if new or remaining <= 0:
+                return version, new[::-1]
+            seen = version
+        table, _ = snapshot()
+        expires = min(
+            (g["created"] for g in table if _expires_here(g["id"])), default=None
+        )
+        if expires is not None:
+            due = expires + config.GAME_TIMEOUT - time.time()
+            remaining = min(remaining, max(due, 0) + 0.01)
+        with _feed:
+            if version != seen:
+                continue
+            waiting += 1
+            try:
+                _feed.wait(remaining)
+            finally:
+                waiting -= 1
@@ -1,33 +1,69 @@
 """http server for wormnet (game lobby management)"""
 
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
+import logging
+import threading
 import time
 from pathlib import Path
-from . import state, config
+from werkzeug.serving import ThreadedWSGIServer
+from . import state, config, record, admin, admission, games, ipfilter, overload, pool
+from . import players, proxy, status
 
 app = Flask(__name__)
+app.register_blueprint(admin.bp)
+# REMOTE_ADDR is the real client behind trusted proxies for everything below
+app.wsgi_app = proxy.ForwardedFor(app.wsgi_app)
 
+# channel -> (body, etag, built at); what GameList.asp serves while shedding
+_gamelist_cache = {}
 
-def cleanup_games():
-    """remove expired games"""
-    now = time.time()
-    with state.games_lock:
-        expired = [
-            gid
-            for gid, g in state.games.items()
-            if now - g["created"] > config.GAME_TIMEOUT
-        ]
-        for gid in expired:
-            del state.games[gid]
+
+@app.before_request
+def filter_request():
+    """403 for wormageddonweb requests from addresses the ip filter denies"""
+    if request.path.startswith("/wormageddonweb/") and not ipfilter.allowed(
+        request.remote_addr
+    ):
+        abort(403)
+
+
+@app.before_request
+def start_timer():
+    request.environ["wormnet.started"] = time.perf_counter()
+
+
+@app.teardown_request
+def record_latency(exc):
+    """feed wormageddonweb request times to the overload monitor"""
+    started = request.environ.get("wormnet.started")
+    if started is not None and request.path.startswith("/wormageddonweb/"):
+        overload.controller.record_latency(time.perf_counter() - started)
+
+
+@app.before_request
+def record_request():
+    """append wormageddonweb requests to the traffic log when recording"""
+    if record.recorder and request.path.startswith("/wormageddonweb/"):
+        record.recorder.http(request.remote_addr, request.full_path.rstrip("?"))
 
 
 @app.route("/wormageddonweb/Login.asp")
 def login():
     """tell client where irc server is"""
-    # use configured IP if set, otherwise fall back to request host
-    irc_host = config.IRC_HOST if config.IRC_HOST else request.host.split(":")[0]
-    port_suffix = f":{config.CONNECT_PORT}" if config.CONNECT_PORT else ""
-    response = f"<CONNECT {irc_host}{port_suffix}>"
+    # a player logging in is a new connection; shed those first
+    if overload.level() >= overload.REJECT:
+        overload.controller.count("login")
+        return "<NOTHING>", 503
+
+    # least loaded pool node if there is a pool, else the configured IP,
+    # else the request host
+    node = pool.pool.pick(request.remote_addr) if pool.pool else None
+    if node:
+        response = f"<CONNECT {node.address}>"
+    else:
+        irc_host = config.IRC_HOST if config.IRC_HOST else request.host.split(":")[0]
+        port_suffix = f":{config.CONNECT_PORT}" if config.CONNECT_PORT else ""
+        response = f"<CONNECT {irc_host}{port_suffix}>"
 
     if config.NEWS_FILE and Path(config.NEWS_FILE).exists():
         try:
@@ -52,37 +88,46 @@ def scheme():
 def game():
     """handle game creation/closing"""
     cmd = request.args.get("Cmd")
-    cleanup_games()
+    games.cleanup()
 
     if cmd == "Create":
-        import logging
-        from flask import Response
-
         logging.debug(f"Game.asp Create params: {dict(request.args)}")
-        with state.games_lock:
-            state.game_counter += 1
-            state.games[state.game_counter] = {
-                "id": state.game_counter,
-                "name": request.args.get("Name", "")[:29],
-                "host": request.args.get("Nick", ""),
-                "address": request.args.get("HostIP", ""),
-                "password": request.args.get("Pwd"),
-                "channel": request.args.get("Chan", ""),
-                "location": request.args.get("Loc", ""),
-                "type": request.args.get("Type", "0"),
-                "scheme": request.args.get("Scheme", ""),
-                "created": time.time(),
-            }
-            resp = Response("<NOTHING>")
-            resp.headers["SetGameId"] = f": {state.game_counter}"
-            return resp
-
-    elif cmd == "Close":
-        gid = int(request.args.get("GameID", 0))
-        with state.games_lock:
-            if gid in state.games:
-                del state.games[gid]
-        return "<NOTHING>"
+        try:
+            gid = games.create(
+                name=request.args.get("Name", ""),
+                host=request.args.get("Nick", ""),
+                address=request.args.get("HostIP", ""),
+                password=request.args.get("Pwd"),
+                channel=request.args.get("Chan", ""),
+                location=request.args.get("Loc", ""),
+                type=request.args.get("Type", "0"),
+                scheme=request.args.get("Scheme", ""),
+                host_ip=request.remote_addr,
+                limited=True,
+            )
+        except games.Refused as e:
+            # no SetGameId header: the game reports it couldn't host
+            logging.info(
+                f"Game.asp: refused create by {request.args.get('Nick')}"
+                f" from {request.remote_addr} ({e})"
+            )
+            return "<NOTHING>", 429
+        resp = Response("<NOTHING>")
+        resp.headers["SetGameId"] = f": {gid}"
+        return resp
+
+    elif cmd in ("Close", "Refresh"):
+        try:
+            gid = int(request.args.get("GameID", 0))
+        except ValueError:
+            return "<NOTHING>", 400
+        if cmd == "Close":
+            games.close(gid)
+            return "<NOTHING>"
+        # not sent by WA; hostingbuddy uses it to keep its lobbies listed
+        if games.touch(gid):
+            return "<NOTHING>"
+        return "<NOTHING>", 404
 
     elif cmd == "Failed":
         return "<NOTHING>"
@@ -93,35 +138,103 @@ def game():
 @app.route("/wormageddonweb/GameList.asp")
 def gamelist():
     """list active games for channel"""
-    import logging
-
-    cleanup_games()
     chan = request.args.get("Channel")
+    if overload.level() >= overload.STALE:
+        cached = _gamelist_cache.get(chan)
+        if cached and time.time() - cached[2] <= config.OVERLOAD_STALE_MAX:
+            overload.controller.count("stale_gamelist")
+            return _gamelist_response(cached[0], cached[1])
+
+    games.cleanup()
+
+    # the table version changes with any game, so it's a valid (if coarse)
+    # etag for every channel's list
+    etag = str(games.version)
+    if request.if_none_match.contains(etag):
+        return _gamelist_response(None, etag)
 
     lines = ["<GAMELISTSTART>\r\n"]
-    with state.games_lock:
-        for g in state.games.values():
-            if g["channel"] == chan:
-                pwd = 1 if g["password"] else 0
-                game_line = (
-                    f"<GAME {g['name']} {g['host']} {g['address']} "
-                    f"{g['location']} 1 {pwd} {g['id']} {g['type']}><BR>\r\n"
-                )
-                lines.append(game_line)
-                logging.debug(f"GameList for {chan}: {game_line.strip()}")
+    for g in games.for_channel(chan):
+        pwd = 1 if g["password"] else 0
+        game_line = (
+            f"<GAME {g['name']} {g['host']} {g['address']} "
+            f"{g['location']} 1 {pwd} {g['id']} {g['type']}><BR>\r\n"
+        )
+        lines.append(game_line)
+        logging.debug(f"GameList for {chan}: {game_line.strip()}")
     lines.append("<GAMELISTEND>\r\n")
 
     result = "".join(lines)
     logging.debug(f"GameList response ({len(state.games)} total games): {result!r}")
-    return result
+    if chan in config.CHANNELS:
+        _gamelist_cache[chan] = (result, etag, time.time())
+    return _gamelist_response(result, etag)
+
+
+def _gamelist_response(body, etag):
+    """GameList body with its etag, or a 304 if the client already has it"""
+    if body is None or request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body)
+    resp.set_etag(etag)
+    return resp
+
+
+@app.route("/games/changes")
+def game_changes():
+    """game table changes after ?since=<version> as json, long-polling
+
+    waits up to ?timeout= seconds (at most GAME_FEED_TIMEOUT) for a change.
+    without since, or when it's too old, answers with the whole table and
+    "reset": true instead. either way "version" is the next since; it's a
+    string because it doesn't fit a javascript number.
+    """
+    if not ipfilter.allowed(request.remote_addr):
+        abort(403)
+    since = request.args.get("since", type=int)
+    timeout = request.args.get("timeout", config.GAME_FEED_TIMEOUT, type=float)
+    version, changes = games.changes_since(
+        since, max(0, min(timeout, config.GAME_FEED_TIMEOUT))
+    )
+    if changes is None:
+        version, table = games.listing()
+        return jsonify(version=str(version), reset=True, games=table)
+    return jsonify(
+        version=str(version),
+        changes=[{"version": str(v), "kind": k, "game": g} for v, k, g in changes],
+    )
 
 
 @app.route("/wormageddonweb/UpdatePlayerInfo.asp")
 def update_info():
-    """no-op for player stats"""
+    """record the player's reported info (see players.py)"""
+    nick = request.args.get("Nick")
+    if players.store and nick:
+        players.store.update(
+            nick[:32], players.clean(request.args), request.remote_addr
+        )
     return "<NOTHING>"
 
 
+@app.route("/status.json")
+def status_json():
+    """who's online per channel, game counts, countries and ranks"""
+    if status.lobby is None:
+        abort(404)
+    _, body, _ = status.lobby.snapshot()
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/status")
+def status_page():
+    """status.json as a page"""
+    if status.lobby is None:
+        abort(404)
+    _, _, page = status.lobby.snapshot()
+    return Response(page, mimetype="text/html")
+
+
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
 def serve(path):
@@ -134,3 +247,70 @@ def serve(path):
     if filepath.exists() and filepath.is_file():
         return send_from_directory(wwwroot, path or "index.html")
     return "404", 404
+
+
+class GatedWSGIServer(ThreadedWSGIServer):
+    """threaded werkzeug server behind an admission gate
+
+    verify_request runs on the accept thread, so pacing there leaves the
+    excess in the listen backlog; refused connections get a bare 503.
+    connections from trusted proxies skip the per-ip cap there; their
+    clients are counted by admit_address once X-Forwarded-For is read.
+    """
+
+    def __init__(self, host, port, app, gate, backlog=None):
+        self.gate = gate
+        self.request_queue_size = backlog or config.HTTP_BACKLOG
+        self._peers = {}
+        self._peers_lock = threading.Lock()
+        # each connection is handled, and shut down, on its own thread
+        self._forwarded = threading.local()
+        super().__init__(host, port, proxy.ForwardedFor(app, self.admit_address))
+
+    def admit_address(self, ip):
+        """per-ip cap for a client behind a trusted proxy, until it's gone"""
+        self._release_address()  # the previous request on this connection
+        reason = self.gate.admit_address(ip)
+        if reason is None:
+            self._forwarded.ip = ip
+        return reason
+
+    def _release_address(self):
+        ip = getattr(self._forwarded, "ip", None)
+        if ip is not None:
+            self._forwarded.ip = None
+            self.gate.release_address(ip)
+
+    def verify_request(self, request, client_address):
+        self.gate.throttle()
+        ip = client_address[0]
+        if proxy.http_trusted.match(ip) is not None:
+            ip = None
+        reason = self.gate.admit(ip)
+        if reason:
+            logging.warning(f"HTTP: refusing {client_address[0]}: {reason}")
+            try:
+                request.sendall(
+                    b"HTTP/1.0 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            return False
+        with self._peers_lock:
+            self._peers[id(request)] = ip
+        return True
+
+    def shutdown_request(self, request):
+        with self._peers_lock:
+            admitted = id(request) in self._peers
+            ip = self._peers.pop(id(request), None)
+        if admitted:
+            self.gate.release(ip)
+        self._release_address()
+        super().shutdown_request(request)
+
+
+def make_server(host, port):
+    """the wormnet http server with admission control from config"""
+    return GatedWSGIServer(host, port, app, admission.http_gate())
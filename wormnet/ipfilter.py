@@ -0,0 +1,216 @@
+"""cidr allow/deny filter for the irc and http listeners
+
+rules live in one patricia (path-compressed binary radix) tree per address
+family. a lookup walks only the nodes on the address's path, so the cost
+grows with prefix depth, not with the number of rules. the most specific
+matching rule wins; with no match the default action applies.
+
+the active filter is replaced wholesale on reload (SIGHUP or
+POST /admin/ipfilter/reload), so lookups never see a half-built tree.
+"""
+
+import ipaddress
+import logging
+import socket
+from pathlib import Path
+
+import tomli
+
+from . import config
+
+ALLOW, DENY = "allow", "deny"
+
+
+class Rule:
+    """one cidr and what to do with addresses inside it"""
+
+    __slots__ = ("network", "action", "hits")
+
+    def __init__(self, network, action):
+        self.network = network
+        self.action = action
+        self.hits = 0
+
+
+class _Node:
+    __slots__ = ("prefix", "length", "rule", "children")
+
+    def __init__(self, prefix, length, rule=None):
+        self.prefix = prefix
+        self.length = length
+        self.rule = rule
+        self.children = [None, None]
+
+
+class RadixTree:
+    """longest-prefix match over fixed-width integers"""
+
+    def __init__(self, width):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, value, index):
+        """bit `index` counted from the most significant end"""
+        return (value >> (self.width - index - 1)) & 1
+
+    def insert(self, prefix, length, rule):
+        """add (or replace) the rule for prefix/length"""
+        width = self.width
+        node = self.root
+        while True:
+            if node.length == length:
+                if node.rule is None:
+                    self.size += 1
+                node.rule = rule
+                return
+            bit = self._bit(prefix, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(prefix, length, rule)
+                self.size += 1
+                return
+
+            diff = prefix ^ child.prefix
+            common = min(child.length, length, width - diff.bit_length())
+            if common == child.length:
+                node = child
+                continue
+
+            # new prefix diverges inside the child's compressed edge: split it
+            mask = ~((1 << (width - common)) - 1) & ((1 << width) - 1)
+            mid = _Node(prefix & mask, common)
+            mid.children[self._bit(child.prefix, common)] = child
+            node.children[bit] = mid
+            if common == length:
+                mid.rule = rule
+            else:
+                mid.children[self._bit(prefix, common)] = _Node(prefix, length, rule)
+            self.size += 1
+            return
+
+    def lookup(self, value):
+        """rule of the longest prefix containing value, or None"""
+        width = self.width
+        node = self.root
+        best = None
+        while node is not None:
+            length = node.length
+            if length and (value ^ node.prefix) >> (width - length):
+                break
+            if node.rule is not None:
+                best = node.rule
+            if length == width:
+                break
+            node = node.children[(value >> (width - length - 1)) & 1]
+        return best
+
+
+class IPFilter:
+    """allow/deny rules for ipv4 and ipv6 with per-rule hit counters"""
+
+    def __init__(self, allow=(), deny=(), default=ALLOW):
+        self.default = default
+        self.default_hits = 0
+        self.rules = []
+        self.trees = {4: RadixTree(32), 6: RadixTree(128)}
+        # deny is added last so it wins when the same cidr is in both lists
+        for cidrs, action in ((allow, ALLOW), (deny, DENY)):
+            for cidr in cidrs:
+                self.add(cidr, action)
+
+    def add(self, cidr, action):
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        rule = Rule(network, action)
+        self.rules.append(rule)
+        self.trees[network.version].insert(
+            int(network.network_address), network.prefixlen, rule
+        )
+        return rule
+
+    def match(self, ip):
+        """the rule deciding ip, or None when the default applies"""
+        # inet_pton is several times faster than ipaddress.ip_address
+        try:
+            if ":" not in ip:
+                return self.trees[4].lookup(
+                    int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+                )
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+        except (OSError, TypeError):
+            return None
+        if value >> 32 == 0xFFFF:  # ipv4-mapped (::ffff:a.b.c.d)
+            return self.trees[4].lookup(value & 0xFFFFFFFF)
+        return self.trees[6].lookup(value)
+
+    def allowed(self, ip):
+        """check ip and count the hit on whichever rule decided it"""
+        rule = self.match(ip)
+        if rule is None:
+            self.default_hits += 1
+            return self.default == ALLOW
+        rule.hits += 1
+        return rule.action == ALLOW
+
+    def stats(self, limit=None):
+        rules = sorted(self.rules, key=lambda r: -r.hits)
+        if limit:
+            rules = rules[:limit]
+        return {
+            "default": self.default,
+            "default_hits": self.default_hits,
+            "rules": len(self.rules),
+            "hits": [
+                {"cidr": str(r.network), "action": r.action, "hits": r.hits}
+                for r in rules
+            ],
+        }
+
+
+def _read_list(path):
+    """cidrs from a file, one per line, # comments allowed"""
+    if not path:
+        return []
+    cidrs = []
+    for line in Path(path).read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            cidrs.append(line)
+    return cidrs
+
+
+def build():
+    """filter from the current config values"""
+    return IPFilter(
+        allow=list(config.IPFILTER_ALLOW) + _read_list(config.IPFILTER_ALLOW_FILE),
+        deny=list(config.IPFILTER_DENY) + _read_list(config.IPFILTER_DENY_FILE),
+        default=config.IPFILTER_DEFAULT,
+    )
+
+
+# active filter; swapped in one assignment on reload
+active = IPFilter()
+
+
+def allowed(ip):
+    return active.allowed(ip)
+
+
+def load():
+    """rebuild the active filter from config"""
+    global active
+    active = build()
+    logging.info(f"IP filter: {len(active.rules)} rules, default {active.default}")
+    return active
+
+
+def reload():
+    """re-read [ipfilter] from the config file and swap the filter in
+
+    a bad file leaves the current filter in place and raises.
+    """
+    if config.CONFIG_FILE:
+        with open(config.CONFIG_FILE, "rb") as f:
+            section = tomli.load(f).get("ipfilter", {})
+        config.load_ipfilter(section)
+    return load()
@@ -1,16 +1,78 @@
 """irc server for wormnet"""
 
+import collections
+import hmac
+import fcntl
+import itertools
+import select
 import socket
+import struct
+import sys
+import termios
 import threading
+import time
 import re
 import logging
+import selectors
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from . import state, config
+from . import state, config, record, admission, ipfilter, overload, federation, proxy
+from . import events, games, wire
+from .state import ChannelSet
+
+_connection_ids = itertools.count(1)
+
+# numeric per-connection stats that listings can sort by
+SORT_KEYS = (
+    "id",
+    "bytes_in",
+    "bytes_out",
+    "lines_in",
+    "lines_out",
+    "send_queue",
+    "recv_buffer",
+    "idle",
+    "age",
+)
+
+# verbs process_line handles; anything else is counted as "other" so a
+# client can't grow its command counter with made-up ones
+COMMANDS = frozenset(
+    (
+        "PASS NICK USER PING JOIN PART PRIVMSG LIST NAMES WHO MODE MOTD OPER"
+        " CONNS KILL QUIT"
+    ).split()
+)
 
 
 class IRCClient:
     """handles individual irc client connection"""
 
+    __slots__ = (
+        "sock",
+        "addr",
+        "nickname",
+        "username",
+        "realname",
+        "registered",
+        "password",
+        "channels",
+        "oper",
+        "id",
+        "connected_at",
+        "last_activity",
+        "bytes_in",
+        "bytes_out",
+        "lines_in",
+        "lines_out",
+        "commands",
+        "recv_buf",
+        "last_query",
+        "session",
+        "send_lock",
+        "nick_ts",
+    )
+
     def __init__(self, sock, addr):
         self.sock = sock
         self.addr = addr
@@ -19,41 +81,149 @@ class IRCClient:
         self.realname = None  # stores "flags rank country version"
         self.registered = False
         self.password = None
-        self.channels = set()
-
-    def send(self, msg):
-        """send message to client"""
+        self.channels = ChannelSet(self)
+        self.oper = False
+
+        # introspection counters; updated without locks, so approximate
+        # when several threads send to this client at once
+        self.id = next(_connection_ids)
+        self.connected_at = time.time()
+        self.last_activity = self.connected_at
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.commands = collections.Counter()
+        self.recv_buf = ""  # only a partial line ever lives here
+        self.last_query = 0.0  # last WHO/LIST let through while throttling
+        self.session = None  # traffic recorder session
+        # several threads may broadcast to this client at once; sendall can
+        # write in pieces, so lines would interleave without it
+        self.send_lock = threading.Lock()
+        self.nick_ts = 0.0  # when the nick was taken; older wins a collision
+
+    def send(self, msg, data=None):
+        """send message to client
+
+        data is msg already encoded, from callers sending one line to many.
+        """
         try:
             logging.debug(f"IRC {self.addr[0]}:{self.addr[1]} <- {msg}")
-            self.sock.sendall(f"{msg}\r\n".encode("utf-8"))
-        except (BrokenPipeError, ConnectionResetError):
+            if data is None:
+                data = wire.line(msg)
+            with self.send_lock:
+                self.sock.sendall(data)
+            self.bytes_out += len(data)
+            self.lines_out += 1
+        except OSError:
+            # broadcasts read a snapshot, so the peer may already be closed
             pass
 
     def handle(self):
-        """handle client connection"""
-        buf = ""
+        """handle client connection on the calling thread until it closes"""
+        self.start()
         try:
             while True:
-                data = self.sock.recv(4096).decode("utf-8", errors="ignore")
-                if not data:
+                raw = self.sock.recv(4096)
+                if not raw:
                     break
-
-                buf += data
-                while "\n" in buf:
-                    line, buf = buf.split("\n", 1)
-                    line = line.rstrip("\r")
-                    if line:
-                        self.process_line(line)
+                self.feed(raw)
         except (ConnectionResetError, BrokenPipeError, OSError):
             pass
         finally:
+            self.finish()
+
+    def start(self):
+        """count the connection in (and open its recording session)"""
+        if record.recorder:
+            self.session = record.recorder.open_session(self.addr[0])
+        state.irc_connections.add(self)
+
+    def feed(self, raw):
+        """process every complete line in a chunk read from the socket"""
+        self.bytes_in += len(raw)
+        recorder = record.recorder
+        self.recv_buf += wire.decode(raw)
+        while "\n" in self.recv_buf:
+            line, self.recv_buf = self.recv_buf.split("\n", 1)
+            line = line.rstrip("\r")
+            if line:
+                if recorder and self.session is not None:
+                    recorder.line(self.session, wire.encode(line))
+                self.process_line(line)
+
+    def read(self):
+        """one recv on a socket the reactor saw readable; False once it's done"""
+        try:
+            raw = self.sock.recv(4096, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            raw = b""
+        if not raw:
+            return False
+        try:
+            self.feed(raw)
+        except OSError:
+            return False
+        # QUIT or a bad password closes the socket from inside feed
+        return self.sock.fileno() != -1
+
+    def finish(self):
+        """count the connection out; cleanup unless QUIT already did it"""
+        if record.recorder and self.session is not None:
+            record.recorder.close_session(self.session)
+            self.session = None
+        if self in state.irc_connections:
             self.cleanup()
 
+    def send_queue_bytes(self):
+        """bytes written but not yet acked by the peer (linux SIOCOUTQ)"""
+        try:
+            buf = fcntl.ioctl(self.sock.fileno(), termios.TIOCOUTQ, b"\0" * 4)
+            return struct.unpack("i", buf)[0]
+        except (OSError, TypeError, ValueError):
+            return 0
+
+    def stats(self, now=None):
+        """snapshot of this connection's counters"""
+        now = now or time.time()
+        return {
+            "id": self.id,
+            "nick": self.nickname,
+            "ip": self.addr[0],
+            "port": self.addr[1],
+            "registered": self.registered,
+            "channels": sorted(self.channels),
+            "connected_at": self.connected_at,
+            "age": round(now - self.connected_at, 3),
+            "idle": round(now - self.last_activity, 3),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "send_queue": self.send_queue_bytes(),
+            "recv_buffer": len(self.recv_buf),
+            "commands": dict(self.commands),
+        }
+
+    def kill(self, reason="Killed"):
+        """drop the connection; the handler thread then runs cleanup"""
+        logging.info(f"IRC: killing {self.nickname or self.addr[0]}: {reason}")
+        self.send(f"ERROR :Closing Link: {self.addr[0]} ({reason})")
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
     def process_line(self, line):
         """process irc command"""
         logging.debug(f"IRC {self.addr[0]}:{self.addr[1]}: {line}")
         parts = line.split(" ")
         cmd = parts[0].upper()
+        self.lines_in += 1
+        self.last_activity = time.time()
+        self.commands[cmd if cmd in COMMANDS else "other"] += 1
 
         if cmd == "PASS":
             self.password = parts[1] if len(parts) > 1 else None
@@ -62,17 +232,32 @@ class IRCClient:
             if len(parts) > 1:
                 nick = parts[1]
                 # validate nickname
-                if re.match(r"^[a-zA-Z][a-zA-Z0-9\-`|\[\]{}\_^]{0,14}$", nick):
-                    self.nickname = nick
+                valid = re.match(r"^[a-zA-Z][a-zA-Z0-9\-`|\[\]{}\_^]{0,14}$", nick)
+                if valid and federation.is_remote(nick):
+                    # owned by a user on another node
+                    self.send(
+                        f":{config.IRC_HOST} 433 {self.nickname or '*'} {nick} :Nickname is already in use"
+                    )
+                elif valid:
+                    old, self.nickname = self.nickname, sys.intern(nick)
+                    self.nick_ts = time.time()
+                    if self.registered and old != nick:
+                        state.irc_clients.rename(self, old, self.nickname)
+                        for channame in self.channels:
+                            state.drop_user(channame, old)
+                            state.irc_channels[channame]["users"].add(self.nickname)
+                        events.publish(events.NickChanged(self, old))
+                        federation.nick(self, old)
                     self.check_registration()
 
         elif cmd == "USER":
             if len(parts) >= 4:
-                self.username = parts[1]
+                self.username = sys.intern(parts[1])
                 # extract realname (everything after the colon)
                 # format: USER username hostname servername :flags rank country version
                 if ":" in line:
-                    self.realname = line.split(":", 1)[1]
+                    # thousands of clients share a handful of these
+                    self.realname = sys.intern(line.split(":", 1)[1])
                 self.check_registration()
 
         elif cmd == "PING":
@@ -85,19 +270,23 @@ class IRCClient:
                         # check if already in channel
                         if channame in self.channels:
                             continue
+                        # one shared string instead of a copy per member
+                        channame = sys.intern(channame)
                         self.channels.add(channame)
-                        with state.irc_lock:
-                            state.irc_channels[channame]["users"].add(self.nickname)
+                        state.irc_channels[channame]["users"].add(self.nickname)
                         # notify everyone in channel (including self)
                         # format: :nick!user@host JOIN :#channel
                         user_mask = f"{self.nickname}!~{self.username}@{self.addr[0]}"
                         join_msg = f":{user_mask} JOIN :{channame}"
                         self.send(join_msg)
                         self.broadcast_to_channel(channame, join_msg)
+                        topic = wire.local(state.irc_channels[channame]["topic"])
                         self.send(
-                            f":{config.IRC_HOST} 332 {self.nickname} {channame} :{state.irc_channels[channame]['topic']}"
+                            f":{config.IRC_HOST} 332 {self.nickname} {channame} :{topic}"
                         )
                         self.send_names(channame)
+                        events.publish(events.ChannelJoined(self, channame))
+                        federation.join(self, channame)
 
         elif cmd == "PART" and self.registered:
             if len(parts) > 1:
@@ -108,34 +297,37 @@ class IRCClient:
                     self.send(part_msg)
                     self.broadcast_to_channel(channame, part_msg)
                     self.channels.remove(channame)
-                    with state.irc_lock:
-                        state.irc_channels[channame]["users"].discard(self.nickname)
+                    state.drop_user(channame, self.nickname)
+                    events.publish(events.ChannelParted(self, channame))
+                    federation.part(self, channame)
 
         elif cmd == "PRIVMSG" and self.registered:
             if len(parts) >= 3:
                 target = parts[1]
-                msg = " ".join(parts[2:])[1:]  # remove leading :
+                msg = line.split(" ", 2)[2][1:]  # remove leading :
                 if target.startswith("#") and target in self.channels:
                     # channel message
                     self.broadcast_to_channel(
                         target, f":{self.nickname} PRIVMSG {target} :{msg}"
                     )
+                    federation.privmsg(self, target, msg)
                 else:
                     # private message to user
-                    with state.irc_lock:
-                        for client in state.irc_clients:
-                            if client.nickname == target:
-                                client.send(
-                                    f":{self.nickname}!~{self.username}@{self.addr[0]} PRIVMSG {target} :{msg}"
-                                )
-                                break
+                    client = state.irc_clients.find(target)
+                    if client is not None:
+                        client.send(
+                            f":{self.nickname}!~{self.username}@{self.addr[0]} PRIVMSG {target} :{msg}"
+                        )
 
         elif cmd == "LIST" and self.registered:
+            if self.throttled(cmd):
+                return
             self.send(f":{config.IRC_HOST} 321 {self.nickname} Channel :Users Name")
             for channame, chandata in state.irc_channels.items():
                 usercount = len(chandata["users"])
+                topic = wire.local(chandata["topic"])
                 self.send(
-                    f":{config.IRC_HOST} 322 {self.nickname} {channame} {usercount} :{chandata['topic']}"
+                    f":{config.IRC_HOST} 322 {self.nickname} {channame} {usercount} :{topic}"
                 )
             self.send(f":{config.IRC_HOST} 323 {self.nickname} :End of /LIST")
 
@@ -144,36 +336,33 @@ class IRCClient:
                 self.send_names(parts[1])
 
         elif cmd == "WHO" and self.registered:
+            if self.throttled(cmd):
+                return
             # WHO [channel]
             target = parts[1].strip() if len(parts) > 1 and parts[1].strip() else "*"
-            with state.irc_lock:
-                if target.startswith("#") and target in state.irc_channels:
-                    # list users in specific channel - need to find client objects
-                    for client in state.irc_clients:
-                        if client.nickname in state.irc_channels[target]["users"]:
-                            realname = (
-                                client.realname if client.realname else client.nickname
-                            )
-                            username = client.username if client.username else "user"
-                            self.send(
-                                f":{config.IRC_HOST} 352 {self.nickname} {target} ~{username} {client.addr[0]} {config.IRC_HOST} {client.nickname} H :0 {realname}"
-                            )
-                else:
-                    # list all users, showing which channel they're in
-                    for client in state.irc_clients:
-                        if client.nickname:
-                            realname = (
-                                client.realname if client.realname else client.nickname
-                            )
-                            username = client.username if client.username else "user"
-                            # show first channel user is in, or * if none
-                            channel = (
-                                next(iter(client.channels)) if client.channels else "*"
-                            )
-                            self.send(
-                                f":{config.IRC_HOST} 352 {self.nickname} {channel} ~{username} {client.addr[0]} {config.IRC_HOST} {client.nickname} H :0 {realname}"
-                            )
-                    target = "*"  # normalize for reply
+            if target.startswith("#") and target in state.irc_channels:
+                for client in state.members(target) + state.remote_members(target):
+                    realname = client.realname if client.realname else client.nickname
+                    username = client.username if client.username else "user"
+                    self.send(
+                        f":{config.IRC_HOST} 352 {self.nickname} {target} ~{username} {client.addr[0]} {config.IRC_HOST} {client.nickname} H :0 {realname}"
+                    )
+            else:
+                # list all users, showing which channel they're in
+                for client in state.irc_clients.snapshot():
+                    if client.nickname:
+                        realname = (
+                            client.realname if client.realname else client.nickname
+                        )
+                        username = client.username if client.username else "user"
+                        # show first channel user is in, or * if none
+                        channel = (
+                            next(iter(client.channels)) if client.channels else "*"
+                        )
+                        self.send(
+                            f":{config.IRC_HOST} 352 {self.nickname} {channel} ~{username} {client.addr[0]} {config.IRC_HOST} {client.nickname} H :0 {realname}"
+                        )
+                target = "*"  # normalize for reply
             self.send(
                 f":{config.IRC_HOST} 315 {self.nickname} {target} :End of /WHO list"
             )
@@ -186,9 +375,108 @@ class IRCClient:
         elif cmd == "MOTD" and self.registered:
             self.send_motd()
 
+        elif cmd == "OPER" and self.registered:
+            self.handle_oper(parts)
+
+        elif cmd == "CONNS" and self.registered:
+            self.handle_conns(parts)
+
+        elif cmd == "KILL" and self.registered:
+            self.handle_kill(line, parts)
+
         elif cmd == "QUIT":
             self.cleanup()
 
+    def throttled(self, cmd):
+        """rate limit WHO/LIST while the server is shedding load"""
+        if overload.level() < overload.THROTTLE:
+            return False
+        now = time.monotonic()
+        if now - self.last_query < config.OVERLOAD_QUERY_INTERVAL:
+            overload.controller.count(cmd.lower())
+            self.send(
+                f":{config.IRC_HOST} 263 {self.nickname} {cmd} :Server load is temporarily too heavy. Please wait a while and try again."
+            )
+            return True
+        self.last_query = now
+        return False
+
+    def handle_oper(self, parts):
+        """OPER name password"""
+        if len(parts) < 3:
+            self.send(
+                f":{config.IRC_HOST} 461 {self.nickname} OPER :Not enough parameters"
+            )
+            return
+        expected = config.OPERS.get(parts[1])
+        if expected is None or not hmac.compare_digest(
+            parts[2].encode(), str(expected).encode()
+        ):
+            self.send(f":{config.IRC_HOST} 464 {self.nickname} :Password incorrect")
+            return
+        self.oper = True
+        logging.info(f"IRC: {self.nickname} is now an operator ({parts[1]})")
+        self.send(
+            f":{config.IRC_HOST} 381 {self.nickname} :You are now an IRC operator"
+        )
+
+    def require_oper(self):
+        """send 481 unless this client has authenticated with OPER"""
+        if not self.oper:
+            self.send(
+                f":{config.IRC_HOST} 481 {self.nickname} :Permission Denied- You're not an IRC operator"
+            )
+        return self.oper
+
+    def handle_conns(self, parts):
+        """CONNS [sort] [match] [limit] - list connections as NOTICEs"""
+        if not self.require_oper():
+            return
+        sort = parts[1] if len(parts) > 1 else "bytes_in"
+        match = parts[2] if len(parts) > 2 and parts[2] != "*" else None
+        limit = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 20
+        if sort not in SORT_KEYS:
+            self.send(
+                f":{config.IRC_HOST} NOTICE {self.nickname} :sort must be one of {', '.join(SORT_KEYS)}"
+            )
+            return
+
+        rows = list_connections(sort=sort, match=match, limit=limit)
+        self.send(
+            f":{config.IRC_HOST} NOTICE {self.nickname} :id nick ip in/out(bytes) lines in/out sendq recvq idle top-commands"
+        )
+        for row in rows:
+            top = ",".join(
+                f"{c}:{n}"
+                for c, n in sorted(row["commands"].items(), key=lambda i: -i[1])[:3]
+            )
+            self.send(
+                f":{config.IRC_HOST} NOTICE {self.nickname} :{row['id']} {row['nick'] or '*'} {row['ip']}"
+                f" {row['bytes_in']}/{row['bytes_out']} {row['lines_in']}/{row['lines_out']}"
+                f" {row['send_queue']} {row['recv_buffer']} {row['idle']:.0f}s {top}"
+            )
+        self.send(
+            f":{config.IRC_HOST} NOTICE {self.nickname} :End of CONNS ({len(rows)})"
+        )
+
+    def handle_kill(self, line, parts):
+        """KILL <nick|#id> [:reason]"""
+        if not self.require_oper():
+            return
+        if len(parts) < 2:
+            self.send(
+                f":{config.IRC_HOST} 461 {self.nickname} KILL :Not enough parameters"
+            )
+            return
+        reason = line.split(":", 1)[1] if ":" in line else f"Killed by {self.nickname}"
+        target = find_connection(parts[1])
+        if target is None:
+            self.send(
+                f":{config.IRC_HOST} 401 {self.nickname} {parts[1]} :No such nick"
+            )
+            return
+        target.kill(reason)
+
     def check_registration(self):
         """check if client can be registered"""
         if self.nickname and self.username and not self.registered:
@@ -198,8 +486,9 @@ class IRCClient:
                 return
 
             self.registered = True
-            with state.irc_lock:
-                state.irc_clients.append(self)
+            state.irc_clients.append(self)
+            events.publish(events.UserRegistered(self))
+            federation.introduce(self)
 
             # send welcome messages
             self.send(
@@ -236,7 +525,7 @@ class IRCClient:
             lines = ["Welcome to WormNET", "Have fun playing Worms Armageddon!"]
 
         for line in lines:
-            self.send(f":{config.IRC_HOST} 372 {self.nickname} :- {line}")
+            self.send(f":{config.IRC_HOST} 372 {self.nickname} :- {wire.local(line)}")
 
         self.send(f":{config.IRC_HOST} 376 {self.nickname} :End of /MOTD command.")
 
@@ -251,50 +540,241 @@ class IRCClient:
 
     def broadcast_to_channel(self, channame, msg):
         """broadcast message to channel"""
-        with state.irc_lock:
-            for client in state.irc_clients:
-                if client != self and channame in client.channels:
-                    client.send(msg)
+        data = wire.line(msg)  # once, not per member
+        for client in state.members(channame):
+            if client is not self:
+                client.send(msg, data)
+
+    def unregister(self, reason):
+        """leave every channel with a QUIT, here and on linked nodes"""
+        if self not in state.irc_clients:
+            return
+        quit_msg = f":{self.nickname} QUIT :{reason}"
+        for channame in self.channels:
+            self.broadcast_to_channel(channame, quit_msg)
+        state.irc_clients.discard(self)  # also leaves the member snapshots
+        for channame in self.channels:
+            state.drop_user(channame, self.nickname)
+        events.publish(events.UserQuit(self, tuple(self.channels), reason))
+        federation.quit(self, reason)
+        closed = games.host_left(self)
+        if closed:
+            logging.info(f"IRC: closed {closed} games hosted by {self.nickname}")
 
     def cleanup(self):
         """cleanup on disconnect"""
-        # notify all channels user was in
         if self.nickname:
-            quit_msg = f":{self.nickname} QUIT :Client disconnected"
-            for channame in self.channels:
-                self.broadcast_to_channel(channame, quit_msg)
             logging.info(f"IRC: {self.addr[0]}:{self.addr[1]} disconnecting: Quit")
         else:
             logging.info(
                 f"IRC: {self.addr[0]}:{self.addr[1]} disconnected before registering"
             )
 
-        with state.irc_lock:
-            if self in state.irc_clients:
-                state.irc_clients.remove(self)
-            for channame in self.channels:
-                if channame in state.irc_channels:
-                    state.irc_channels[channame]["users"].discard(self.nickname)
+        state.irc_connections.discard(self)
+        self.unregister("Client disconnected")
         try:
             self.sock.close()
         except OSError:
             pass
 
 
-def run_server():
-    """run irc server"""
+def list_connections(
+    sort="bytes_in", reverse=True, match=None, idle_min=None, limit=None
+):
+    """stats for every live connection, sorted and filtered
+
+    match is a substring of the nick or ip; idle_min drops connections that
+    were active in the last idle_min seconds.
+    """
+    now = time.time()
+    rows = [c.stats(now) for c in state.irc_connections.snapshot()]
+    if match:
+        rows = [r for r in rows if match in (r["nick"] or "") or match in r["ip"]]
+    if idle_min is not None:
+        rows = [r for r in rows if r["idle"] >= idle_min]
+    rows.sort(key=lambda r: r[sort], reverse=reverse)
+    return rows[:limit] if limit else rows
+
+
+def find_connection(target):
+    """look up a live connection by nick or by "#<id>" """
+    for client in state.irc_connections.snapshot():
+        if target.startswith("#") and str(client.id) == target[1:]:
+            return client
+        if client.nickname == target:
+            return client
+    return None
+
+
+class Reactor:
+    """serves client connections from a worker pool instead of a thread each
+
+    every client socket sits in one epoll set armed with EPOLLONESHOT. when
+    one turns readable a pool worker does a single recv, processes the
+    complete lines and re-arms it, so a client is never handled by two
+    workers at once and an idle client costs its socket and IRCClient, not
+    a thread stack.
+    """
+
+    EVENTS = getattr(select, "EPOLLIN", 0) | getattr(select, "EPOLLONESHOT", 0)
+
+    def __init__(self, workers):
+        self.epoll = select.epoll()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="irc-worker")
+        self.lock = threading.Lock()
+        self.clients = {}  # fd -> (client, on_close)
+        self.thread = threading.Thread(target=self.run, name="irc-reactor", daemon=True)
+        self.thread.start()
+
+    def add(self, client, on_close):
+        fd = client.sock.fileno()
+        client.start()
+        with self.lock:
+            self.clients[fd] = (client, on_close)
+        self.epoll.register(fd, self.EVENTS)
+
+    def run(self):
+        while True:
+            try:
+                events = self.epoll.poll()
+            except InterruptedError:
+                continue
+            except (OSError, ValueError):
+                return  # closed
+            for fd, _ in events:
+                entry = self.clients.get(fd)
+                if entry is not None:
+                    self.pool.submit(self.service, fd, *entry)
+
+    def service(self, fd, client, on_close):
+        try:
+            if client.read():
+                self.epoll.modify(fd, self.EVENTS)
+                return
+        except Exception:
+            logging.exception(f"IRC: error serving {client.addr[0]}")
+        with self.lock:
+            # the fd may already belong to a newer connection
+            if self.clients.get(fd, (None,))[0] is client:
+                del self.clients[fd]
+        try:
+            client.finish()
+        finally:
+            on_close()
+
+    def close(self):
+        self.epoll.close()
+        self.pool.shutdown(wait=False)
+
+
+# shared reactor, None when clients get a thread each
+reactor = None
+
+
+def start_reactor(workers=None):
+    """start the pooled reactor if configured and supported (linux epoll)"""
+    global reactor
+    workers = config.IRC_WORKERS if workers is None else workers
+    if workers and hasattr(select, "epoll") and reactor is None:
+        reactor = Reactor(workers)
+        logging.info(f"IRC: serving clients from {workers} worker threads")
+    return reactor
+
+
+def listen():
+    """bind the irc listener from config"""
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind(("0.0.0.0", config.IRC_PORT))
-    sock.listen(5)
+    sock.listen(config.IRC_BACKLOG)
     logging.info(f"IRC server listening on port {config.IRC_PORT}")
+    return sock
+
+
+def run_server(sock=None):
+    """run irc server, on an already bound listener if given"""
+    sock = sock or listen()
+    start_reactor()
+    serve(sock, admission.irc_gate())
+
+
+def serve(sock, gate, batch=None):
+    """accept loop for a listening socket
 
-    while True:
+    wakes when the listener is readable, then drains up to `batch`
+    connections, each paced by the gate's token bucket.
+    """
+    batch = batch or config.IRC_ACCEPT_BATCH
+    sock.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+
+    while sock.fileno() != -1:
+        try:
+            sel.select(timeout=1.0)
+        except (OSError, ValueError):
+            break
+        for _ in range(batch):
+            gate.throttle()
+            try:
+                client_sock, addr = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                gate.bucket.refund()
+                break
+            except OSError:
+                break
+            if proxy.irc_trusted.rules and proxy.irc_trusted.match(addr[0]):
+                # the header may not be here yet; don't hold up the accept loop
+                threading.Thread(
+                    target=admit_proxied, args=(client_sock, addr, gate), daemon=True
+                ).start()
+            else:
+                admit(client_sock, addr, gate)
+    sel.close()
+
+
+def admit_proxied(client_sock, addr, gate):
+    """admit a connection from a trusted balancer as the client it carries"""
+    try:
+        client_sock.setblocking(True)
+        source = proxy.read_header(client_sock, config.IRC_PROXY_TIMEOUT)
+    except (OSError, ValueError) as e:
+        logging.warning(f"IRC: dropping {addr[0]}:{addr[1]}: {e}")
+        client_sock.close()
+        return
+    admit(client_sock, source or addr, gate)
+
+
+def admit(client_sock, addr, gate):
+    """start a client thread, or turn the connection away with an ERROR"""
+    client_sock.setblocking(True)
+    if not ipfilter.allowed(addr[0]):
+        reason = "Banned"
+    elif overload.level() >= overload.REJECT:
+        overload.controller.count("irc_connection")
+        reason = "Server busy, try again later"
+    else:
+        reason = gate.admit(addr[0])
+    if reason:
+        logging.warning(f"IRC: refusing {addr[0]}:{addr[1]}: {reason}")
         try:
-            client_sock, addr = sock.accept()
-            logging.info(f"New IRC connection from {addr[0]}:{addr[1]}")
-            client = IRCClient(client_sock, addr)
-            thread = threading.Thread(target=client.handle, daemon=True)
-            thread.start()
+            client_sock.send(f"ERROR :Closing Link: {addr[0]} ({reason})\r\n".encode())
         except OSError:
             pass
+        client_sock.close()
+        return
+
+    logging.info(f"New IRC connection from {addr[0]}:{addr[1]}")
+    client = IRCClient(client_sock, addr)
+
+    if reactor is not None:
+        reactor.add(client, lambda: gate.release(addr[0]))
+        return
+
+    def run():
+        try:
+            client.handle()
+        finally:
+            gate.release(addr[0])
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,219 @@
+"""load shedding when the server is saturated
+
+a monitor thread samples a few pressure signals every interval:
+
+- lag: how late its own sleep wakes up. with one thread per client this is
+  the scheduler/GIL backlog everyone else is waiting in too
+- threads: live thread count
+- send_queue: bytes sitting unacked in client socket buffers, summed
+- http_latency: p95 of recent /wormageddonweb/ request times
+
+each signal is divided by its configured ceiling; the largest ratio is the
+pressure, and the pressure picks a level. levels shed in order, each one
+keeping the ones below it:
+
+1. reject: new irc connections and Login.asp are turned away
+2. throttle: WHO and LIST are rate limited per client (263 try again)
+3. stale: GameList.asp serves cached bodies instead of rebuilding them
+
+chat and Game.asp for connected players are never shed. levels go up as
+soon as pressure crosses a threshold and come down one at a time after
+pressure has stayed below it for the cooldown.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from . import config, state
+
+NORMAL, REJECT, THROTTLE, STALE = 0, 1, 2, 3
+LEVEL_NAMES = ("normal", "reject", "throttle", "stale")
+
+# pressure must drop this far below a level's threshold to count as calm
+HYSTERESIS = 0.8
+
+
+def send_queue_total():
+    """unacked bytes across every live irc connection"""
+    return sum(c.send_queue_bytes() for c in state.irc_connections.snapshot())
+
+
+class Controller:
+    """turns pressure samples into a shedding level"""
+
+    def __init__(
+        self,
+        limits=None,
+        thresholds=(1.0, 1.5, 2.0),
+        cooldown=10.0,
+        interval=0.5,
+    ):
+        # signal -> ceiling (0 ignores the signal)
+        self.limits = dict(limits or {})
+        self.thresholds = tuple(thresholds)
+        self.cooldown = cooldown
+        self.interval = interval
+        self.level = NORMAL
+        self.pressure = 0.0
+        self.signals = {}
+        self.calm_since = None
+        self.since = time.monotonic()
+        self.time_in_level = collections.Counter()
+        self.transitions = collections.Counter()
+        self.history = collections.deque(maxlen=50)
+        self.shed = collections.Counter()
+        self.latencies = collections.deque(maxlen=512)
+        # http threads append while the monitor reads; without a GIL
+        # iterating the deque then can fail
+        self._latency_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record_latency(self, seconds):
+        with self._latency_lock:
+            self.latencies.append(seconds)
+
+    def count(self, what):
+        """tally one shed request or connection"""
+        self.shed[what] += 1
+
+    def sample(self, lag):
+        """current signal values; lag is measured by the caller"""
+        with self._latency_lock:
+            latencies = list(self.latencies)
+        latencies.sort()
+        return {
+            "lag": lag,
+            "threads": threading.active_count(),
+            "send_queue": send_queue_total() if self.limits.get("send_queue") else 0,
+            "http_latency": (
+                latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+            ),
+        }
+
+    def target(self, pressure):
+        """highest level whose threshold the pressure reaches"""
+        level = NORMAL
+        for i, threshold in enumerate(self.thresholds, start=1):
+            if pressure >= threshold:
+                level = i
+        return level
+
+    def update(self, signals, now=None):
+        """feed one sample; returns the (possibly new) level"""
+        now = time.monotonic() if now is None else now
+        self.signals = signals
+        self.pressure = max(
+            (signals.get(k, 0) / limit for k, limit in self.limits.items() if limit),
+            default=0.0,
+        )
+        target = self.target(self.pressure)
+
+        if target > self.level:
+            self._move(target, now)
+        elif self.level > NORMAL and (
+            self.pressure < self.thresholds[self.level - 1] * HYSTERESIS
+        ):
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= self.cooldown:
+                self._move(self.level - 1, now)
+        else:
+            self.calm_since = None
+        return self.level
+
+    def _move(self, level, now):
+        old = self.level
+        self.time_in_level[LEVEL_NAMES[old]] += now - self.since
+        self.since = now
+        self.calm_since = None
+        self.level = level
+        self.transitions[f"{LEVEL_NAMES[old]}->{LEVEL_NAMES[level]}"] += 1
+        self.history.append(
+            {
+                "time": time.time(),
+                "from": LEVEL_NAMES[old],
+                "to": LEVEL_NAMES[level],
+                "pressure": round(self.pressure, 3),
+                "signals": dict(self.signals),
+            }
+        )
+        log = logging.warning if level > old else logging.info
+        log(
+            f"Overload: {LEVEL_NAMES[old]} -> {LEVEL_NAMES[level]}"
+            f" (pressure {self.pressure:.2f}, {self.signals})"
+        )
+
+    def run(self):
+        while True:
+            t0 = time.monotonic()
+            if self._stop.wait(self.interval):
+                return
+            lag = max(0.0, time.monotonic() - t0 - self.interval)
+            try:
+                self.update(self.sample(lag))
+            except Exception:
+                # a dead monitor would freeze the level where it is
+                logging.exception("Overload: sampling failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        now = time.monotonic()
+        time_in_level = dict(self.time_in_level)
+        name = LEVEL_NAMES[self.level]
+        time_in_level[name] = time_in_level.get(name, 0) + now - self.since
+        return {
+            "level": self.level,
+            "state": name,
+            "pressure": round(self.pressure, 3),
+            "signals": self.signals,
+            "limits": self.limits,
+            "thresholds": list(self.thresholds),
+            "transitions": dict(self.transitions),
+            "time_in_state": {k: round(v, 3) for k, v in time_in_level.items()},
+            "shed": dict(self.shed),
+            "history": list(self.history),
+        }
+
+
+# stays at NORMAL until start() replaces it with a monitored one
+controller = Controller()
+
+
+def level():
+    return controller.level
+
+
+def start():
+    """start monitoring with thresholds from config"""
+    global controller
+    controller = Controller(
+        limits={
+            "lag": config.OVERLOAD_MAX_LAG,
+            "threads": config.OVERLOAD_MAX_THREADS,
+            "send_queue": config.OVERLOAD_MAX_SEND_QUEUE,
+            "http_latency": config.OVERLOAD_MAX_HTTP_LATENCY,
+        },
+        thresholds=config.OVERLOAD_THRESHOLDS,
+        cooldown=config.OVERLOAD_COOLDOWN,
+        interval=config.OVERLOAD_INTERVAL,
+    )
+    controller.start()
+    logging.info(f"Overload monitor started ({controller.limits})")
+    return controller
+
+
+def stop():
+    global controller
+    controller.stop()
+    controller = Controller()
@@ -0,0 +1,283 @@
+"""player info reported through UpdatePlayerInfo.asp
+
+each report updates one in-memory record keyed by nick: a couple of dict
+operations under a lock, nothing else. the record is marked dirty and a
+writer thread upserts every dirty record into sqlite in one transaction per
+flush interval, so requests never wait on the disk.
+
+the table keeps the `max_players` most recently active players in LRU order
+and evicts the least recently seen. evicted players stay in the database
+(counts are written as deltas, so nothing is lost), and a returning player
+gets their totals back from it on the next flush. at start the table is
+warmed with the most recently seen players. without a db path the store is
+memory only.
+
+only the last report's fields are kept per player, capped in count and
+length; the game sends a handful of short values.
+"""
+
+import atexit
+import collections
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from . import config
+
+MAX_FIELDS = 16
+MAX_KEY = 32
+MAX_VALUE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    nick TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    ip TEXT,
+    updates INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+)
+"""
+UPSERT = """
+INSERT INTO players VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(nick) DO UPDATE SET
+    info = excluded.info,
+    ip = excluded.ip,
+    updates = updates + excluded.updates,
+    last_seen = excluded.last_seen
+"""
+
+# active store, None when player info is off
+store = None
+
+
+class Player:
+    __slots__ = (
+        "nick",
+        "fields",
+        "ip",
+        "updates",
+        "pending",
+        "first_seen",
+        "last_seen",
+        "synced",
+    )
+
+    def __init__(self, nick, now, synced=False):
+        self.nick = nick
+        self.fields = ()
+        self.ip = None
+        self.updates = 0
+        self.pending = 0  # updates not written yet
+        self.first_seen = now
+        self.last_seen = now
+        self.synced = synced  # totals include what the database had
+
+    def as_dict(self):
+        return {
+            "nick": self.nick,
+            "info": dict(self.fields),
+            "ip": self.ip,
+            "updates": self.updates,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+        }
+
+
+def clean(args, skip=("Nick",)):
+    """the report's fields as a short tuple of (key, value) pairs"""
+    fields = []
+    for key, value in args.items():
+        if key in skip:
+            continue
+        fields.append((key[:MAX_KEY], value[:MAX_VALUE]))
+        if len(fields) == MAX_FIELDS:
+            break
+    return tuple(fields)
+
+
+class PlayerStore:
+    """LRU table of recent players, written behind to sqlite"""
+
+    def __init__(self, max_players=10000, path=None):
+        self.max_players = max_players
+        self.path = path
+        self.table = collections.OrderedDict()  # nick -> Player, oldest first
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # the writer thread vs stop()
+        self.evicted = 0
+        self.flushes = 0
+        self.written = 0
+        self.db = None
+        self.stopped = threading.Event()
+        if path:
+            # only the writer thread uses it once start() has run
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(SCHEMA)
+            self.db.commit()
+            self.load()
+
+    def load(self):
+        """warm the table with the most recently seen players"""
+        rows = self.db.execute(
+            "SELECT nick, info, ip, updates, first_seen, last_seen FROM players"
+            " ORDER BY last_seen DESC LIMIT ?",
+            (self.max_players,),
+        ).fetchall()
+        with self.lock:
+            for nick, info, ip, updates, first_seen, last_seen in reversed(rows):
+                player = Player(nick, first_seen, synced=True)
+                player.fields = tuple(json.loads(info).items())
+                player.ip, player.updates, player.last_seen = ip, updates, last_seen
+                self.table[nick] = player
+        return len(rows)
+
+    def update(self, nick, fields, ip=None, now=None):
+        """record one report (never touches the disk)"""
+        now = time.time() if now is None else now
+        with self.lock:
+            player = self.table.get(nick)
+            if player is None:
+                player = self.table[nick] = Player(nick, now, synced=not self.db)
+                if len(self.table) > self.max_players:
+                    self.table.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self.table.move_to_end(nick)
+            player.fields = fields
+            player.ip = ip
+            player.last_seen = now
+            player.updates += 1
+            if self.db is not None:
+                player.pending += 1
+                self.dirty.add(player)
+
+    def get(self, nick):
+        """a recently active player as a dict, or None"""
+        player = self.table.get(nick)
+        return None if player is None else player.as_dict()
+
+    def top(self, n=10, by="updates"):
+        """the n highest ranked recent players by updates or a numeric field"""
+        with self.lock:
+            players = list(self.table.values())
+        if by == "updates":
+            best = heapq.nlargest(n, players, key=lambda p: p.updates)
+            return [p.as_dict() for p in best]
+        ranked = []
+        for player in players:
+            value = dict(player.fields).get(by)
+            try:
+                ranked.append((float(value), player))
+            except (TypeError, ValueError):
+                continue
+        best = heapq.nlargest(n, ranked, key=lambda pair: pair[0])
+        return [p.as_dict() for _, p in best]
+
+    def flush(self):
+        """write dirty players in one transaction, returns how many"""
+        if self.db is None:
+            return 0
+        with self.flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self.lock:
+            batch = [
+                (p, p.ip, p.pending, p.first_seen, p.last_seen, p.fields)
+                for p in self.dirty
+            ]
+            for player in self.dirty:
+                player.pending = 0
+            self.dirty = set()
+        if not batch:
+            return 0
+        rows = [
+            (p.nick, json.dumps(dict(fields)), ip, pending, first, last)
+            for p, ip, pending, first, last, fields in batch
+        ]
+        try:
+            with self.db:
+                self.db.executemany(UPSERT, rows)
+        except sqlite3.Error:
+            # keep the counts for the next try
+            with self.lock:
+                for player, _, pending, *_ in batch:
+                    player.pending += pending
+                    self.dirty.add(player)
+            raise
+        self.flushes += 1
+        self.written += len(rows)
+        self._sync([p for p, *_ in batch if not p.synced])
+        return len(rows)
+
+    def _sync(self, players):
+        """give new records the totals the database already had"""
+        for player in players:
+            row = self.db.execute(
+                "SELECT updates, first_seen FROM players WHERE nick = ?",
+                (player.nick,),
+            ).fetchone()
+            with self.lock:
+                # row counts everything written; add what came in since
+                player.updates = row[0] + player.pending
+                player.first_seen = row[1]
+                player.synced = True
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logging.error(f"Players: flush to {self.path} failed: {e}")
+
+    def start(self, interval):
+        threading.Thread(
+            target=self.run, args=(interval,), name="players", daemon=True
+        ).start()
+
+    def stop(self):
+        """flush what's left and close the database"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+
+    def stats(self):
+        return {
+            "players": len(self.table),
+            "max_players": self.max_players,
+            "dirty": len(self.dirty),
+            "evicted": self.evicted,
+            "flushes": self.flushes,
+            "written": self.written,
+            "db": self.path,
+        }
+
+
+def start():
+    """open the store from config, returns it"""
+    global store
+    store = PlayerStore(config.PLAYERS_MAX, config.PLAYERS_DB or None)
+    if store.db is not None:
+        store.start(config.PLAYERS_FLUSH_INTERVAL)
+        atexit.register(store.stop)
+    logging.info(
+        f"Players: {len(store.table)} loaded, writing to {config.PLAYERS_DB}"
+        if config.PLAYERS_DB
+        else "Players: in memory only"
+    )
+    return store
+
+
+def stop():
+    global store
+    if store:
+        store.stop()
+        store = None
@@ -0,0 +1,243 @@
+"""spread Login.asp across a pool of irc nodes
+
+every irc node in the pool sends the http node a one-line udp report each
+interval: "<name> <connections> <max_clients> <overload level>". Login.asp
+then answers <CONNECT> with the least loaded healthy node, and keeps giving
+the same ip the same node for `sticky` seconds while that node stays healthy,
+so a reconnecting player lands back where they were.
+
+a node is healthy while its reports are fresh (within 3 intervals) and it is
+not rejecting connections. load is connections over max_clients, counting
+players sent there since its last report so a login burst between reports
+doesn't all go to the same node. with no healthy node Login.asp falls back
+to the plain [irc] address.
+
+the status port only needs to be reachable by the pool's own nodes; bind it
+to localhost or a private address.
+"""
+
+import logging
+import socket
+import threading
+import time
+
+from . import config, overload, state
+
+pool = None
+reporter = None
+
+# reports older than this many intervals mark a node down
+STALE_INTERVALS = 3
+
+
+class Node:
+    __slots__ = (
+        "name",
+        "host",
+        "port",
+        "connections",
+        "max_clients",
+        "level",
+        "seen",
+        "pending",
+    )
+
+    def __init__(self, name, host, port):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.max_clients = 0
+        self.level = overload.NORMAL
+        self.seen = None  # monotonic time of the last report
+        self.pending = 0  # handed out since that report
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def load(self):
+        used = self.connections + self.pending
+        return used / self.max_clients if self.max_clients else used
+
+    def stats(self, now):
+        return {
+            "address": self.address,
+            "connections": self.connections,
+            "max_clients": self.max_clients,
+            "pending": self.pending,
+            "level": overload.LEVEL_NAMES[self.level],
+            "age": None if self.seen is None else round(now - self.seen, 3),
+        }
+
+
+class Pool:
+    """node health from reports, and the pick for each login"""
+
+    def __init__(self, nodes, interval=1.0, sticky=600):
+        self.nodes = {
+            n["name"]: Node(
+                n["name"], n["host"], n.get("port", config.DEFAULT_IRC_PORT)
+            )
+            for n in nodes
+        }
+        self.interval = interval
+        self.sticky = sticky
+        self.assigned = {}  # ip -> (node name, expires)
+        self.lock = threading.Lock()
+        self.sock = None
+        self.running = False
+
+    def report(self, line, now=None):
+        """apply one status line; False if it isn't from a pool node"""
+        try:
+            name, connections, max_clients, level = line.split()
+            node = self.nodes[name]
+            values = int(connections), int(max_clients), int(level)
+        except (KeyError, ValueError):
+            return False
+        with self.lock:
+            node.connections, node.max_clients, node.level = values
+            node.seen = time.monotonic() if now is None else now
+            node.pending = 0
+        return True
+
+    def healthy(self, node, now):
+        return (
+            node.seen is not None
+            and now - node.seen <= self.interval * STALE_INTERVALS
+            and node.level < overload.REJECT
+        )
+
+    def pick(self, ip, now=None):
+        """node to send a player at ip to, or None if none are healthy"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            name, expires = self.assigned.get(ip, (None, 0))
+            node = self.nodes.get(name)
+            if node is None or expires < now or not self.healthy(node, now):
+                up = [n for n in self.nodes.values() if self.healthy(n, now)]
+                if not up:
+                    return None
+                node = min(up, key=Node.load)
+            node.pending += 1
+            self.assigned[ip] = (node.name, now + self.sticky)
+            return node
+
+    def expire(self, now=None):
+        """forget sticky assignments that ran out"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.assigned = {
+                ip: entry for ip, entry in self.assigned.items() if entry[1] >= now
+            }
+
+    def start(self, ip, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        self.sock.settimeout(self.interval)
+        self.running = True
+        threading.Thread(target=self.listen, name="pool", daemon=True).start()
+
+    def listen(self):
+        last_expire = time.monotonic()
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(512)
+                if not self.report(data.decode(errors="replace")):
+                    logging.debug(f"Pool: ignored report from {addr[0]}: {data!r}")
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            if time.monotonic() - last_expire > self.sticky:
+                self.expire()
+                last_expire = time.monotonic()
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            self.sock.close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "nodes": {
+                    name: dict(node.stats(now), healthy=self.healthy(node, now))
+                    for name, node in self.nodes.items()
+                },
+                "sticky": len(self.assigned),
+            }
+
+
+class Reporter:
+    """irc node side: send our load to the pool's status port"""
+
+    def __init__(self, name, target, interval=1.0):
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def line(self):
+        return (
+            f"{self.name} {len(state.irc_connections)} {config.IRC_MAX_CLIENTS}"
+            f" {overload.level()}"
+        )
+
+    def send(self):
+        try:
+            self.sock.sendto(self.line().encode(), self.target)
+        except OSError as e:
+            logging.debug(f"Pool: report to {self.target} failed: {e}")
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.send()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        threading.Thread(target=self.run, name="pool-report", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sock.close()
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return host, int(port)
+
+
+def start():
+    """start the pool listener from config, returns it"""
+    global pool
+    pool = Pool(config.POOL_NODES, config.POOL_INTERVAL, config.POOL_STICKY)
+    pool.start(config.POOL_STATUS_IP, config.POOL_STATUS_PORT)
+    logging.info(
+        f"Pool: {len(pool.nodes)} irc nodes, status on "
+        f"{config.POOL_STATUS_IP}:{config.POOL_STATUS_PORT}/udp"
+    )
+    return pool
+
+
+def start_reporter():
+    """start reporting this irc node's load from config, returns the reporter"""
+    global reporter
+    name = config.POOL_NAME or config.IRC_HOST or socket.gethostname()
+    reporter = Reporter(name, _address(config.POOL_REPORT_TO), config.POOL_INTERVAL)
+    reporter.start()
+    logging.info(f"Pool: reporting as {name} to {config.POOL_REPORT_TO}")
+    return reporter
+
+
+def stop():
+    global pool, reporter
+    if pool:
+        pool.stop()
+        pool = None
+    if reporter:
+        reporter.stop()
+        reporter = None
@@ -0,0 +1,169 @@
+"""on-demand cpu and memory profiling for a live server
+
+nothing here runs until asked: the cpu sampler is a thread that exists only
+while a profile is being taken, and tracemalloc is started and stopped
+around each memory diff.
+
+    kill -USR1 <pid>   sample all threads for PROFILE_SECONDS
+    kill -USR2 <pid>   start memory tracking; send again to write the diff
+
+the same actions are available over http under /admin/profile/.
+"""
+
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from . import config
+
+_cpu_lock = threading.Lock()
+_mem_lock = threading.Lock()
+_mem_baseline = None
+
+
+def _output_path(kind, suffix):
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    directory = Path(config.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"wormnet-{kind}-{os.getpid()}-{stamp}.{suffix}"
+
+
+def _collapse(frame):
+    """frame stack as "outer;...;inner" for flamegraph tools"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_cpu(seconds, interval=None):
+    """sample every thread's stack for `seconds`, returns {stack: count}"""
+    interval = interval or config.PROFILE_INTERVAL
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            thread = names.get(ident, str(ident))
+            counts[f"{thread};{_collapse(frame)}"] += 1
+        time.sleep(interval)
+    return counts
+
+
+def profile_cpu(seconds=None):
+    """take a cpu profile and write a collapsed-stack file
+
+    returns the output path, or None if a profile is already running.
+    """
+    if not _cpu_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = seconds or config.PROFILE_SECONDS
+        logging.info(f"Profiling: sampling all threads for {seconds}s")
+        counts = sample_cpu(seconds)
+        path = _output_path("cpu", "folded")
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Profiling: wrote {sum(counts.values())} samples to {path}")
+        return path
+    finally:
+        _cpu_lock.release()
+
+
+def start_cpu_profile(seconds=None):
+    """profile_cpu in a background thread; False if one is already running"""
+    if _cpu_lock.locked():
+        return False
+    threading.Thread(
+        target=profile_cpu, args=(seconds,), name="profiler", daemon=True
+    ).start()
+    return True
+
+
+def memory_tracking():
+    """True while a memory diff is in progress"""
+    return _mem_baseline is not None
+
+
+def start_memory():
+    """begin tracing allocations and take the baseline snapshot"""
+    global _mem_baseline
+    with _mem_lock:
+        if _mem_baseline is not None:
+            return False
+        tracemalloc.start(config.PROFILE_MEMORY_FRAMES)
+        _mem_baseline = tracemalloc.take_snapshot()
+    logging.info("Profiling: memory tracking started")
+    return True
+
+
+def stop_memory(limit=50):
+    """diff against the baseline, write the top growth sites, stop tracing
+
+    returns the output path, or None if tracking wasn't started.
+    """
+    global _mem_baseline
+    with _mem_lock:
+        if _mem_baseline is None:
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        baseline, _mem_baseline = _mem_baseline, None
+        tracemalloc.stop()
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ]
+    stats = snapshot.filter_traces(filters).compare_to(
+        baseline.filter_traces(filters), "traceback"
+    )
+    path = _output_path("memory", "txt")
+    with open(path, "w") as f:
+        total = sum(s.size_diff for s in stats)
+        f.write(f"total growth: {total / 1024:.1f} KiB\n\n")
+        for stat in stats[:limit]:
+            f.write(
+                f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks),"
+                f" now {stat.size / 1024:.1f} KiB\n"
+            )
+            for line in stat.traceback.format():
+                f.write(f"  {line}\n")
+            f.write("\n")
+    logging.info(f"Profiling: wrote memory diff to {path}")
+    return path
+
+
+def toggle_memory():
+    """start memory tracking, or finish it if already running"""
+    if memory_tracking():
+        return stop_memory()
+    start_memory()
+    return None
+
+
+def install_signal_handlers():
+    """SIGUSR1 = cpu profile, SIGUSR2 = memory diff toggle (main thread only)"""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    # handlers only hand off to a thread; the work never runs in signal context
+    def on_usr1(signum, frame):
+        start_cpu_profile()
+
+    def on_usr2(signum, frame):
+        threading.Thread(target=toggle_memory, daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_usr1)
+    signal.signal(signal.SIGUSR2, on_usr2)
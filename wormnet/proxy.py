@@ -0,0 +1,171 @@
+"""client addresses from behind a load balancer
+
+a tcp balancer in front of the irc port makes every connection come from
+the balancer. balancers listed in [irc] trusted_proxies must open each
+connection with a PROXY protocol header (v1 text or v2 binary, as sent by
+haproxy's send-proxy / send-proxy-v2 and most cloud balancers); the address
+in it replaces the peer address before the ip filter, admission caps,
+user masks and WHO see it. the header is read byte-exact, so nothing of the
+irc stream behind it is consumed.
+
+for http, X-Forwarded-For is believed only from [http] trusted_proxies:
+walking the header right to left, each hop added by a trusted proxy is
+skipped, and the first untrusted one is the client. that client, not the
+proxy, is what the http listener's per-ip cap counts.
+
+peers not in the lists are taken as they are and any header they send is
+left alone (an irc client sending PROXY just gets an unknown command).
+"""
+
+import logging
+import socket
+import struct
+
+from . import config
+from .ipfilter import DENY, IPFilter
+
+V1_PREFIX = b"PROXY"
+V1_MAX = 107  # longest v1 line, crlf included
+V2_SIGNATURE = b"\r\n\r\n\x00\r\nQUIT\n"
+
+# trusted balancer addresses; rebuilt from config by load()
+irc_trusted = IPFilter(default=DENY)
+http_trusted = IPFilter(default=DENY)
+
+
+def load():
+    """rebuild the trusted proxy lists from config"""
+    global irc_trusted, http_trusted
+    irc_trusted = IPFilter(allow=config.IRC_TRUSTED_PROXIES, default=DENY)
+    http_trusted = IPFilter(allow=config.HTTP_TRUSTED_PROXIES, default=DENY)
+
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ValueError("connection closed in PROXY header")
+        data += chunk
+    return data
+
+
+def _ip(family, text):
+    """text if it is an address of family, else ValueError"""
+    try:
+        socket.inet_pton(family, text)
+    except (OSError, TypeError):
+        raise ValueError(f"bad address in PROXY header: {text!r}") from None
+    return text
+
+
+def parse_v1(line):
+    """(ip, port) from a v1 line, None for PROXY UNKNOWN"""
+    fields = line.decode("ascii", errors="replace").rstrip("\r\n").split(" ")
+    if fields[0] != "PROXY" or len(fields) < 2:
+        raise ValueError(f"bad PROXY v1 header: {line!r}")
+    if fields[1] == "UNKNOWN":
+        return None
+    families = {"TCP4": socket.AF_INET, "TCP6": socket.AF_INET6}
+    if fields[1] not in families or len(fields) != 6:
+        raise ValueError(f"bad PROXY v1 header: {line!r}")
+    port = int(fields[4])
+    if not 0 <= port <= 65535:
+        raise ValueError(f"bad port in PROXY header: {port}")
+    return _ip(families[fields[1]], fields[2]), port
+
+
+def parse_v2(header, body):
+    """(ip, port) from a v2 header and its address block
+
+    None for LOCAL connections (the balancer's own health checks) and for
+    families other than tcp over ipv4/ipv6.
+    """
+    version, command = header[12] >> 4, header[12] & 0x0F
+    if version != 2 or command > 1:
+        raise ValueError(f"bad PROXY v2 version/command: {header[12]:#x}")
+    if command == 0:
+        return None
+    family = header[13]
+    if family == 0x11 and len(body) >= 12:
+        src = socket.inet_ntop(socket.AF_INET, body[:4])
+        (port,) = struct.unpack("!H", body[8:10])
+        return src, port
+    if family == 0x21 and len(body) >= 36:
+        src = socket.inet_ntop(socket.AF_INET6, body[:16])
+        (port,) = struct.unpack("!H", body[32:34])
+        return src, port
+    return None
+
+
+def read_header(sock, timeout):
+    """read one PROXY header (v1 or v2) off sock
+
+    returns the client's (ip, port), or None when the header carries no
+    address. raises ValueError on a malformed header and OSError on a
+    timeout or a dead socket.
+    """
+    sock.settimeout(timeout)
+    try:
+        head = _recv_exact(sock, 5)
+        if head == V1_PREFIX:
+            line = head
+            while not line.endswith(b"\r\n"):
+                if len(line) >= V1_MAX:
+                    raise ValueError("PROXY v1 header too long")
+                line += _recv_exact(sock, 1)
+            return parse_v1(line)
+        header = head + _recv_exact(sock, 11)
+        if not header.startswith(V2_SIGNATURE):
+            raise ValueError("no PROXY header from a trusted proxy")
+        (length,) = struct.unpack("!H", header[14:16])
+        return parse_v2(header, _recv_exact(sock, length))
+    finally:
+        sock.settimeout(None)
+
+
+def forwarded_for(peer, header):
+    """the client behind peer per X-Forwarded-For, trusting only proxies"""
+    ip = peer
+    if not header:
+        return ip
+    for hop in reversed(header.split(",")):
+        if http_trusted.match(ip) is None:
+            break
+        hop = hop.strip()
+        try:
+            ip = _ip(socket.AF_INET6 if ":" in hop else socket.AF_INET, hop)
+        except ValueError:
+            break
+    return ip
+
+
+class ForwardedFor:
+    """wsgi middleware: REMOTE_ADDR from X-Forwarded-For of trusted proxies
+
+    the balancer's own address is kept in environ["wormnet.peer"]; a request
+    that already has it was resolved further out and is passed through.
+    admit, if given, is called with the client address of each request that
+    came through a trusted proxy, and a reason it returns refuses the
+    request with a 503 (the http listener's per-ip cap).
+    """
+
+    def __init__(self, app, admit=None):
+        self.app = app
+        self.admit = admit
+
+    def __call__(self, environ, start_response):
+        if not http_trusted.rules or "wormnet.peer" in environ:
+            return self.app(environ, start_response)
+        peer = environ.get("REMOTE_ADDR")
+        environ["wormnet.peer"] = peer
+        ip = environ["REMOTE_ADDR"] = forwarded_for(
+            peer, environ.get("HTTP_X_FORWARDED_FOR")
+        )
+        if self.admit is not None and http_trusted.match(peer) is not None:
+            reason = self.admit(ip)
+            if reason:
+                logging.warning(f"HTTP: refusing {ip} via {peer}: {reason}")
+                start_response("503 Service Unavailable", [("Content-Length", "0")])
+                return [b""]
+        return self.app(environ, start_response)
@@ -0,0 +1,311 @@
+"""traffic recorder for wormnet
+
+writes every inbound irc line and wormageddonweb http request to a compact
+binary log so real lobby behavior can be replayed against the server later
+(see bench/replay.py).
+
+log layout: an 8-byte magic, the start time as a little-endian double, then
+records of
+
+    kind (u8) | ms since start (u64) | session (u32) | length (u16) | payload
+
+version 1 logs had a u32 ms field, which runs out after 49.7 days of
+recording; read_log still reads them.
+
+irc sessions get an OPEN record carrying the peer ip, one LINE record per
+line received and a CLOSE record. http requests are single HTTP records
+carrying "path?query"; requests from the same client ip share a session.
+"""
+
+import atexit
+import ipaddress
+import logging
+import struct
+import threading
+import time
+
+MAGIC = b"WNREC\x00\x02\n"
+HEADER = struct.Struct("<d")
+RECORD = struct.Struct("<BQIH")
+# older layouts read_log still understands, by magic
+OLD_RECORDS = {b"WNREC\x00\x01\n": struct.Struct("<BIIH")}
+MAX_PAYLOAD = 0xFFFF
+
+OPEN, LINE, CLOSE, HTTP = 1, 2, 3, 4
+KIND_NAMES = {OPEN: "open", LINE: "line", CLOSE: "close", HTTP: "http"}
+
+# active recorder, None when recording is off
+recorder = None
+
+
+class Recorder:
+    """append-only writer for the traffic log"""
+
+    def __init__(self, path, start=None):
+        self.path = path
+        self.start = time.time() if start is None else start
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + HEADER.pack(self.start))
+        self._lock = threading.Lock()
+        self._next_session = 1
+        self._http_sessions = {}
+
+    def _now(self):
+        return time.time()
+
+    def _write(self, kind, session, payload):
+        payload = payload[:MAX_PAYLOAD]
+        ms = max(0, int((self._now() - self.start) * 1000))
+        with self._lock:
+            self._file.write(RECORD.pack(kind, ms, session, len(payload)) + payload)
+
+    def open_session(self, ip):
+        """start an irc session, returns its id"""
+        with self._lock:
+            session = self._next_session
+            self._next_session += 1
+        self._write(OPEN, session, ip.encode())
+        return session
+
+    def line(self, session, line):
+        """one inbound irc line (bytes, without line ending)"""
+        self._write(LINE, session, line)
+
+    def close_session(self, session):
+        self._write(CLOSE, session, b"")
+
+    def http(self, ip, path):
+        """one http request; requests from the same ip share a session id"""
+        with self._lock:
+            session = self._http_sessions.get(ip)
+            if session is None:
+                session = self._http_sessions[ip] = self._next_session
+                self._next_session += 1
+        self._write(HTTP, session, path.encode())
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _flush_loop(rec, interval):
+    while recorder is rec:
+        time.sleep(interval)
+        try:
+            rec.flush()
+        except ValueError:  # closed underneath us
+            return
+
+
+def start(path, flush_interval=1.0):
+    """begin recording to path"""
+    global recorder
+    recorder = Recorder(path)
+    atexit.register(recorder.close)
+    # keep the log useful even if the process is killed without atexit
+    threading.Thread(
+        target=_flush_loop, args=(recorder, flush_interval), daemon=True
+    ).start()
+    logging.info(f"Recording traffic to {path}")
+    return recorder
+
+
+def stop():
+    """stop recording and close the log"""
+    global recorder
+    if recorder:
+        recorder.close()
+        recorder = None
+
+
+def read_log(path):
+    """yield (kind, seconds since start, session, payload) from a log"""
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        layout = RECORD if magic == MAGIC else OLD_RECORDS.get(magic)
+        if layout is None:
+            raise ValueError(f"{path}: not a wormnet traffic log")
+        f.read(HEADER.size)
+        while True:
+            head = f.read(layout.size)
+            if len(head) < layout.size:
+                return
+            kind, ms, session, length = layout.unpack(head)
+            yield kind, ms / 1000, session, f.read(length)
+
+
+class LogWriter(Recorder):
+    """recorder fed with explicit timestamps, used by importers"""
+
+    def __init__(self, path, start):
+        super().__init__(path, start)
+        self.now = start
+
+    def _now(self):
+        return self.now
+
+
+# pcap import
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW = 0, 1, 101
+LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2 = 113, 276
+
+
+def _read_packets(path):
+    """yield (timestamp, linktype, frame) from a classic libpcap file"""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        if magic not in PCAP_MAGIC:
+            raise ValueError(f"{path}: not a libpcap file (pcapng is not supported)")
+        endian, scale = PCAP_MAGIC[magic]
+        _, _, _, _, _, linktype = struct.unpack(f"{endian}HHiIII", f.read(20))
+        rec = struct.Struct(f"{endian}IIII")
+        while True:
+            head = f.read(rec.size)
+            if len(head) < rec.size:
+                return
+            sec, frac, incl, _ = rec.unpack(head)
+            yield sec + frac * scale, linktype, f.read(incl)
+
+
+def _ip_payload(linktype, frame):
+    """strip the link layer; returns (ethertype-ish version, ip packet)"""
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = struct.unpack("!H", frame[12:14])[0]
+        offset = 14
+        if ethertype == 0x8100:  # vlan tag
+            ethertype = struct.unpack("!H", frame[16:18])[0]
+            offset = 18
+        return ethertype, frame[offset:]
+    if linktype == LINKTYPE_LINUX_SLL:
+        return struct.unpack("!H", frame[14:16])[0], frame[16:]
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return struct.unpack("!H", frame[0:2])[0], frame[20:]
+    if linktype == LINKTYPE_NULL:
+        family = struct.unpack("<I", frame[:4])[0]
+        return (0x0800 if family == 2 else 0x86DD), frame[4:]
+    if linktype == LINKTYPE_RAW or linktype == 12:
+        return (0x0800 if frame[0] >> 4 == 4 else 0x86DD), frame
+    return None, b""
+
+
+def _tcp_segment(ethertype, packet):
+    """returns (src, dst, sport, dport, seq, flags, payload) or None"""
+    if ethertype == 0x0800:
+        ihl = (packet[0] & 0x0F) * 4
+        if packet[9] != 6:
+            return None
+        total = struct.unpack("!H", packet[2:4])[0]
+        src = str(ipaddress.IPv4Address(packet[12:16]))
+        dst = str(ipaddress.IPv4Address(packet[16:20]))
+        tcp = packet[ihl:total]
+    elif ethertype == 0x86DD:
+        if packet[6] != 6:  # extension headers are not followed
+            return None
+        length = struct.unpack("!H", packet[4:6])[0]
+        src = str(ipaddress.IPv6Address(packet[8:24]))
+        dst = str(ipaddress.IPv6Address(packet[24:40]))
+        tcp = packet[40 : 40 + length]
+    else:
+        return None
+
+    sport, dport, seq = struct.unpack("!HHI", tcp[:8])
+    offset = (tcp[12] >> 4) * 4
+    flags = tcp[13]
+    return src, dst, sport, dport, seq, flags, tcp[offset:]
+
+
+def import_pcap(pcap_path, log_path, irc_ports=(6667,), http_ports=(80, 8081)):
+    """convert client->server traffic in a pcap into a traffic log
+
+    tcp streams are reassembled per flow by sequence number; retransmitted
+    bytes are dropped. returns a dict of counts.
+    """
+    SYN, FIN, RST = 0x02, 0x01, 0x04
+    flows = {}  # (src, sport, dst, dport) -> [session, next_seq, buffer]
+    counts = {"packets": 0, "irc_sessions": 0, "irc_lines": 0, "http_requests": 0}
+    writer = None
+
+    for ts, linktype, frame in _read_packets(pcap_path):
+        counts["packets"] += 1
+        if writer is None:
+            writer = LogWriter(log_path, ts)
+        writer.now = ts
+
+        ethertype, packet = _ip_payload(linktype, frame)
+        seg = _tcp_segment(ethertype, packet) if packet else None
+        if seg is None:
+            continue
+        src, dst, sport, dport, seq, flags, payload = seg
+        is_irc = dport in irc_ports
+        if not is_irc and dport not in http_ports:
+            continue
+
+        key = (src, sport, dst, dport)
+        flow = flows.get(key)
+        if flow is None:
+            # stragglers after FIN/RST (the last ACK) don't start a new flow
+            if not (flags & SYN or payload):
+                continue
+            session = None
+            if is_irc:
+                session = writer.open_session(src)
+                counts["irc_sessions"] += 1
+            next_seq = (seq + 1) & 0xFFFFFFFF if flags & SYN else seq
+            flow = flows[key] = [session, next_seq, b""]
+
+        if payload:
+            # drop bytes we've already seen (retransmissions)
+            skip = (flow[1] - seq) & 0xFFFFFFFF
+            if skip < len(payload):
+                payload = payload[skip:]
+                flow[1] = (flow[1] + len(payload)) & 0xFFFFFFFF
+                flow[2] += payload
+                if is_irc:
+                    counts["irc_lines"] += _drain_irc(writer, flow)
+                else:
+                    counts["http_requests"] += _drain_http(writer, src, flow)
+
+        if flags & (FIN | RST):
+            if is_irc:
+                writer.close_session(flow[0])
+            del flows[key]
+
+    if writer is None:
+        writer = LogWriter(log_path, 0.0)
+    for flow in flows.values():
+        if flow[0] is not None:
+            writer.close_session(flow[0])
+    writer.close()
+    return counts
+
+
+def _drain_irc(writer, flow):
+    lines = flow[2].split(b"\n")
+    flow[2] = lines.pop()
+    for line in lines:
+        line = line.rstrip(b"\r")
+        if line:
+            writer.line(flow[0], line)
+    return len(lines)
+
+
+def _drain_http(writer, src, flow):
+    found = 0
+    while b"\r\n\r\n" in flow[2]:
+        head, flow[2] = flow[2].split(b"\r\n\r\n", 1)
+        parts = head.split(b"\r\n", 1)[0].split(b" ")
+        if len(parts) == 3 and parts[0] == b"GET":
+            writer.http(src, parts[1].decode("latin-1"))
+            found += 1
+    return found
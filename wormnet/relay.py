@@ -0,0 +1,662 @@
+"""nat relay for hostingbuddy games
+
+players behind cgnat can't accept connections, so a hosted game is
+advertised at the relay instead: each !host gets its own public port, the
+host runs a small agent that dials out to the relay, and joiners connecting
+to the public port are stitched to fresh agent connections.
+
+control protocol (lines on the control port):
+
+    agent -> relay   HOST <token>             claim a session
+    relay -> agent   OK <public port>
+    relay -> agent   CONNECT <id>             a joiner arrived
+    agent -> relay   DATA <token> <id>        connection carrying that joiner
+    agent -> relay   PING <token>             keepalive, every KEEPALIVE secs
+    relay -> agent   PONG
+
+a session is dropped after idle_timeout without game traffic or a PING, so
+a lobby waiting for players stays up as long as its agent does.
+
+after a DATA line the connection is raw game traffic. everything runs on one
+selector thread; on linux bytes move socket -> pipe -> socket with splice(2)
+and never enter python, elsewhere through one reused buffer.
+
+    python -m wormnet.relay agent relay.example.com:17000 <token>
+"""
+
+import argparse
+import logging
+import os
+import secrets
+import selectors
+import socket
+import sys
+import threading
+import time
+
+from . import config
+
+CHUNK = 65536
+MAX_LINE = 256
+KEEPALIVE = 60  # agent PING interval, well inside the default idle_timeout
+SPLICE = sys.platform.startswith("linux") and hasattr(os, "splice")
+
+# running relay, None when the relay is off
+relay = None
+
+
+class BufferPump:
+    """one direction of a link: recv into a shared buffer, send what fits"""
+
+    def __init__(self, src, dst, buf, account):
+        self.src = src
+        self.dst = dst
+        self.buf = buf
+        self.account = account
+        self.pending = b""
+        self.eof = False
+
+    def fill(self):
+        """move one read from src to dst, False on eof"""
+        n = self.src.recv_into(self.buf)
+        if n == 0:
+            return False
+        self.account(n)
+        self.pending = self.buf[:n]
+        self.flush()
+        return True
+
+    def push(self, data):
+        """queue bytes that arrived outside the pump (e.g. after a DATA line)"""
+        self.pending = bytes(self.pending) + data
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.dst.send(self.pending)
+        except BlockingIOError:
+            sent = 0
+        # the shared buffer is reused by the next read, so keep a copy
+        self.pending = bytes(self.pending[sent:])
+
+    def close(self):
+        pass
+
+
+class SplicePump:
+    """one direction of a link through a kernel pipe (zero-copy)"""
+
+    FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+    def __init__(self, src, dst, account):
+        self.src = src
+        self.dst = dst
+        self.account = account
+        self.r, self.w = os.pipe2(os.O_NONBLOCK)
+        self.pending = 0
+        self.eof = False
+
+    def fill(self):
+        try:
+            n = os.splice(self.src.fileno(), self.w, CHUNK, flags=self.FLAGS)
+        except BlockingIOError:
+            return True
+        if n == 0:
+            return False
+        self.account(n)
+        self.pending += n
+        self.flush()
+        return True
+
+    def push(self, data):
+        self.pending += os.write(self.w, data)
+        self.flush()
+
+    def flush(self):
+        try:
+            self.pending -= os.splice(
+                self.r, self.dst.fileno(), self.pending, flags=self.FLAGS
+            )
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+
+class Link:
+    """a joiner stitched to one agent data connection"""
+
+    def __init__(self, session, conn_id, joiner, host, pumps):
+        self.session = session
+        self.id = conn_id
+        self.joiner = joiner
+        self.host = host
+        self.up, self.down = pumps  # joiner -> host, host -> joiner
+
+    def pumps_for(self, sock):
+        """(pump reading from sock, pump writing to sock)"""
+        if sock is self.joiner:
+            return self.up, self.down
+        return self.down, self.up
+
+
+class Session:
+    """one relayed game: a public port, its agent and its joiners"""
+
+    def __init__(self, nick, listener):
+        self.token = secrets.token_hex(8)
+        self.nick = nick
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+        self.game_id = None
+        self.control = None
+        self.created = time.time()
+        self.last_activity = self.created
+        self.bytes_to_host = 0
+        self.bytes_to_joiners = 0
+        self.links = {}
+        self.waiting = {}  # conn id -> (joiner socket, arrival time)
+        self.next_id = 1
+        self.closed = False
+
+    def stats(self):
+        now = time.time()
+        return {
+            "nick": self.nick,
+            "port": self.port,
+            "game_id": self.game_id,
+            "agent": self.control is not None,
+            "joiners": len(self.links),
+            "bytes_to_host": self.bytes_to_host,
+            "bytes_to_joiners": self.bytes_to_joiners,
+            "age": round(now - self.created, 3),
+            "idle": round(now - self.last_activity, 3),
+        }
+
+
+class Relay:
+    """selector loop owning every relay socket"""
+
+    def __init__(
+        self,
+        bind="0.0.0.0",
+        control_port=17000,
+        ports=(17100, 17999),
+        idle_timeout=300,
+        claim_timeout=60,
+        splice=SPLICE,
+        on_close=None,
+    ):
+        self.bind = bind
+        self.ports = ports
+        self.idle_timeout = idle_timeout
+        self.claim_timeout = claim_timeout
+        self.splice = splice
+        self.on_close = on_close
+        self.sessions = {}  # token -> Session
+        self.buf = memoryview(bytearray(CHUNK))
+        self.sel = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.commands = []
+        self.control = socket.create_server((bind, control_port), backlog=128)
+        self.control_port = self.control.getsockname()[1]
+        self.control.setblocking(False)
+        self.sel.register(self.control, selectors.EVENT_READ, ("control", None))
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ, ("wake", None))
+        self._next_port = ports[0] if ports else 0
+        self._stop = False
+        self._thread = None
+
+    # api for other threads
+
+    def allocate(self, nick):
+        """open a public port for nick's game, returns the Session"""
+        listener = self._bind_public()
+        listener.setblocking(False)
+        session = Session(nick, listener)
+        self._call(self._add_session, session)
+        logging.info(f"Relay: {nick} gets port {session.port}")
+        return session
+
+    def release(self, token):
+        """tear a session down (game closed)"""
+        self._call(self._release, token)
+
+    def stats(self):
+        with self.lock:
+            return [s.stats() for s in self.sessions.values()]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="relay", daemon=True)
+        self._thread.start()
+        logging.info(f"Relay: control port {self.control_port}")
+
+    def stop(self):
+        self._stop = True
+        self._wake()
+        if self._thread:
+            self._thread.join()
+
+    def _call(self, fn, *args):
+        with self.lock:
+            self.commands.append((fn, args))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _bind_public(self):
+        if not self.ports:
+            return socket.create_server((self.bind, 0), backlog=16)
+        low, high = self.ports
+        with self.lock:
+            used = {s.port for s in self.sessions.values()}
+            for _ in range(high - low + 1):
+                port = self._next_port
+                self._next_port = low if port >= high else port + 1
+                if port in used:
+                    continue
+                try:
+                    return socket.create_server((self.bind, port), backlog=16)
+                except OSError:
+                    continue
+        raise OSError("relay: no free public port")
+
+    # selector thread
+
+    def run(self):
+        last_sweep = time.monotonic()
+        while not self._stop:
+            for key, mask in self.sel.select(timeout=1.0):
+                kind, obj = key.data
+                try:
+                    if kind == "control":
+                        self._accept_control()
+                    elif kind == "wake":
+                        self._drain_wake()
+                    elif kind == "public":
+                        self._accept_joiner(obj)
+                    elif kind == "pending":
+                        self._read_control_line(key.fileobj, obj)
+                    elif kind == "link":
+                        self._service_link(obj, key.fileobj, mask)
+                except OSError as e:
+                    logging.debug(f"Relay: {kind} error: {e}")
+                    if kind == "link":
+                        self._close_link(obj)
+                    elif kind == "pending":
+                        self._drop_control(key.fileobj)
+            with self.lock:
+                commands, self.commands = self.commands, []
+            for fn, args in commands:
+                fn(*args)
+            if time.monotonic() - last_sweep >= 1.0:
+                last_sweep = time.monotonic()
+                self._sweep()
+
+        for session in list(self.sessions.values()):
+            self._close_session(session, "relay stopped")
+        self.sel.close()
+        self.control.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _add_session(self, session):
+        with self.lock:
+            self.sessions[session.token] = session
+        self.sel.register(session.listener, selectors.EVENT_READ, ("public", session))
+
+    def _release(self, token):
+        session = self.sessions.get(token)
+        if session:
+            self._close_session(session, "released", notify=False)
+
+    def _accept_control(self):
+        while True:
+            try:
+                conn, _ = self.control.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            # [line buffer, accepted at, claimed a session as its control]
+            self.sel.register(
+                conn, selectors.EVENT_READ, ("pending", [b"", time.time(), False])
+            )
+
+    def _drop_pending(self, conn):
+        self.sel.unregister(conn)
+        conn.close()
+
+    def _read_control_line(self, conn, state):
+        data = conn.recv(MAX_LINE)
+        if not data:
+            self._drop_control(conn)
+            return
+        state[0] += data
+        if b"\n" not in state[0]:
+            if len(state[0]) > MAX_LINE:
+                self._drop_control(conn)
+            return
+        line, rest = state[0].split(b"\n", 1)
+        state[0] = b""
+        parts = line.decode("ascii", errors="replace").split()
+
+        session = self.sessions.get(parts[1]) if len(parts) > 1 else None
+        if parts[:1] == ["HOST"] and session and session.control is None:
+            session.control = conn
+            session.last_activity = time.time()
+            state[2] = True
+            conn.sendall(f"OK {session.port}\n".encode())
+            logging.info(f"Relay: agent for {session.nick} connected")
+        elif parts[:1] == ["DATA"] and session and len(parts) == 3:
+            waiting = (
+                session.waiting.pop(int(parts[2]), None) if parts[2].isdigit() else None
+            )
+            self.sel.unregister(conn)
+            if waiting is None:
+                conn.close()
+                return
+            self._link(session, int(parts[2]), waiting[0], conn, rest)
+        elif parts[:1] == ["PING"] and session and conn is session.control:
+            session.last_activity = time.time()
+            try:
+                conn.sendall(b"PONG\n")
+            except OSError:
+                self._close_session(session, "agent unreachable")
+        elif session and conn is session.control:
+            pass  # nothing else is expected on the control connection
+        else:
+            self._drop_control(conn)
+
+    def _drop_control(self, conn):
+        for session in list(self.sessions.values()):
+            if session.control is conn:
+                self._close_session(session, "agent disconnected")
+                return
+        self._drop_pending(conn)
+
+    def _accept_joiner(self, session):
+        while True:
+            try:
+                joiner, addr = session.listener.accept()
+            except BlockingIOError:
+                return
+            if session.control is None:
+                joiner.close()
+                continue
+            joiner.setblocking(False)
+            conn_id = session.next_id
+            session.next_id += 1
+            session.waiting[conn_id] = (joiner, time.time())
+            session.last_activity = time.time()
+            try:
+                session.control.send(f"CONNECT {conn_id}\n".encode())
+            except OSError:
+                self._close_session(session, "agent unreachable")
+                return
+            logging.debug(f"Relay: joiner {addr[0]} for {session.nick} (#{conn_id})")
+
+    def _link(self, session, conn_id, joiner, host, early):
+        def to_host(n):
+            session.bytes_to_host += n
+            session.last_activity = time.time()
+
+        def to_joiners(n):
+            session.bytes_to_joiners += n
+            session.last_activity = time.time()
+
+        if self.splice:
+            pumps = (
+                SplicePump(joiner, host, to_host),
+                SplicePump(host, joiner, to_joiners),
+            )
+        else:
+            pumps = (
+                BufferPump(joiner, host, self.buf, to_host),
+                BufferPump(host, joiner, self.buf, to_joiners),
+            )
+        link = Link(session, conn_id, joiner, host, pumps)
+        session.links[conn_id] = link
+        if early:
+            # game bytes the agent sent right behind its DATA line
+            to_joiners(len(early))
+            link.down.push(early)
+        self._update(link)
+
+    def _service_link(self, link, sock, mask):
+        reader, writer = link.pumps_for(sock)
+        if mask & selectors.EVENT_WRITE and writer.pending:
+            writer.flush()
+            if writer.eof and not writer.pending:
+                writer.dst.shutdown(socket.SHUT_WR)
+        if mask & selectors.EVENT_READ and not reader.pending and not reader.eof:
+            if not reader.fill():
+                reader.eof = True
+                if not reader.pending:
+                    reader.dst.shutdown(socket.SHUT_WR)
+        if (
+            link.up.eof
+            and link.down.eof
+            and not link.up.pending
+            and not link.down.pending
+        ):
+            self._close_link(link)
+            return
+        self._update(link)
+
+    def _update(self, link):
+        """register each socket for what its pumps are waiting on"""
+        for sock in (link.joiner, link.host):
+            reader, writer = link.pumps_for(sock)
+            events = 0
+            if not reader.eof and not reader.pending:
+                events |= selectors.EVENT_READ
+            if writer.pending:
+                events |= selectors.EVENT_WRITE
+            registered = self._is_registered(sock)
+            if events and registered:
+                self.sel.modify(sock, events, ("link", link))
+            elif events:
+                self.sel.register(sock, events, ("link", link))
+            elif registered:
+                self.sel.unregister(sock)
+
+    def _is_registered(self, sock):
+        try:
+            self.sel.get_key(sock)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def _close_link(self, link):
+        if link.session.links.pop(link.id, None) is None:
+            return
+        for sock in (link.joiner, link.host):
+            if self._is_registered(sock):
+                self.sel.unregister(sock)
+            sock.close()
+        link.up.close()
+        link.down.close()
+
+    def _close_session(self, session, reason, notify=True):
+        if session.closed:
+            return
+        session.closed = True
+        logging.info(
+            f"Relay: closing {session.nick} port {session.port} ({reason}),"
+            f" {session.bytes_to_host}B up / {session.bytes_to_joiners}B down"
+        )
+        for link in list(session.links.values()):
+            self._close_link(link)
+        for joiner, _ in session.waiting.values():
+            joiner.close()
+        session.waiting.clear()
+        for sock in (session.listener, session.control):
+            if sock is not None:
+                if self._is_registered(sock):
+                    self.sel.unregister(sock)
+                sock.close()
+        with self.lock:
+            self.sessions.pop(session.token, None)
+        if notify and self.on_close:
+            try:
+                self.on_close(session)
+            except Exception:
+                logging.exception("Relay: on_close failed")
+
+    def _sweep(self):
+        """drop idle sessions, unclaimed sessions and joiners the agent ignored"""
+        now = time.time()
+        for session in list(self.sessions.values()):
+            if session.control is None and now - session.created > self.claim_timeout:
+                self._close_session(session, "agent never connected")
+            elif now - session.last_activity > self.idle_timeout:
+                self._close_session(session, "idle")
+            else:
+                for conn_id, (joiner, since) in list(session.waiting.items()):
+                    if now - since > self.claim_timeout:
+                        del session.waiting[conn_id]
+                        joiner.close()
+        for key in list(self.sel.get_map().values()):
+            kind, state = key.data
+            if (
+                kind == "pending"
+                and not state[2]
+                and now - state[1] > self.claim_timeout
+            ):
+                self._drop_pending(key.fileobj)
+
+
+def start(on_close=None):
+    """start the relay from config, returns it"""
+    global relay
+    relay = Relay(
+        control_port=config.RELAY_CONTROL_PORT,
+        ports=(config.RELAY_PORT_MIN, config.RELAY_PORT_MAX),
+        idle_timeout=config.RELAY_IDLE_TIMEOUT,
+        claim_timeout=config.RELAY_CLAIM_TIMEOUT,
+        on_close=on_close,
+    )
+    relay.start()
+    return relay
+
+
+def stop():
+    global relay
+    if relay:
+        relay.stop()
+        relay = None
+
+
+# host side
+
+
+def _pipe(src, dst):
+    try:
+        while True:
+            data = src.recv(CHUNK)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def _serve_joiner(server, token, conn_id, local):
+    try:
+        data = socket.create_connection(server)
+        data.sendall(f"DATA {token} {conn_id}\n".encode())
+        game = socket.create_connection(local)
+    except OSError as e:
+        logging.warning(f"Relay agent: joiner #{conn_id} failed: {e}")
+        return
+    threading.Thread(target=_pipe, args=(game, data), daemon=True).start()
+    _pipe(data, game)
+
+
+def _keepalive(ctl, token, interval, done):
+    while not done.wait(interval):
+        try:
+            ctl.sendall(f"PING {token}\n".encode())
+        except OSError:
+            return
+
+
+def run_agent(
+    server, token, local=("127.0.0.1", 17011), ready=None, keepalive=KEEPALIVE
+):
+    """connect a local game to the relay until the relay hangs up
+
+    server and local are (host, port); ready(port) is called once the relay
+    has accepted the token. a PING goes out every keepalive seconds so a
+    lobby without joiners isn't dropped as idle.
+    """
+    ctl = socket.create_connection(server)
+    ctl.sendall(f"HOST {token}\n".encode())
+    lines = ctl.makefile("rb")
+    reply = lines.readline().decode().split()
+    if reply[:1] != ["OK"]:
+        raise ConnectionError(f"relay refused token: {' '.join(reply)}")
+    logging.info(f"Relay agent: game reachable on relay port {reply[1]}")
+    if ready:
+        ready(int(reply[1]))
+    done = threading.Event()
+    threading.Thread(
+        target=_keepalive, args=(ctl, token, keepalive, done), daemon=True
+    ).start()
+    try:
+        for raw in lines:
+            parts = raw.decode().split()
+            if parts[:1] == ["CONNECT"] and len(parts) == 2:
+                threading.Thread(
+                    target=_serve_joiner,
+                    args=(server, token, parts[1], local),
+                    daemon=True,
+                ).start()
+    finally:
+        done.set()
+        ctl.close()
+
+
+def _address(text, default_port):
+    host, _, port = text.rpartition(":")
+    if not host:
+        return text, default_port
+    return host, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="wormnet nat relay agent")
+    sub = parser.add_subparsers(dest="command", required=True)
+    agent = sub.add_parser("agent", help="expose a local game through a relay")
+    agent.add_argument("server", help="relay control address host[:port]")
+    agent.add_argument("token", help="token HostingBuddy gave you")
+    agent.add_argument("--local", default="127.0.0.1:17011", help="local game address")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    run_agent(_address(args.server, 17000), args.token, _address(args.local, 17011))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,266 @@
-"""shared state for wormnet server"""
+"""shared state for wormnet server
+
+readers never take a lock. each shared collection publishes an immutable
+snapshot (a tuple) through a single attribute; writers build the next one
+under the collection's own lock and swap it in with one assignment, which is
+atomic with or without the GIL. a reader that iterates while a writer swaps
+simply sees the state from just before the change.
+
+membership is sharded per channel: every channel has its own member
+snapshot and lock, so joins, parts and broadcasts in different channels
+never touch the same structure.
+"""
 
 import threading
 
-# game storage
+
+class SnapshotSet:
+    """set of objects published as an immutable tuple (copy on write)"""
+
+    __slots__ = ("items", "index", "lock")
+
+    def __init__(self, items=()):
+        self.index = dict.fromkeys(items)  # ordered, for O(1) `in`
+        self.items = tuple(self.index)
+        self.lock = threading.Lock()
+
+    def add(self, item):
+        with self.lock:
+            if item not in self.index:
+                self.index[item] = None
+                self.items = self.items + (item,)
+
+    def discard(self, item):
+        with self.lock:
+            if item in self.index:
+                del self.index[item]
+                self.items = tuple(self.index)
+
+    def remove(self, item):
+        if item not in self.index:
+            raise ValueError(f"{item!r} not in set")
+        self.discard(item)
+
+    def clear(self):
+        with self.lock:
+            self.index = {}
+            self.items = ()
+
+    def snapshot(self):
+        return self.items
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.items)!r})"
+
+
+class ClientRegistry(SnapshotSet):
+    """registered clients in join order, with a nick index
+
+    list-like (append/remove) since that's what it replaced. adding or
+    removing a client also adds it to, or drops it from, the member
+    snapshot of every channel in client.channels.
+
+    two clients can share a nick (a nick collision in progress, or a
+    node-local service), so the index maps a nick to its client or to a
+    tuple of them in join order, and find() returns the first one, as the
+    list scan it replaced did.
+    """
+
+    __slots__ = ("nicks",)
+
+    def __init__(self):
+        super().__init__()
+        self.nicks = {}
+
+    def append(self, client):
+        self.add(client)
+
+    def add(self, client):
+        with self.lock:
+            if client in self.index:
+                return
+            self.index[client] = None
+            self.items = self.items + (client,)
+            if client.nickname:
+                self._hold(client.nickname, client)
+        for channame in client.channels:
+            _member_set(channame, SnapshotSet.add, client)
+
+    def discard(self, client):
+        with self.lock:
+            if client not in self.index:
+                return
+            del self.index[client]
+            self.items = tuple(self.index)
+            self._release(client.nickname, client)
+        for channame in client.channels:
+            _member_set(channame, SnapshotSet.discard, client)
+
+    def clear(self):
+        with self.lock:
+            old = self.items
+            self.index = {}
+            self.items = ()
+            self.nicks = {}
+        for client in old:
+            for channame in client.channels:
+                _member_set(channame, SnapshotSet.discard, client)
+
+    def rename(self, client, old, new):
+        with self.lock:
+            if client in self.index:
+                self._release(old, client)
+                self._hold(new, client)
+
+    def _hold(self, nick, client):
+        held = self.nicks.get(nick)
+        if held is None:
+            self.nicks[nick] = client
+            return
+        holders = (held if type(held) is tuple else (held,)) + (client,)
+        order = {c: i for i, c in enumerate(self.index)}  # only on a clash
+        self.nicks[nick] = tuple(sorted(holders, key=order.__getitem__))
+
+    def _release(self, nick, client):
+        held = self.nicks.get(nick)
+        if held is client:
+            del self.nicks[nick]
+        elif type(held) is tuple and client in held:
+            rest = tuple(c for c in held if c is not client)
+            self.nicks[nick] = rest if len(rest) > 1 else rest[0]
+
+    def find(self, nick):
+        """registered client by nickname (the first to take it), or None"""
+        client = self.nicks.get(nick)
+        if type(client) is tuple:
+            client = client[0]
+        if client is not None and client.nickname == nick:
+            return client
+        return None
+
+
+class ChannelSet:
+    """the channels one client is in
+
+    clients sit in one or two channels, so a tuple beats a set (216 bytes
+    empty) by a wide margin at tens of thousands of idle clients. when the
+    owner is registered, changes are mirrored into the channel's member
+    snapshot so broadcasts only visit members.
+    """
+
+    __slots__ = ("names", "owner")
+
+    def __init__(self, owner=None, names=()):
+        self.owner = owner
+        self.names = tuple(names)
+
+    def add(self, name):
+        if name not in self.names:
+            self.names += (name,)
+            if self.owner is not None and self.owner in irc_clients:
+                _member_set(name, SnapshotSet.add, self.owner)
+
+    def discard(self, name):
+        if name in self.names:
+            self.names = tuple(n for n in self.names if n != name)
+            if self.owner is not None:
+                _member_set(name, SnapshotSet.discard, self.owner)
+
+    def remove(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        self.discard(name)
+
+    def clear(self):
+        for name in self.names:
+            self.discard(name)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __and__(self, other):
+        return set(self.names) & set(other)
+
+    __rand__ = __and__
+
+    def __eq__(self, other):
+        if isinstance(other, ChannelSet):
+            other = other.names
+        return set(self.names) == set(other)
+
+    def __repr__(self):
+        return f"ChannelSet({self.names!r})"
+
+
+def _member_set(channame, op, client):
+    """apply op to a channel's member set; unknown channels have none"""
+    chan = irc_channels.get(channame)
+    if chan is not None:
+        op(chan["members"], client)
+
+
+def members(channame):
+    """registered clients in a channel, as an immutable snapshot"""
+    chan = irc_channels.get(channame)
+    return chan["members"].items if chan is not None else ()
+
+
+def remote_members(channame):
+    """users on other nodes in a channel (see federation)"""
+    chan = irc_channels.get(channame)
+    return chan["remote"].items if chan is not None else ()
+
+
+def drop_user(channame, nick):
+    """take a nick out of a channel's NAMES, unless someone else holds it there
+
+    after a nick collision the loser and the winner briefly share the nick.
+    """
+    chan = irc_channels.get(channame)
+    holder = irc_clients.find(nick)
+    if chan is not None and (holder is None or channame not in holder.channels):
+        chan["users"].discard(nick)
+
+
+def new_channel(topic):
+    """the per-channel record in irc_channels"""
+    return {
+        "users": SnapshotSet(),  # nicks, for NAMES and LIST
+        "members": SnapshotSet(),  # local registered clients
+        "remote": SnapshotSet(),  # federation.RemoteClient
+        "topic": topic,
+    }
+
+
+# game storage (writes hold games_lock; reads go through games.py snapshots)
 games = {}
 game_counter = 0
 games_lock = threading.Lock()
+game_hosts = {}  # irc client -> ids of the games bound to its session
+game_sessions = {}  # game id -> that client
+game_creators = {}  # id of each game listed here -> address it came from
 
 # irc state
-irc_clients = []
-irc_channels = {}
+irc_clients = ClientRegistry()  # registered clients
+irc_connections = SnapshotSet()  # every live connection, registered or not
+irc_channels = {}  # name -> new_channel()
+# no longer taken on the message path; kept for callers that batch changes
 irc_lock = threading.Lock()
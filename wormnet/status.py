@@ -0,0 +1,189 @@
+"""who's in the lobby, for /status and /status.json
+
+the aggregates (users per channel, countries and ranks from the realname
+field "flags rank country version") are kept up to date from the event bus
+on registration, join, part and quit, so building a page never walks the
+client list and never takes a state lock. the rendered json and html are
+cached and rebuilt at most once per STATUS_MAX_AGE; while one request
+rebuilds, others get the previous copy.
+
+irc users only show up when the irc server runs in this process (--role all);
+game counts come from the game table either way.
+"""
+
+import collections
+import html
+import json
+import threading
+import time
+
+from . import config, events, games, state
+
+TOP = 20  # countries and ranks listed
+
+# active lobby view, None when the status page is off
+lobby = None
+
+
+def parse_realname(realname):
+    """(rank, country) from "flags rank country version", None if missing"""
+    parts = (realname or "").split(" ")
+    rank = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+    country = parts[2][:8] if len(parts) > 2 and parts[2] else None
+    return rank, country
+
+
+class Lobby:
+    """incremental lobby aggregates and a cached rendering of them"""
+
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self.lock = threading.Lock()  # the aggregates; never a state lock
+        self.users = {}  # client -> (rank, country)
+        self.channels = collections.defaultdict(dict)  # name -> {client: None}
+        self.countries = collections.Counter()
+        self.ranks = collections.Counter()
+        self.rebuilding = threading.Lock()
+        self.built = 0.0
+        self.cached = (None, None, None)  # data, json bytes, html
+        self.rebuilds = 0
+
+    def _add(self, client):
+        if client in self.users:
+            return
+        rank, country = self.users[client] = parse_realname(client.realname)
+        self.ranks[rank] += 1
+        self.countries[country] += 1
+
+    def _remove(self, client, channels):
+        for name in channels:
+            self.channels[name].pop(client, None)
+        info = self.users.pop(client, None)
+        if info is not None:
+            for counter, key in zip((self.ranks, self.countries), info):
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+
+    def apply(self, batch):
+        """event bus subscriber"""
+        with self.lock:
+            for event in batch:
+                kind = type(event)
+                if kind is events.ChannelJoined:
+                    self._add(event.client)
+                    self.channels[event.channel][event.client] = None
+                elif kind is events.ChannelParted:
+                    self.channels[event.channel].pop(event.client, None)
+                elif kind is events.UserRegistered:
+                    self._add(event.client)
+                elif kind is events.UserQuit:
+                    self._remove(event.client, event.channels)
+
+    def seed(self):
+        """count the users registered before we subscribed"""
+        with self.lock:
+            for client in state.irc_clients.snapshot():
+                self._add(client)
+                for name in client.channels:
+                    self.channels[name][client] = None
+
+    def start(self):
+        events.subscribe(
+            self.apply,
+            events.UserRegistered,
+            events.UserQuit,
+            events.ChannelJoined,
+            events.ChannelParted,
+        )
+        self.seed()
+
+    def stop(self):
+        events.unsubscribe(self.apply)
+
+    def build(self):
+        """the status as plain data"""
+        _, by_channel = games.snapshot()
+        with self.lock:
+            channels = {
+                name: [c.nickname for c in self.channels.get(name, ())]
+                for name in state.irc_channels
+            }
+            users = len(self.users)
+            countries = self.countries.most_common(TOP)
+            ranks = self.ranks.most_common(TOP)
+        return {
+            "generated": time.time(),
+            "users": users,
+            "games": sum(len(g) for g in by_channel.values()),
+            "channels": [
+                {
+                    "name": name,
+                    "topic": state.irc_channels[name]["topic"],
+                    "users": sorted(nicks, key=str.lower),
+                    "games": len(by_channel.get(name.lstrip("#"), ())),
+                }
+                for name, nicks in channels.items()
+            ],
+            "countries": {k or "??": n for k, n in countries},
+            "ranks": {"?" if k is None else str(k): n for k, n in ranks},
+        }
+
+    def snapshot(self):
+        """(data, json bytes, html), rebuilt if older than max_age"""
+        if time.monotonic() - self.built < self.max_age:
+            return self.cached
+        if not self.rebuilding.acquire(blocking=False):
+            if self.cached[0] is not None:
+                return self.cached  # someone's already on it
+            self.rebuilding.acquire()
+        try:
+            if time.monotonic() - self.built >= self.max_age:
+                data = self.build()
+                self.cached = (data, json.dumps(data).encode(), render(data))
+                self.built = time.monotonic()
+                self.rebuilds += 1
+            return self.cached
+        finally:
+            self.rebuilding.release()
+
+
+def _table(title, counts):
+    rows = "".join(
+        f"<tr><td>{html.escape(k)}</td><td>{n}</td></tr>" for k, n in counts.items()
+    )
+    return f"<h2>{title}</h2><table>{rows}</table>"
+
+
+def render(data):
+    """the status page as html"""
+    channels = "".join(
+        f"<h2>{html.escape(c['name'])} ({len(c['users'])} users,"
+        f" {c['games']} games)</h2><p><i>{html.escape(c['topic'])}</i></p>"
+        f"<p>{html.escape(' '.join(c['users'])) or '-'}</p>"
+        for c in data["channels"]
+    )
+    generated = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(data["generated"]))
+    return (
+        "<html><head><title>WormNET status</title>"
+        '<meta http-equiv="refresh" content="30"></head><body>'
+        f"<h1>WormNET: {data['users']} online, {data['games']} games</h1>"
+        f"{channels}{_table('Countries', data['countries'])}"
+        f"{_table('Ranks', data['ranks'])}"
+        f"<p><small>as of {generated} UTC</small></p></body></html>"
+    )
+
+
+def start():
+    """start the lobby view from config, returns it"""
+    global lobby
+    lobby = Lobby(config.STATUS_MAX_AGE)
+    lobby.start()
+    return lobby
+
+
+def stop():
+    global lobby
+    if lobby:
+        lobby.stop()
+        lobby = None
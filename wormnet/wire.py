@@ -0,0 +1,42 @@
+"""text on the irc wire
+
+WA sends its text in the windows codepage (cp1252), not utf-8; decoding it
+as utf-8 dropped every accented character. with [irc] raw on (the default)
+lines are decoded as latin-1 instead, which maps each byte to the code point
+of the same value: nothing is lost, commands and targets parse as before,
+and encoding back to latin-1 gives the received bytes exactly, so message
+payloads reach other players (and other nodes) byte for byte. both
+directions are a plain copy in CPython, cheaper than the utf-8 codec.
+
+our own text (motd, topics) is real unicode, so it's put in the game's
+codepage first with local().
+"""
+
+from . import config
+
+
+def decode(raw):
+    """bytes read from a client as a line str"""
+    if config.IRC_RAW:
+        return raw.decode("latin-1")
+    return raw.decode("utf-8", errors="ignore")
+
+
+def encode(text):
+    """a line str back to bytes"""
+    if config.IRC_RAW:
+        # only local() text can hold anything past U+00FF, and it doesn't
+        return text.encode("latin-1", errors="replace")
+    return text.encode("utf-8")
+
+
+def line(msg):
+    """one line to send, with its crlf"""
+    return encode(f"{msg}\r\n")
+
+
+def local(text):
+    """text of ours as the game will show it"""
+    if config.IRC_RAW:
+        return text.encode(config.IRC_CODEPAGE, errors="replace").decode("latin-1")
+    return text